@@ -2,12 +2,15 @@ import argparse
 import logging
 import sys
 
+import composer.batch as batch
 import composer.execution as execution
+import composer.mapfile as mapfile
 import composer.mapremote as mapremote
 import composer.maptarget as maptarget
 import composer.parser as parser
+import composer.remotecache as remotecache
 import composer.rules as rules
-import composer.util as util
+import composer.rulesfile as rulesfile
 
 
 def func_mapper(args: argparse.Namespace) -> None:
@@ -19,22 +22,40 @@ def func_mapper(args: argparse.Namespace) -> None:
     """
 
     if args.action == 'direct':
-        cmds = rules.create_ruleset(args)
-        execution.apply_rules(cmds, args.threads, args.real_run)
+        if args.previous_rules:
+            cmds, state = rules.create_delta_ruleset(args, rules.load_previous_rules(args.previous_rules))
+        else:
+            cmds = rules.create_ruleset(args)
+        execution.apply_rules(cmds, args.threads, args.real_run, args.exec_mode)
+        if args.previous_rules and args.real_run:
+            rulesfile.save_rules(state, args.previous_rules, args.rules_format)
     elif args.action == 'fromrules':
-        cmds = util.load_from_json(args.input_file)
-        execution.apply_rules(cmds, args.threads, args.real_run)
+        rules_format = rulesfile.detect_format(args.input_file) if args.rules_format == 'auto' else args.rules_format
+        if rules_format == 'ndjson':
+            commands = rulesfile.iter_commands(args.input_file, rules_format)
+            execution.apply_rules_stream(commands, args.threads, args.real_run, args.exec_mode)
+        else:
+            cmds = rulesfile.load_rules(args.input_file, rules_format)
+            execution.apply_rules(cmds, args.threads, args.real_run, args.exec_mode)
     elif args.action == 'saverules':
-        cmds = rules.create_ruleset(args)
-        util.save_to_json(cmds, args.output_file)
+        if args.previous_rules:
+            cmds, _ = rules.create_delta_ruleset(args, rules.load_previous_rules(args.previous_rules))
+        else:
+            cmds = rules.create_ruleset(args)
+        rulesfile.save_rules(cmds, args.output_file, args.rules_format)
     elif args.action == 'maprepo':
-        src_repo = maptarget.map_target(args.src_repo, args)
-        util.save_to_json(src_repo, args.output_file)
+        map_format = mapfile.resolve_format(args.output_file, args.map_format)
+        stamp = maptarget.create_stamp(args.src_repo, args) if map_format != 'json' else None
+        mapfile.save_map(maptarget.iter_target(args.src_repo, args, stamp), args.output_file, map_format, stamp)
+    elif args.action == 'batch':
+        batch.run_batch(batch.load_manifest(args.manifest, args), args)
     elif args.action == 'fakerepo':
-        repo = util.load_from_json(args.input_file)
-        execution.create_local_repo_script(repo, args.bash_output)
+        execution.create_local_repo_script(mapfile.iter_elems(args.input_file), args.bash_output)
     elif args.action == 'fakeremote':
-        mapremote.write_repo_tree_shell(args.input_url, args.bash_output)
+        cache = (remotecache.ListingCache(args.listing_cache, args.full_rescan, args.skip_unchanged)
+                 if args.listing_cache else None)
+        mapremote.write_repo_tree_shell(args.input_url, args.bash_output, args.threads, args.html_parser, cache,
+                                        args.repodata)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,285 @@
+"""
+Batch composition - several (src, dst) jobs of a manifest composed at once.
+
+A manifest is a json list of jobs, each of them a dictionary of `direct` options (by their long names, values as on
+the command line or as json lists/booleans, replacements also as a dictionary), e.g.:
+
+    [
+        {"src_repo": "/mirror/redhat8/", "dst_repo": "/srv/eurolinux8/", "replacements": {"CodeReady": "PowerTools"}},
+        {"src_map": "redhat9.idx", "dst_repo": "/srv/eurolinux9/", "repo_priority": ["BaseOS", "AppStream"],
+         "custom_rules_file": "el9.conf"}
+    ]
+
+Mapping options missing in a job are taken from the batch command line. Threads, real run, exec mode, the map
+cache and the listing cache (of remote sources, see mapremote.map_remote) are shared by all the jobs. Every
+distinct tree (and mapping options) is mapped just once - all the trees in a single pool of workers - rulesets
+of the jobs are created in parallel and applied in a single executor as soon as they are ready.
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import typing as t
+
+import composer.execution as execution
+import composer.mapindex as mapindex
+import composer.mapremote as mapremote
+import composer.maptarget as maptarget
+import composer.parser as parser
+import composer.rules as rules
+import composer.rulesfile as rulesfile
+from composer.composer_types import CommandsDataType
+from composer.remotecache import ListingCache
+from composer.repomap import RepoElem
+
+# options a job can set (long names of `direct` options)
+JOB_OPTIONS = ('src_repo', 'src_map', 'dst_repo', 'repo_priority', 'archs', 'skip_dirs', 'mask', 'include_beta',
+               'include_extra', 'move_debug', 'os_dir', 'debug_dir', 'all_dir', 'custom_rules_file', 'replacements',
+               'previous_rules', 'rules_format', 'skip_existing', 'repodata')
+# options taken from the batch command line unless set by a job
+_INHERITED_OPTIONS = ('repo_priority', 'archs', 'skip_dirs', 'mask', 'include_beta', 'include_extra', 'repodata')
+# options shared by all the jobs
+_SHARED_OPTIONS = ('threads', 'real_run', 'exec_mode', 'map_cache', 'full_rescan', 'listing_cache', 'skip_unchanged')
+
+# jobs and their maps, inherited by forked ruleset workers (see _ruleset_pool)
+_pool_jobs: list[tuple[argparse.Namespace, rules.MappedReposType]] = []
+
+
+def load_manifest(filename: str, args: argparse.Namespace) -> list[argparse.Namespace]:
+    """
+    Load jobs of a manifest.
+
+    Args:
+        filename: manifest file
+        args: argparse object of the batch (requires: <_INHERITED_OPTIONS>, <_SHARED_OPTIONS>)
+
+    Returns:
+        argparse objects of the jobs (as if each of them was a `direct` command line)
+
+    Raises:
+        ValueError: if the manifest is not a list of valid jobs
+    """
+
+    with open(filename) as manifest:
+        content = json.load(manifest)
+    if not isinstance(content, list) or not all(isinstance(job, dict) for job in content):
+        raise ValueError(f'Manifest {filename} is not a list of jobs')
+    jobs = []
+    for i, job in enumerate(content):
+        unknown = sorted(set(job) - set(JOB_OPTIONS))
+        if unknown:
+            raise ValueError(f'Job {i} of {filename}: unknown options {", ".join(unknown)}')
+        if 'dst_repo' not in job or ('src_repo' in job) == ('src_map' in job):
+            raise ValueError(f'Job {i} of {filename}: dst_repo and either src_repo or src_map are required')
+        argv = ['direct']
+        for name, value in job.items():
+            argv += [f'--{name}', _option_value(value)]
+        job_args = parser.parse_args(argv)
+        for name in _INHERITED_OPTIONS:
+            if name not in job:
+                setattr(job_args, name, getattr(args, name))
+        for name in _SHARED_OPTIONS:
+            setattr(job_args, name, getattr(args, name))
+        jobs.append(job_args)
+    return jobs
+
+
+def run_batch(jobs: list[argparse.Namespace], args: argparse.Namespace) -> None:
+    """
+    Compose all the jobs - map their trees (see map_jobs), create their rulesets in parallel (see _ruleset_pool)
+    and apply them in a single executor (see execution.apply_rulesets). Rulesets of jobs with the same (or nested)
+    destination are merged and applied together, in order of the jobs, so they never race each other.
+    Previous rules of jobs are updated after a real run (as by `direct`).
+
+    Args:
+        jobs: argparse objects of the jobs (see load_manifest)
+        args: argparse object of the batch (requires: threads, real_run, exec_mode + <map_targets requirements>)
+    """
+
+    mapped = map_jobs(jobs, args)
+    _pool_jobs[:] = zip(jobs, mapped)
+    try:
+        with _ruleset_pool(max(min(args.threads, len(jobs)), 1)) as pool:
+            futures = [pool.submit(_create_pool_ruleset, i) for i in range(len(jobs))]
+            rulesets = _ready_groups(_group_by_destination(jobs), futures)
+            execution.apply_rulesets(rulesets, args.threads, args.real_run, args.exec_mode)
+    finally:
+        _pool_jobs.clear()
+        for mapped_src in {id(job_mapped[0]): job_mapped[0] for job_mapped in mapped}.values():
+            if isinstance(mapped_src, mapindex.MapIndex):
+                mapped_src.close()
+    if args.real_run:
+        for job, future in zip(jobs, futures):
+            state = future.result()[1]
+            if state is not None:
+                rulesfile.save_rules(state, job.previous_rules, job.rules_format)
+
+
+def map_jobs(jobs: list[argparse.Namespace], args: argparse.Namespace) -> list[rules.MappedReposType]:
+    """
+    Map trees of all the jobs. Every distinct tree (together with the mapping options, see maptarget.tree_key)
+    is mapped just once, all of them at the same time (see maptarget.map_targets). Source maps (src_map) are opened
+    once too, if they are up to date (see rules.open_src_map). Remote sources (urls) are mapped one by one
+    (see mapremote.map_remote) while the trees are mapped, sharing the listing cache.
+
+    Args:
+        jobs: argparse objects of the jobs (see load_manifest)
+        args: argparse object of the batch (requires: threads; optional: map_cache, full_rescan, listing_cache,
+                                            skip_unchanged)
+
+    Returns:
+        source map, destination map and destination classifiers of every job (as taken by rules.create_ruleset)
+    """
+
+    targets: list[str] = []
+    targets_args: list[argparse.Namespace] = []
+    classifiers: list[list[maptarget.Classifier]] = []
+    trees: dict[str, int] = {}
+    src_maps: dict[str, 'tuple[t.Mapping[str, RepoElem]|None, str]'] = {}
+
+    def tree(target: str, job: argparse.Namespace) -> int:
+        key = maptarget.tree_key(target, job)
+        if key not in trees:
+            trees[key] = len(targets)
+            targets.append(target)
+            targets_args.append(job)
+            classifiers.append([])
+        return trees[key]
+
+    listing_cache = getattr(args, 'listing_cache', None)
+    cache = (ListingCache(listing_cache, getattr(args, 'full_rescan', False), getattr(args, 'skip_unchanged', False))
+             if listing_cache else None)
+    remote: dict[str, concurrent.futures.Future] = {}
+    sources: list['int|t.Mapping[str, RepoElem]|concurrent.futures.Future'] = []
+    destinations = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as remote_pool:
+        for job in jobs:
+            if job.src_map:
+                key = maptarget.tree_key(job.src_map, job)
+                if key not in src_maps:
+                    src_maps[key] = rules.open_src_map(job.src_map, job)
+                src_map, src_target = src_maps[key]
+                sources.append(tree(src_target, job) if src_map is None else src_map)
+            elif mapremote.is_url(job.src_repo):
+                key = json.dumps([maptarget.tree_key(job.src_repo, job), job.repodata])
+                if key not in remote:
+                    remote[key] = remote_pool.submit(mapremote.map_remote, job.src_repo, job, cache)
+                sources.append(remote[key])
+            else:
+                sources.append(tree(job.src_repo, job))
+            job_classifiers = rules.dst_classifiers(job)
+            destinations.append((tree(job.dst_repo, job), job_classifiers))
+            classifiers[destinations[-1][0]] += job_classifiers
+        logging.info(f'Mapping {len(targets)} trees and {len(remote)} remote sources of {len(jobs)} jobs')
+        maps = maptarget.map_targets(targets, args, classifiers, targets_args)
+        mapped: list[rules.MappedReposType] = []
+        for source, (dst, job_classifiers) in zip(sources, destinations):
+            if isinstance(source, int):
+                source = maps[source]
+            elif isinstance(source, concurrent.futures.Future):
+                source = source.result()
+            mapped.append((source, maps[dst], job_classifiers))
+    if cache:
+        cache.save()
+    return mapped
+
+
+def _ruleset_pool(workers: int) -> concurrent.futures.Executor:
+    """
+    Rulesets are created in pure python, so they are created in forked processes if there are more CPUs to run them
+    on (the maps are inherited by the workers, just the rulesets are sent back), in threads otherwise.
+
+    Returns:
+        pool of workers to create rulesets in
+    """
+
+    if workers > 1 and (os.cpu_count() or 1) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+        return concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('fork'))
+    return concurrent.futures.ThreadPoolExecutor(workers)
+
+
+def _create_pool_ruleset(i: int) -> 'tuple[CommandsDataType, CommandsDataType|None]':
+    """
+    Args:
+        i: index of the job (in _pool_jobs)
+
+    Returns:
+        ruleset to apply and the full ruleset to save as previous rules (None if the job has no previous rules)
+    """
+
+    job, mapped = _pool_jobs[i]
+    if job.previous_rules:
+        return rules.create_delta_ruleset(job, rules.load_previous_rules(job.previous_rules), mapped)
+    return rules.create_ruleset(job, mapped), None
+
+
+def _group_by_destination(jobs: list[argparse.Namespace]) -> list[list[int]]:
+    """
+    Returns:
+        groups of jobs (their indexes, in order) whose destinations are the same or nested in each other
+    """
+
+    groups: list[tuple[list[str], list[int]]] = []
+    for i, job in enumerate(jobs):
+        dst = os.path.join(os.path.abspath(job.dst_repo), '')
+        overlapping = [group for group in groups if any(dst.startswith(path) or path.startswith(dst)
+                                                        for path in group[0])]
+        merged: tuple[list[str], list[int]] = ([dst], [i])
+        for group in overlapping:
+            groups.remove(group)
+            merged[0].extend(group[0])
+            merged[1].extend(group[1])
+        merged[1].sort()
+        groups.append(merged)
+    return sorted((indexes for _, indexes in groups), key=lambda indexes: indexes[0])
+
+
+def _ready_groups(groups: list[list[int]],
+                  futures: list[concurrent.futures.Future]) -> t.Iterator[CommandsDataType]:
+    """
+    Merge rulesets of each group of jobs as soon as all of them are created.
+
+    Returns:
+        iterator over merged rulesets (in order the groups are ready)
+    """
+
+    group_of = {i: group for group in groups for i in group}
+    remaining = {id(group): len(group) for group in groups}
+    for future in concurrent.futures.as_completed(futures):
+        group = group_of[futures.index(future)]
+        remaining[id(group)] -= 1
+        if not remaining[id(group)]:
+            yield _merge_rulesets([futures[i].result()[0] for i in group])
+
+
+def _merge_rulesets(rulesets: list[CommandsDataType]) -> CommandsDataType:
+    """
+    Returns:
+        ruleset with all the commands of rulesets (in order, each command just once)
+    """
+
+    if len(rulesets) == 1:
+        return rulesets[0]
+    merged: CommandsDataType = {'mkdir': [], 'mv': [], 'ln': [], 'rm': []}
+    merged['mv'] = list(dict.fromkeys(cmd for cmds in rulesets for cmd in cmds['mv']))
+    merged['ln'] = list(dict.fromkeys(cmd for cmds in rulesets for cmd in cmds['ln']))
+    merged['rm'] = list(dict.fromkeys(cmd for cmds in rulesets for cmd in cmds.get('rm', [])))
+    return merged
+
+
+def _option_value(value: t.Any) -> str:
+    """
+    Returns:
+        value of a manifest option as given on the command line
+    """
+
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, list):
+        return ','.join(str(item) for item in value)
+    if isinstance(value, dict):
+        return ','.join(f'{key}/{item}' for key, item in value.items())
+    return str(value)
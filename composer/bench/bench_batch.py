@@ -0,0 +1,73 @@
+"""
+Batch composition benchmark (jobs run one by one as by `direct` vs a single `batch`).
+
+Creates SOURCES synthetic source trees and JOBS destination trees of COUNT packages each (job i is modeled
+on source i % SOURCES), then composes all the jobs - first one after another (mapping both trees, creating
+and applying the rules of each job, as separate `direct` runs would), then at once by batch.run_batch.
+Links are removed between the runs. Wall-clock time of each job and of the whole batch is reported.
+
+Usage:
+    python -m composer.bench.bench_batch [-n COUNT] [-j JOBS] [-s SOURCES] [-T THREADS] [--tmpdir DIR]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import composer.batch as batch
+import composer.execution as execution
+import composer.parser as parser
+import composer.rules as rules
+from composer.bench import synthetic
+
+
+def _remove_links(dsts: list[str]) -> None:
+    for dst in dsts:
+        for repo in os.listdir(dst):
+            for arch in os.listdir(os.path.join(dst, repo)):
+                shutil.rmtree(os.path.join(dst, repo, arch, 'os'), ignore_errors=True)
+
+
+def run(base: str, count: int, jobs: int, sources: int, threads: int) -> None:
+    srcs = [os.path.join(base, f'src{i}/') for i in range(sources)]
+    dsts = [os.path.join(base, f'dst{i}/') for i in range(jobs)]
+    for src in srcs:
+        synthetic.create_tree(src, count, 'src')
+    for dst in dsts:
+        synthetic.create_tree(dst, count)
+    manifest = os.path.join(base, 'manifest.json')
+    with open(manifest, 'w') as f:
+        f.write('[' + ','.join(f'{{"src_repo": "{srcs[i % sources]}", "dst_repo": "{dst}", "move_debug": false}}'
+                               for i, dst in enumerate(dsts)) + ']')
+    args = parser.parse_args(['batch', '-i', manifest, '-T', str(threads), '-r', 'True'])
+    job_args = batch.load_manifest(manifest, args)
+
+    total = 0.0
+    for i, job in enumerate(job_args):
+        _, elapsed = synthetic.timed(lambda: execution.apply_rules(rules.create_ruleset(job), threads, True))
+        print(f'job {i}: {elapsed:6.2f}s')
+        total += elapsed
+    print(f'{len(job_args)} jobs one by one: {total:6.2f}s')
+    _remove_links(dsts)
+    _, elapsed = synthetic.timed(batch.run_batch, job_args, args)
+    print(f'batch of {len(job_args)} jobs: {elapsed:6.2f}s ({total / elapsed:.2f}x)')
+
+
+def main() -> None:
+    arg_parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    arg_parser.add_argument('-n', '--count', type=int, default=50000,
+                            help='number of packages per tree (default: %(default)s)')
+    arg_parser.add_argument('-j', '--jobs', type=int, default=4, help='number of jobs (default: %(default)s)')
+    arg_parser.add_argument('-s', '--sources', type=int, default=2,
+                            help='number of source trees (default: %(default)s)')
+    arg_parser.add_argument('-T', '--threads', type=int, default=4, help='threads (default: %(default)s)')
+    arg_parser.add_argument('--tmpdir', type=str, default=None,
+                            help='directory to create the trees in (default: system temp)')
+    args = arg_parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix='composer-bench-', dir=args.tmpdir) as tmp:
+        run(tmp, args.count, args.jobs, args.sources, args.threads)
+
+
+if __name__ == '__main__':
+    main()
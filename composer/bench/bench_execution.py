@@ -0,0 +1,74 @@
+"""
+Execution backend benchmark (path vs dirfd mode).
+
+Creates a synthetic tree of COUNT packages in all/ directories (preferably on tmpfs, so that only the syscall and
+path lookup cost is measured) and hardlinks all of them into os/ directories in each execution mode.
+Planning (see execution._plan_tasks) and execution of the planned tasks are timed separately.
+Links are removed between the runs.
+
+Usage:
+    python -m composer.bench.bench_execution [-n COUNT] [-T THREADS [THREADS ...]] [--tmpdir DIR]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+
+import composer.execution as execution
+import composer.executor as executor
+from composer.bench import synthetic
+from composer.composer_types import CommandsDataType
+
+
+def _link_commands(base: str, count: int) -> CommandsDataType:
+    links = []
+    for repo, arch, path in synthetic.package_files(count):
+        links.append((os.path.join(base, repo, arch, 'all', path), os.path.join(base, repo, arch, 'os', path)))
+    return {'mkdir': sorted({os.path.dirname(dst) for _, dst in links}), 'mv': [], 'ln': links}
+
+
+def _execute(tasks: list[executor.Task], threads: int) -> None:
+    if threads == 1:
+        for task in tasks:
+            task.fun(task.batch)
+        return
+    pool = executor.OperationExecutor(threads)
+    for task in tasks:
+        pool.submit_task(task)
+    pool.join()
+
+
+def run(count: int, threads: int, tmpdir: str) -> None:
+    root = tempfile.mkdtemp(prefix='composer-bench-', dir=tmpdir)
+    try:
+        # nest the tree as deep as in real mirrors (e.g. /srv/mirror/eurolinux/8/prod/BaseOS/x86_64/os/...)
+        base = os.path.join(root, 'mirror', 'eurolinux', '8', 'prod')
+        synthetic.create_tree(base, count)
+        cmds = _link_commands(base, count)
+        os_dirs = {os.path.join(base, repo, arch, 'os') for repo, arch, _ in synthetic.package_files(count)}
+        for mode in 'path', 'dirfd':
+            tasks, plan_time = synthetic.timed(execution._plan_tasks, cmds, mode)
+            _, elapsed = synthetic.timed(_execute, tasks, threads)
+            print(f'{count:9} links, {threads:3} threads, {mode:5}: planning {plan_time:5.2f}s, '
+                  f'execution {elapsed:6.2f}s ({count / elapsed:8.0f} links/s)')
+            for os_dir in os_dirs:
+                shutil.rmtree(os_dir)
+    finally:
+        shutil.rmtree(root)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=200000, help='number of links (default: %(default)s)')
+    parser.add_argument('-T', '--threads', type=int, nargs='+', default=[1, 8],
+                        help='numbers of threads (default: %(default)s)')
+    parser.add_argument('--tmpdir', type=str, default='/dev/shm' if os.path.isdir('/dev/shm') else None,
+                        help='directory to create the tree in (default: %(default)s)')
+    args = parser.parse_args()
+    for threads in args.threads:
+        run(args.count, threads, args.tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+Listing parser benchmark (stdlib html.parser link extractor vs BeautifulSoup).
+
+Builds an autoindex page (as generated by nginx) of ENTRIES packages and extracts its links by each of the
+parsers of mapremote.HTML_PARSERS (the stdlib one is fed in 64 KiB chunks, as the page is read).
+Reports page size, time per page, MiB/s and links/s.
+
+Usage:
+    python -m composer.bench.bench_htmlparse [-n ENTRIES [ENTRIES ...]] [-r REPEAT]
+"""
+
+import argparse
+import time
+
+import composer.mapremote as mapremote
+
+
+def autoindex_page(entries: int) -> bytes:
+    """
+    Args:
+        entries: number of packages listed
+
+    Returns:
+        autoindex page of a Packages/ directory
+    """
+
+    lines = ['<html>\r\n<head><title>Index of /repo/BaseOS/x86_64/os/Packages/</title></head>\r\n<body>\r\n'
+             '<h1>Index of /repo/BaseOS/x86_64/os/Packages/</h1><hr><pre><a href="../">../</a>\r\n']
+    for i in range(entries):
+        name = f'pkg{i}-{i % 10}.{i % 7}.{i % 3}-{i % 5}.el8.x86_64.rpm'
+        lines.append(f'<a href="{name}">{name[:50]}</a>{" " * (51 - len(name[:50]))}01-Jan-2024 00:00'
+                     f'{i * 1024:20}\r\n')
+    lines.append('</pre><hr></body>\r\n</html>\r\n')
+    return ''.join(lines).encode()
+
+
+def run(entries: list[int], repeat: int) -> None:
+    for count in entries:
+        page = autoindex_page(count)
+        chunks = [page[i:i + (1 << 16)] for i in range(0, len(page), 1 << 16)]
+        for name, links in mapremote.HTML_PARSERS.items():
+            try:
+                found = len(list(links(chunks)))
+            except ImportError:
+                print(f'{name:6}: not installed')
+                continue
+            start = time.perf_counter()
+            for _ in range(repeat):
+                list(links(chunks))
+            elapsed = (time.perf_counter() - start) / repeat
+            print(f'{count:7} entries, {len(page) / 2 ** 20:5.1f} MiB, {name:6}: {elapsed * 1000:8.1f}ms per page, '
+                  f'{len(page) / 2 ** 20 / elapsed:6.1f} MiB/s, {found / elapsed:9.0f} links/s')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--entries', type=int, nargs='+', default=[1000, 20000],
+                        help='numbers of entries of the pages (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='parses of every page (default: %(default)s)')
+    args = parser.parse_args()
+    run(args.entries, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
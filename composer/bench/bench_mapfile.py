@@ -0,0 +1,96 @@
+"""
+Map file benchmark (maprepo building the whole map vs writing it while walking).
+
+Maps a synthetic tree (or an existing one) into a json file as maprepo did before (map_target, then json.dumps of the
+whole map) and as a stream (maptarget.iter_target into mapfile.save_map) in both json and ndjson format.
+Reports wall-clock time, time to the first byte written, peak memory allocated (traced in a separate run) and file
+size, then the time to load each file back into a RepoMap.
+
+Usage:
+    python -m composer.bench.bench_mapfile [-n FILES] [-T THREADS] [-d DIR]
+"""
+
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+import typing as t
+
+import composer.mapfile as mapfile
+import composer.maptarget as maptarget
+from composer.bench import synthetic
+
+
+class _FirstByte:
+    """
+    Records when the first entry (directory) reaches the writer.
+    """
+
+    def __init__(self, entries: mapfile.MapEntriesType):
+        self.entries = entries
+        self.at = 0.0
+
+    def __iter__(self) -> t.Iterator[tuple[maptarget.RepoDir, list[tuple[str, int]]]]:
+        for entry in self.entries:
+            if not self.at:
+                self.at = time.perf_counter()
+            yield entry
+
+
+def _whole(target: str, args: argparse.Namespace, filename: str) -> float:
+    content = json.dumps(maptarget.map_target(target, args).to_dict(), indent=2)
+    first_byte = time.perf_counter()
+    with open(filename, 'w') as savefile:
+        savefile.write(content)
+    return first_byte
+
+
+def _streamed(target: str, args: argparse.Namespace, filename: str, map_format: str) -> float:
+    entries = _FirstByte(maptarget.iter_target(target, args))
+    mapfile.save_map(entries, filename, map_format)
+    return entries.at
+
+
+def run(target: str, threads: int) -> None:
+    args = synthetic.mapping_args(target, threads)
+    with tempfile.TemporaryDirectory(prefix='composer-bench-') as tmp:
+        variants: list[tuple[str, str, t.Callable[[], float]]] = [
+            ('whole json', 'whole.json', lambda: _whole(target, args, os.path.join(tmp, 'whole.json'))),
+            ('streamed json', 'map.json', lambda: _streamed(target, args, os.path.join(tmp, 'map.json'), 'json')),
+            ('streamed ndjson', 'map.ndjson',
+             lambda: _streamed(target, args, os.path.join(tmp, 'map.ndjson'), 'ndjson')),
+        ]
+        for name, filename, fun in variants:
+            start = time.perf_counter()
+            first_byte = fun()
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            fun()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            path = os.path.join(tmp, filename)
+            loaded, load_time = synthetic.timed(mapfile.load_map, path)
+            print(f'{name:16}: {elapsed:6.2f}s, first byte after {first_byte - start:6.2f}s, '
+                  f'peak {peak / 2 ** 20:7.1f} MiB, {os.path.getsize(path) / 2 ** 20:7.1f} MiB file, '
+                  f'load {load_time:5.2f}s ({len(loaded)} files)')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--files', type=int, default=200000, help='number of files (default: %(default)s)')
+    parser.add_argument('-T', '--threads', type=int, default=4, help='threads for mapping (default: %(default)s)')
+    parser.add_argument('-d', '--directory', type=str, default=None,
+                        help='existing tree to map (a synthetic one is created otherwise)')
+    args = parser.parse_args()
+    if args.directory:
+        run(args.directory, args.threads)
+        return
+    with tempfile.TemporaryDirectory(prefix='composer-bench-') as tmp:
+        synthetic.create_tree(tmp, args.files)
+        run(tmp + '/', args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Map index benchmark (opening a map file and looking files up in it).
+
+Saves a synthetic map of FILES packages as json, ndjson and index (see mapindex) and reports for each of them
+the file size, time to open the map (mapfile.open_map - json and ndjson maps are loaded, indexes memory-mapped),
+time until the first lookup is answered, peak memory allocated while opening and lookup throughput
+(random keys, a tenth of them missing).
+
+Usage:
+    python -m composer.bench.bench_mapindex [-n FILES] [-l LOOKUPS]
+"""
+
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+import composer.mapfile as mapfile
+import composer.mapindex as mapindex
+from composer.bench import synthetic
+from composer.repomap import RepoDir, RepoMap
+
+
+def run(files: int, lookups: int) -> None:
+    mapped = synthetic.build_map('/srv/mirror/eurolinux/8/prod', files)
+    keys = list(mapped)
+    rng = random.Random(0)
+    probes = [rng.choice(keys) if i % 10 else f'BaseOS:x86_64:Packages/a:missing{i}.rpm' for i in range(lookups)]
+    entries = _map_entries(mapped)
+    del mapped
+    with tempfile.TemporaryDirectory(prefix='composer-bench-') as tmp:
+        for map_format, filename in ('json', 'map.json'), ('ndjson', 'map.ndjson'), ('index', 'map.idx'):
+            path = os.path.join(tmp, filename)
+            mapfile.save_map(entries, path, map_format)
+            start = time.perf_counter()
+            opened = mapfile.open_map(path)
+            open_time = time.perf_counter() - start
+            opened.get(probes[0])
+            first_lookup = time.perf_counter() - start
+            start = time.perf_counter()
+            found = sum(1 for key in probes if opened.get(key) is not None)
+            lookup_time = time.perf_counter() - start
+            if isinstance(opened, mapindex.MapIndex):
+                opened.close()
+            del opened
+            tracemalloc.start()
+            opened = mapfile.open_map(path)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            if isinstance(opened, mapindex.MapIndex):
+                opened.close()
+            del opened
+            print(f'{map_format:6}: {os.path.getsize(path) / 2 ** 20:7.1f} MiB file, open {open_time:6.3f}s, '
+                  f'first lookup after {first_lookup:6.3f}s, peak {peak / 2 ** 20:7.1f} MiB, '
+                  f'{lookups / lookup_time:9.0f} lookups/s ({found} found)')
+
+
+def _map_entries(mapped: RepoMap) -> list[tuple[RepoDir, list[tuple[str, int]]]]:
+    """
+    Returns:
+        map entries (as written by maprepo) of mapped files grouped by directory
+    """
+
+    entries: dict[RepoDir, list[tuple[str, int]]] = {}
+    for elem in mapped.values():
+        entries.setdefault(elem.directory, []).append((elem.elem_name, 0))
+    return list(entries.items())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--files', type=int, default=1000000, help='number of files (default: %(default)s)')
+    parser.add_argument('-l', '--lookups', type=int, default=200000,
+                        help='number of lookups (default: %(default)s)')
+    args = parser.parse_args()
+    run(args.files, args.lookups)
+
+
+if __name__ == '__main__':
+    main()
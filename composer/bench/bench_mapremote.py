@@ -0,0 +1,149 @@
+"""
+Remote crawler benchmark (listings fetched one by one vs concurrently over keep-alive connections).
+
+Serves a synthetic source tree of COUNT packages by a local http.server (HTTP/1.1, every response delayed
+by LATENCY seconds to mimic a remote mirror) and maps it by mapremote - first as before (a new connection per
+listing, fetched one by one), then by the connection-pooled crawler with each of THREADS threads.
+Reports listings per second and number of connections opened. Then the tree is crawled again with a listing cache
+(see remotecache; the server sends ETags of listings) - requesting all the listings conditionally and skipping
+subtrees of unchanged listings. Finally every arch/Repo directory gets repodata (repomd.xml and primary.xml.gz
+listing its packages) and the tree is mapped from the metadata (see mapremote._map_repodata). Last, a source map
+is created the old way (fakeremote script run by bash, the fake tree mapped by maptarget) and straight from
+the listings (see mapremote.map_remote).
+
+Usage:
+    python -m composer.bench.bench_mapremote [-n COUNT] [-T THREADS [THREADS ...]] [-l LATENCY]
+"""
+
+import argparse
+import functools
+import gzip
+import http.server
+import os
+import subprocess
+import tempfile
+import threading
+import time
+import typing as t
+
+import composer.mapremote as mapremote
+import composer.maptarget as maptarget
+import composer.remotecache as remotecache
+from composer.bench import synthetic
+
+
+class _Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True  # headers and body are written separately
+    latency = 0.0
+    etag: 'str|None' = None
+
+    def do_GET(self) -> None:
+        time.sleep(self.latency)
+        super().do_GET()
+
+    def send_head(self) -> t.Any:
+        path = self.translate_path(self.path)
+        if os.path.isdir(path) and self.path.endswith('/'):
+            self.etag = f'"{os.stat(path).st_mtime_ns}"'
+            if self.headers.get('If-None-Match') == self.etag:
+                self.send_response(304)
+                self.end_headers()
+                return None
+        return super().send_head()
+
+    def end_headers(self) -> None:
+        if self.etag:
+            self.send_header('ETag', self.etag)
+        super().end_headers()
+
+    def log_message(self, *args: t.Any) -> None:
+        pass
+
+
+def _count(repo: 'mapremote.TreeElement|None') -> int:
+    if repo is None:
+        return 0
+    return 1 + sum(_count(sub) for sub in repo.parent_to.values() if sub is None or sub.elem_type == 'dir')
+
+
+def _write_repodata(directory: str) -> None:
+    for arch in synthetic.ARCHS:
+        for repo in synthetic.REPOS:
+            repo_dir = os.path.join(directory, arch, repo)
+            packages = [os.path.relpath(os.path.join(root, name), repo_dir).replace(os.sep, '/')
+                        for root, _, names in os.walk(repo_dir) for name in names]
+            primary = ['<?xml version="1.0" encoding="UTF-8"?>\n<metadata xmlns="http://linux.duke.edu/metadata/'
+                       f'common" xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="{len(packages)}">']
+            primary += [f'<package type="rpm"><name>{os.path.basename(path)}</name><arch>{arch}</arch>'
+                        f'<location href="{path}"/></package>' for path in sorted(packages)]
+            primary.append('</metadata>')
+            os.makedirs(os.path.join(repo_dir, 'repodata'))
+            with open(os.path.join(repo_dir, 'repodata', 'primary.xml.gz'), 'wb') as f:
+                f.write(gzip.compress('\n'.join(primary).encode()))
+            with open(os.path.join(repo_dir, 'repodata', 'repomd.xml'), 'w') as f:
+                f.write('<?xml version="1.0" encoding="UTF-8"?>\n<repomd xmlns="http://linux.duke.edu/metadata/repo">'
+                        '<data type="primary"><location href="repodata/primary.xml.gz"/></data></repomd>')
+
+
+def run(directory: str, threads: list[int], latency: float) -> None:
+    handler = functools.partial(type('Handler', (_Handler,), {'latency': latency}), directory=directory)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}/'
+    try:
+        repo, elapsed = synthetic.timed(mapremote._create_mapped_repo, url, 1, mapremote._urlopen)
+        listings = _count(repo)
+        print(f'urlopen, 1 thread   : {elapsed:6.2f}s, {listings / elapsed:7.0f} listings/s, {listings} connections')
+        for count in threads:
+            connections = mapremote.ConnectionPool()
+            repo, elapsed = synthetic.timed(mapremote._create_mapped_repo, url, count, connections.fetch)
+            print(f'pooled, {count:2} threads : {elapsed:6.2f}s, {_count(repo) / elapsed:7.0f} listings/s, '
+                  f'{connections.opened} connections')
+        with tempfile.TemporaryDirectory(prefix='composer-bench-') as tmp:
+            cache_file = os.path.join(tmp, 'listings.json')
+            for name, skip_unchanged in ('first crawl', False), ('conditional', False), ('skip unchanged', True):
+                cache = remotecache.ListingCache(cache_file, skip_unchanged=skip_unchanged)
+                repo, elapsed = synthetic.timed(mapremote._create_mapped_repo, url, max(threads), cache=cache)
+                cache.save()
+                print(f'cached, {name:14}: {elapsed:6.2f}s, {_count(repo)} listings')
+        _write_repodata(directory)
+        for name, repodata in ('crawled', False), ('repodata', True):
+            repo, elapsed = synthetic.timed(mapremote._create_mapped_repo, url, max(threads), repodata=repodata)
+            touches = len(mapremote._debug_recreate_repo_tree(repo, [], [])[1])
+            print(f'{name:8}, {max(threads):2} threads: {elapsed:6.2f}s, {touches} files')
+        args = synthetic.mapping_args(url, max(threads))
+        with tempfile.TemporaryDirectory(prefix='composer-bench-') as tmp:
+            def round_trip() -> t.Any:
+                script = os.path.join(tmp, 'fake.sh')
+                mapremote.write_repo_tree_shell(url, script, max(threads))
+                subprocess.run(['bash', script], cwd=tmp, check=True)
+                return maptarget.map_target(tmp, args)
+
+            mapped, elapsed = synthetic.timed(round_trip)
+            print(f'source map, fake tree  : {elapsed:6.2f}s, {len(mapped)} files')
+        for repodata in False, True:
+            args.repodata = repodata
+            mapped, elapsed = synthetic.timed(mapremote.map_remote, url, args)
+            print(f'source map, map_remote : {elapsed:6.2f}s, {len(mapped)} files' +
+                  (' (repodata)' if repodata else ''))
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, default=20000, help='number of packages (default: %(default)s)')
+    parser.add_argument('-T', '--threads', type=int, nargs='+', default=[1, 4, 16],
+                        help='numbers of crawler threads to compare (default: %(default)s)')
+    parser.add_argument('-l', '--latency', type=float, default=0.005,
+                        help='delay of every response in seconds (default: %(default)s)')
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory(prefix='composer-bench-') as tmp:
+        synthetic.create_tree(tmp, args.count, 'src')
+        run(tmp, args.threads, args.latency)
+
+
+if __name__ == '__main__':
+    main()
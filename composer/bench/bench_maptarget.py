@@ -0,0 +1,125 @@
+"""
+Repository mapping benchmark (files/second).
+
+Compares per-file classification (as done before the per-directory classification cache) with the current
+per-directory classification on an in-memory listing of a synthetic tree, then times map_target end to end
+(without a map cache, filling a map cache and with the map cache of the unchanged tree) and the debug package moves
+(a separate pass over the map vs a classifier run during the walk).
+
+Usage:
+    python -m composer.bench.bench_maptarget [-n FILES] [-T THREADS] [-d DIR]
+"""
+
+import argparse
+import os
+import re
+import tempfile
+import time
+
+import composer.maptarget as maptarget
+import composer.rules as rules
+from composer.bench import synthetic
+from composer.repomap import RepoMap
+
+
+def _map_files_per_file(rootdir: str, files: list[tuple[str, int]], ctx: maptarget._MapContext,
+                        current_root: dict[str, dict[str, str]]) -> dict[str, dict[str, str]]:
+    """
+    Reference implementation - classify every single file (arch, repo and relative path lookups per file).
+    """
+
+    args = ctx.args
+    for elem_name, _ in files:
+        if not ctx.pattern.match(elem_name):
+            continue
+        elem_arch = maptarget._set_elem_arch(rootdir, args.archs)
+        elem_repo = maptarget._set_elem_repo(rootdir, args)
+        if elem_arch is None or elem_repo is None:
+            continue
+        elem_path = os.path.join(rootdir, elem_name)
+        m = re.search(f'{ctx.target}(.*/(Packages/.*)$)', elem_path)
+        if not m:
+            continue
+        elem_rel = os.path.dirname(m.group(1))
+        elem_pkg = os.path.dirname(m.group(2))
+        elem_key = f'{elem_repo}:{elem_arch}:{elem_pkg}:{elem_name}'
+        current_root[elem_key] = {'elem_name': elem_name, 'elem_abs': ctx.abs_path,
+                                  'elem_path': elem_path, 'elem_arch': elem_arch,
+                                  'elem_repo': elem_repo, 'elem_base': ctx.target,
+                                  'elem_rel': elem_rel, 'elem_pkg': elem_pkg}
+    return current_root
+
+
+def _listing(ctx: maptarget._MapContext) -> list[tuple[str, list[tuple[str, int]]]]:
+    listing = []
+    stack = [ctx.abs_path]
+    while stack:
+        rootdir = stack.pop()
+        dirs, files = maptarget._list_dir(rootdir, ctx)
+        listing.append((rootdir, files))
+        stack += reversed(dirs)
+    return listing
+
+
+def _classify(listing: list[tuple[str, list[tuple[str, int]]]], ctx: maptarget._MapContext, map_files, current_root):
+    for rootdir, files in listing:
+        map_files(rootdir, files, ctx, current_root)
+    return current_root
+
+
+def run(target: str, threads: int) -> None:
+    args = synthetic.mapping_args(target, threads)
+    ctx = maptarget._MapContext(target, args)
+    listing = _listing(ctx)
+    before, before_time = synthetic.timed(_classify, listing, ctx, _map_files_per_file, {})
+    after, after_time = synthetic.timed(_classify, listing, ctx, maptarget._map_files, RepoMap())
+    assert before == after
+    print(f'classification, per file:      {len(before) / before_time:12.0f} files/s ({before_time:.2f}s)')
+    print(f'classification, per directory: {len(after) / after_time:12.0f} files/s ({after_time:.2f}s)')
+    mapped, map_time = synthetic.timed(maptarget.map_target, target, args)
+    print(f'map_target (-T {threads}):           {len(mapped) / map_time:12.0f} files/s ({map_time:.2f}s)')
+    _, pass_time = synthetic.timed(rules.create_move_commands_for_debug_packages, mapped, '/all/', '/debug/')
+    moves = rules.DebugPackageMoves('/all/', '/debug/')
+    _, classified_time = synthetic.timed(maptarget.map_target, target, args, [moves])
+    print(f'debug moves, separate pass:    {pass_time:12.2f}s (after map_target)')
+    print(f'debug moves, during the walk:  {classified_time - map_time:12.2f}s (map_target with DebugPackageMoves '
+          f'took {classified_time:.2f}s)')
+    with tempfile.TemporaryDirectory() as cache_dir:
+        args = synthetic.mapping_args(target, threads, '-c', os.path.join(cache_dir, 'cache.json'))
+        _, fill_time = synthetic.timed(maptarget.map_target, target, args)
+        cached, cached_time = synthetic.timed(maptarget.map_target, target, args)
+        assert cached == mapped
+    print(f'map_target, filling cache:     {len(mapped) / fill_time:12.0f} files/s ({fill_time:.2f}s)')
+    print(f'map_target, unchanged tree:    {len(mapped) / cached_time:12.0f} files/s ({cached_time:.2f}s)')
+
+
+def _age_dirs(base: str, seconds: int) -> None:
+    """
+    Move modification times of all the directories of a tree to the past (recently modified directories are not
+    cached, see composer.mapcache).
+    """
+
+    past = time.time() - seconds
+    for rootdir, _, _ in os.walk(base):
+        os.utime(rootdir, (past, past))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--files', type=int, default=500000, help='number of files (default: %(default)s)')
+    parser.add_argument('-T', '--threads', type=int, default=4, help='threads for map_target (default: %(default)s)')
+    parser.add_argument('-d', '--directory', type=str, default=None,
+                        help='existing tree to map (a synthetic one is created otherwise)')
+    args = parser.parse_args()
+    if args.directory:
+        run(args.directory, args.threads)
+        return
+    with tempfile.TemporaryDirectory() as tmp:
+        _, create_time = synthetic.timed(synthetic.create_tree, tmp, args.files)
+        print(f'created {args.files} files in {create_time:.2f}s')
+        _age_dirs(tmp, 3600)
+        run(tmp + '/', args.threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+Repository map memory benchmark (peak traced memory).
+
+Builds a map of synthetic files both as the former dictionary of per-file dictionaries and as RepoMap.
+
+Usage:
+    python -m composer.bench.bench_repomap [-n FILES]
+"""
+
+import argparse
+import gc
+import os
+import tracemalloc
+import typing as t
+
+from composer.bench import synthetic
+from composer.repomap import RepoDir, RepoMap
+
+BASE = '/srv/repo/eurolinux8/'
+ABS = '/srv/repo/eurolinux8'
+
+
+def _listing(count: int) -> list[tuple[str, str, str, str]]:
+    return [(repo, arch, os.path.dirname(path), os.path.basename(path))
+            for repo, arch, path in synthetic.package_files(count)]
+
+
+def build_dicts(listing: list[tuple[str, str, str, str]]) -> dict[str, dict[str, str]]:
+    mapped = {}
+    for repo, arch, pkg, name in listing:
+        rootdir = f'{ABS}/{repo}/{arch}/all/{pkg}'
+        elem_path = os.path.join(rootdir, name)
+        elem_rel = os.path.dirname(elem_path[len(BASE):])
+        elem_pkg = os.path.dirname(elem_path[len(rootdir) - len(pkg):])
+        mapped[f'{repo}:{arch}:{elem_pkg}:{name}'] = {'elem_name': name, 'elem_abs': ABS,
+                                                      'elem_path': elem_path, 'elem_arch': arch,
+                                                      'elem_repo': repo, 'elem_base': BASE,
+                                                      'elem_rel': elem_rel, 'elem_pkg': elem_pkg}
+    return mapped
+
+
+def build_repomap(listing: list[tuple[str, str, str, str]]) -> RepoMap:
+    mapped = RepoMap()
+    dirs: dict[str, RepoDir] = {}
+    for repo, arch, pkg, name in listing:
+        rootdir = f'{ABS}/{repo}/{arch}/all/{pkg}'
+        directory = dirs.get(rootdir)
+        if directory is None:
+            directory = dirs[rootdir] = RepoDir(ABS, BASE, rootdir, repo, arch, rootdir[len(BASE):], pkg)
+        mapped.add(directory, name)
+    return mapped
+
+
+def peak_memory(build: t.Callable[[t.Any], t.Any], listing: t.Any) -> tuple[int, int]:
+    """
+    Returns:
+        peak and retained traced memory (in bytes) of building a map
+    """
+
+    gc.collect()
+    tracemalloc.start()
+    mapped = build(listing)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del mapped
+    return peak, retained
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--files', type=int, default=1000000, help='number of files (default: %(default)s)')
+    args = parser.parse_args()
+    listing = _listing(args.files)
+    for name, build in ('dict of dicts', build_dicts), ('RepoMap', build_repomap):
+        peak, retained = peak_memory(build, listing)
+        print(f'{name:15} peak {peak / 2**20:9.1f} MiB, retained {retained / 2**20:9.1f} MiB '
+              f'({retained / args.files:.0f} B/file)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+Link rule generation benchmark (scaling with the number of packages).
+
+Compares probing every (arch, repository) key candidate of each source package (as done before the destination index)
+with create_link_commands. By default 10% of source packages are missing in the destination.
+The index saves the probes of keys that are not found - its gain grows with the share of missing packages, not with
+their number (with nothing missing, both take about the same time). Single runs of small maps are dominated by noise,
+hence the best of several runs is reported.
+
+Usage:
+    python -m composer.bench.bench_rules [-n COUNT [COUNT ...]] [-m MISSING_PERCENT] [-r REPEAT]
+"""
+
+import argparse
+import gc
+import typing as t
+
+import composer.rules as rules
+from composer.bench import synthetic
+from composer.repomap import RepoMap
+
+
+def _create_link_commands_probing(mapped_src: RepoMap, mapped_dst: RepoMap,
+                                  args: argparse.Namespace) -> list[tuple[str, str]]:
+    """
+    Reference implementation - probe destination map with every candidate key.
+    """
+
+    links = []
+    for mapped_src_key in mapped_src.keys():
+        src_arch, src_variable_key = mapped_src_key.split(':', 2)[1:3]
+        for current_arch in [src_arch] + args.archs:
+            for current_repo in args.repo_priority:
+                cmd = rules._append_rule(mapped_src, mapped_dst, mapped_src_key, src_variable_key, current_repo,
+                                         current_arch, args.all_dir, args.os_dir, args.replacements)
+                if cmd:
+                    links.append(cmd)
+                    break
+            if cmd:
+                break
+    return links
+
+
+def best_of(repeat: int, fun: t.Callable[..., t.Any], *args: t.Any) -> tuple[t.Any, float]:
+    """
+    Returns:
+        function result and the shortest of repeat wall-clock times (in seconds)
+    """
+
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        result, elapsed = synthetic.timed(fun, *args)
+        timings.append(elapsed)
+    return result, min(timings)
+
+
+def run(count: int, missing: int, repeat: int) -> None:
+    args = synthetic.mapping_args('/srv/src')
+    args.all_dir, args.os_dir, args.replacements = '/all/', '/os/', None
+    mapped_src = synthetic.build_map('/srv/src', count, 'src')
+    mapped_dst = synthetic.build_map('/srv/dst', count, 'dst', start=count * missing // 100)
+    before, before_time = best_of(repeat, _create_link_commands_probing, mapped_src, mapped_dst, args)
+    after, after_time = best_of(repeat, rules.create_link_commands, mapped_src, mapped_dst, args)
+    assert before == after
+    print(f'{count:9} packages: probing {before_time:7.2f}s, index {after_time:7.2f}s '
+          f'({before_time / after_time:.1f}x, {len(after)} links)')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='numbers of packages (default: %(default)s)')
+    parser.add_argument('-m', '--missing', type=int, default=10,
+                        help='percentage of source packages missing in destination (default: %(default)s)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='runs of both implementations, the best is reported (default: %(default)s)')
+    args = parser.parse_args()
+    for count in args.count:
+        run(count, args.missing, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Rules file benchmark (json vs packed format).
+
+Builds a synthetic ruleset of COUNT links (and a move of every tenth package), as created for a real mirror path,
+saves it in both formats and reports file size, save time, load time and peak memory allocated while loading
+(measured in a separate load, as tracing allocations slows loading down).
+
+Usage:
+    python -m composer.bench.bench_rulesfile [-n COUNT [COUNT ...]] [--tmpdir DIR]
+"""
+
+import argparse
+import os
+import tempfile
+import tracemalloc
+
+import composer.rulesfile as rulesfile
+from composer.bench import synthetic
+from composer.composer_types import CommandsDataType
+
+
+def _ruleset(count: int) -> CommandsDataType:
+    base = '/srv/mirror/eurolinux/8/prod'
+    cmds: CommandsDataType = {'mkdir': [], 'mv': [], 'ln': []}
+    for i, (repo, arch, path) in enumerate(synthetic.package_files(count)):
+        src = f'{base}/{repo}/{arch}/all/{path}'
+        if i % 10:
+            cmds['ln'].append((src, f'{base}/{repo}/{arch}/os/{path}'))
+        else:
+            cmds['mv'].append((src, f'{base}/{repo}/{arch}/debug/{path}'))
+    cmds['mkdir'] = sorted({dst.rpartition('/')[0] for _, dst in cmds['ln'] + cmds['mv']})
+    return cmds
+
+
+def _peak_memory(filename: str, rules_format: str) -> int:
+    tracemalloc.start()
+    try:
+        rulesfile.load_rules(filename, rules_format)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(count: int, tmpdir: str) -> None:
+    cmds = _ruleset(count)
+    with tempfile.TemporaryDirectory(prefix='composer-bench-', dir=tmpdir) as tmp:
+        for rules_format in 'json', 'packed':
+            filename = os.path.join(tmp, f'rules.{rules_format}')
+            _, save_time = synthetic.timed(rulesfile.save_rules, cmds, filename, rules_format)
+            loaded, load_time = synthetic.timed(rulesfile.load_rules, filename, rules_format)
+            assert [tuple(cmd) for cmd in loaded['ln']] == cmds['ln']
+            del loaded
+            size = os.path.getsize(filename)
+            peak = _peak_memory(filename, rules_format)
+            print(f'{count:9} packages, {rules_format:6}: {size / 2 ** 20:8.1f} MiB, save {save_time:6.2f}s, '
+                  f'load {load_time:6.2f}s, load peak {peak / 2 ** 20:8.1f} MiB')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, nargs='+', default=[100000, 1000000],
+                        help='numbers of packages (default: %(default)s)')
+    parser.add_argument('--tmpdir', type=str, default=None,
+                        help='directory to save rules files in (default: system temporary directory)')
+    args = parser.parse_args()
+    for count in args.count:
+        run(count, args.tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Streamed rules benchmark (fromrules with a json vs a ndjson rules file).
+
+Creates a synthetic tree of COUNT packages in all/ directories (preferably on tmpfs) and a rules file hardlinking
+all of them into os/ directories. The json file is loaded whole and applied (execution.apply_rules), the ndjson file
+is applied while being read (execution.apply_rules_stream). Reports wall-clock time and peak memory allocated
+(traced separately from the timed run, as tracing allocations slows everything down). Links are removed between runs.
+
+Usage:
+    python -m composer.bench.bench_stream [-n COUNT [COUNT ...]] [-T THREADS] [--tmpdir DIR]
+"""
+
+import argparse
+import os
+import shutil
+import tempfile
+import tracemalloc
+import typing as t
+
+import composer.execution as execution
+import composer.rulesfile as rulesfile
+from composer.bench import synthetic
+from composer.composer_types import CommandsDataType
+
+
+def _apply_json(filename: str, threads: int) -> None:
+    execution.apply_rules(rulesfile.load_rules(filename), threads, True)
+
+
+def _apply_ndjson(filename: str, threads: int) -> None:
+    execution.apply_rules_stream(rulesfile.iter_commands(filename), threads, True)
+
+
+def _peak_memory(fun: t.Callable[[str, int], None], filename: str, threads: int) -> int:
+    tracemalloc.start()
+    try:
+        fun(filename, threads)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run(count: int, threads: int, tmpdir: str) -> None:
+    root = tempfile.mkdtemp(prefix='composer-bench-', dir=tmpdir)
+    try:
+        base = os.path.join(root, 'mirror', 'eurolinux', '8', 'prod')
+        synthetic.create_tree(base, count)
+        cmds: CommandsDataType = {'mkdir': [], 'mv': [], 'ln': []}
+        for repo, arch, path in synthetic.package_files(count):
+            cmds['ln'].append((os.path.join(base, repo, arch, 'all', path), os.path.join(base, repo, arch, 'os', path)))
+        os_dirs = {os.path.join(base, repo, arch, 'os') for repo, arch, _ in synthetic.package_files(count)}
+        for rules_format, fun in ('json', _apply_json), ('ndjson', _apply_ndjson):
+            filename = os.path.join(root, f'rules.{rules_format}')
+            rulesfile.save_rules(cmds, filename, rules_format)
+            _, elapsed = synthetic.timed(fun, filename, threads)
+            for os_dir in os_dirs:
+                shutil.rmtree(os_dir)
+            peak = _peak_memory(fun, filename, threads)
+            for os_dir in os_dirs:
+                shutil.rmtree(os_dir)
+            print(f'{count:9} links, {threads:3} threads, {rules_format:6}: {elapsed:6.2f}s '
+                  f'({count / elapsed:8.0f} links/s), peak {peak / 2 ** 20:8.1f} MiB')
+    finally:
+        shutil.rmtree(root)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('-n', '--count', type=int, nargs='+', default=[100000, 300000],
+                        help='numbers of links (default: %(default)s)')
+    parser.add_argument('-T', '--threads', type=int, default=8, help='number of threads (default: %(default)s)')
+    parser.add_argument('--tmpdir', type=str, default='/dev/shm' if os.path.isdir('/dev/shm') else None,
+                        help='directory to create the tree in (default: %(default)s)')
+    args = parser.parse_args()
+    for count in args.count:
+        run(count, args.threads, args.tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""
+Synthetic repositories and helpers shared by benchmarks.
+"""
+
+import argparse
+import os
+import time
+import typing as t
+
+import composer.parser as parser
+from composer.repomap import RepoDir, RepoMap
+
+REPOS = ['BaseOS', 'AppStream', 'PowerTools']
+ARCHS = ['x86_64', 'i686', 'aarch64', 'noarch']
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def package_files(count: int) -> t.Iterator[tuple[str, str, str]]:
+    """
+    Generate (repo, arch, 'Packages' relative path) triples of synthetic packages.
+    Packages are spread evenly among repos, archs and Packages/<letter>/ directories.
+
+    Args:
+        count: number of packages to generate
+    """
+
+    for i in range(count):
+        repo = REPOS[i % len(REPOS)]
+        arch = ARCHS[(i // len(REPOS)) % len(ARCHS)]
+        letter = LETTERS[(i // (len(REPOS) * len(ARCHS))) % len(LETTERS)]
+        yield repo, arch, f'Packages/{letter}/{letter}pkg{i}-1.0-1.el8.{arch}.rpm'
+
+
+def create_tree(base: str, count: int, layout: str = 'dst', subdirs: t.Sequence[str] = ('all',)) -> None:
+    """
+    Create a synthetic repository tree of empty files.
+
+    Args:
+        base: directory to create the tree in
+        count: number of packages (per subdir)
+        layout: 'dst' (Repo/arch/<subdir>/Packages) or 'src' (arch/Repo/Packages) layout
+        subdirs: subdirectories to create packages in ('dst' layout only, e.g. all, os, debug)
+    """
+
+    created: set[str] = set()
+    for repo, arch, path in package_files(count):
+        if layout == 'src':
+            paths = [os.path.join(base, arch, repo, path)]
+        else:
+            paths = [os.path.join(base, repo, arch, sub, path) for sub in subdirs]
+        for p in paths:
+            directory = os.path.dirname(p)
+            if directory not in created:
+                os.makedirs(directory, exist_ok=True)
+                created.add(directory)
+            open(p, 'w').close()
+
+
+def build_map(base: str, count: int, layout: str = 'dst', start: int = 0) -> RepoMap:
+    """
+    Create a repository map of synthetic packages (without creating any files).
+
+    Args:
+        base: (absolute) path of the mapped repository
+        count: number of packages
+        layout: 'dst' (Repo/arch/all/Packages) or 'src' (arch/Repo/Packages) layout
+        start: skip this many packages (maps with different start share packages only partially)
+
+    Returns:
+        repository map
+    """
+
+    mapped = RepoMap()
+    dirs: dict[str, RepoDir] = {}
+    base = base.rstrip('/')
+    for i, (repo, arch, path) in enumerate(package_files(start + count)):
+        if i < start:
+            continue
+        pkg, name = os.path.split(path)
+        rel = f'{arch}/{repo}/{pkg}' if layout == 'src' else f'{repo}/{arch}/all/{pkg}'
+        directory = dirs.get(rel)
+        if directory is None:
+            directory = dirs[rel] = RepoDir(base, base + '/', f'{base}/{rel}', repo, arch, rel, pkg)
+        mapped.add(directory, name)
+    return mapped
+
+
+def mapping_args(target: str, threads: int = 1, *extra: str) -> argparse.Namespace:
+    """
+    Create (default) composer arguments for mapping target.
+
+    Args:
+        target: mapped directory
+        threads: number of threads
+        extra: additional command line arguments
+
+    Returns:
+        argparse object
+    """
+
+    return parser.parse_args(['maprepo', '-s', target, '-o', os.devnull, '-T', str(threads), *extra])
+
+
+def timed(fun: t.Callable[..., t.Any], *args: t.Any, **kwargs: t.Any) -> tuple[t.Any, float]:
+    """
+    Call a function and measure its wall-clock time.
+
+    Returns:
+        function result and elapsed time (in seconds)
+    """
+
+    start = time.perf_counter()
+    result = fun(*args, **kwargs)
+    return result, time.perf_counter() - start
@@ -5,7 +5,17 @@ Composer types for mypy.
 import typing as t
 
 
-class CommandsDataType(t.TypedDict, total=True):
+class _OptionalCommandsDataType(t.TypedDict, total=False):
+    rm: list[tuple[str, str]]  # links (src-dst tuples) to remove - present only in delta rulesets
+
+
+class CommandsDataType(_OptionalCommandsDataType, total=True):
     mkdir: list[str]
     mv: list[tuple[str, str]]
     ln: list[tuple[str, str]]
+
+
+class MapStampDataType(t.TypedDict):
+    target: str  # absolute path of the mapped tree
+    settings: dict[str, t.Any]  # arguments the tree was mapped with (see maptarget.create_stamp)
+    mtimes: dict[str, int]  # mtime_ns of listed directories (by path relative to target; -1 if not trustworthy)
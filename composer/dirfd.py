@@ -0,0 +1,112 @@
+"""
+Execution backend resolving paths relative to directory file descriptors.
+
+Every operation of a batch shares its source directory and its destination directory. Both are opened once per batch
+and links/renames (as well as stats and unlinks) resolve just the file names relative to them, instead of walking
+both absolute paths from / on every syscall.
+"""
+
+import contextlib
+import logging
+import os
+import sys
+import typing as t
+
+SUPPORTED = {os.link, os.rename, os.stat, os.unlink} <= os.supports_dir_fd
+
+
+@contextlib.contextmanager
+def _open_dirs(src_dir: str, dst_dir: str) -> t.Iterator[tuple[int, int]]:
+    """
+    Open source and destination directory (just once if they are the same directory).
+
+    Args:
+        src_dir: source directory
+        dst_dir: destination directory
+
+    Returns:
+        file descriptors of source and destination directory
+    """
+
+    src_fd = os.open(src_dir or '.', os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        if dst_dir == src_dir:
+            yield src_fd, src_fd
+            return
+        dst_fd = os.open(dst_dir or '.', os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            yield src_fd, dst_fd
+        finally:
+            os.close(dst_fd)
+    finally:
+        os.close(src_fd)
+
+
+def rename_batch(batch: list[tuple[str, str]]) -> None:
+    """
+    Rename files (equivalent of os.rename on each tuple).
+
+    Args:
+        batch: list of (src, dst) tuples - all in the same source directory and the same destination directory
+    """
+
+    src_dir, dst_dir = os.path.dirname(batch[0][0]), os.path.dirname(batch[0][1])
+    with _open_dirs(src_dir, dst_dir) as (src_fd, dst_fd):
+        for src, dst in batch:
+            os.rename(os.path.basename(src), os.path.basename(dst), src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+
+
+def link_batch(batch: list[tuple[str, str]]) -> None:
+    """
+    Create hardlinks (equivalent of execution._create_link on each tuple).
+    If link already exists -> replace it only if different than original
+
+    Args:
+        batch: list of (src, dst) tuples - all in the same source directory and the same destination directory
+    """
+
+    src_dir, dst_dir = os.path.dirname(batch[0][0]), os.path.dirname(batch[0][1])
+    with _open_dirs(src_dir, dst_dir) as (src_fd, dst_fd):
+        for src, dst in batch:
+            src_name, dst_name = os.path.basename(src), os.path.basename(dst)
+            try:
+                os.link(src_name, dst_name, src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+            except FileExistsError:
+                src_stat = os.stat(src_name, dir_fd=src_fd)
+                dst_stat = os.stat(dst_name, dir_fd=dst_fd)
+                if dst_stat.st_dev != src_stat.st_dev:
+                    logging.error(f'Sorry, we require {src} and {dst} to be on the same device')
+                    sys.exit(1)
+                if dst_stat.st_ino != src_stat.st_ino:
+                    os.unlink(dst_name, dir_fd=dst_fd)
+                    os.link(src_name, dst_name, src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+
+
+def remove_batch(batch: list[tuple[str, str]]) -> None:
+    """
+    Remove hardlinks (equivalent of execution._remove_link on each tuple).
+    Only the destination directory is opened - the source (and its directory) may not exist anymore.
+
+    Args:
+        batch: list of (src, dst) tuples - all in the same destination directory
+    """
+
+    try:
+        dst_fd = os.open(os.path.dirname(batch[0][1]) or '.', os.O_RDONLY | os.O_DIRECTORY)
+    except FileNotFoundError:
+        return
+    try:
+        for src, dst in batch:
+            dst_name = os.path.basename(dst)
+            try:
+                dst_stat = os.stat(dst_name, dir_fd=dst_fd)
+            except FileNotFoundError:
+                continue
+            try:
+                src_stat = os.stat(src)
+            except FileNotFoundError:
+                src_stat = None
+            if src_stat is None or (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+                os.unlink(dst_name, dir_fd=dst_fd)
+    finally:
+        os.close(dst_fd)
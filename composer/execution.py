@@ -1,24 +1,37 @@
 import os
 import sys
 import logging
-import threading
+import itertools
+import collections
+import collections.abc
+import concurrent.futures
 import typing as t
 
+import composer.dirfd as dirfd
+import composer.executor as executor
 from composer.composer_types import CommandsDataType
+from composer.repomap import RepoElem, RepoMap
 
 
-def create_local_repo_script(repo: dict[str, dict[str, str]], output_file: str) -> None:
+def create_local_repo_script(repo: 't.Union[RepoMap, t.Iterable[RepoElem]]', output_file: str) -> None:
     """
     Outputs a bash script file that creates a mock repository locally.
 
     Args:
-        repo: A dictionary representing a repository (to mock)
+        repo: A map representing a repository (to mock) or just its files (e.g. streamed by mapfile.iter_elems -
+              of files with the same key, just the last one is created, as it is kept in a map)
         output_file: destination filename to write the script to (will overwrite)
     """
 
+    elems: t.Iterable[RepoElem]
+    if isinstance(repo, collections.abc.Mapping):
+        elems = repo.values()
+    else:
+        elems = {f'{elem.elem_repo}:{elem.elem_arch}:{elem.elem_pkg}:{elem.elem_name}': elem
+                 for elem in t.cast(t.Iterable[RepoElem], repo)}.values()
     mkdirs = []
     touches = []
-    for repo_elem in repo.values():
+    for repo_elem in elems:
         directory = repo_elem['elem_rel']
         path = os.path.join(directory, repo_elem['elem_name'])
         mkdirs.append(f'mkdir -p {directory}\n')
@@ -31,7 +44,7 @@ def create_local_repo_script(repo: dict[str, dict[str, str]], output_file: str)
         savefile.writelines(touches)
 
 
-def apply_rules(cmds: CommandsDataType, threads: int, real_run: bool = False) -> None:
+def apply_rules(cmds: CommandsDataType, threads: int, real_run: bool = False, exec_mode: str = 'path') -> None:
     """
     Apply collected command rules.
 
@@ -39,25 +52,154 @@ def apply_rules(cmds: CommandsDataType, threads: int, real_run: bool = False) ->
         cmds: rule dictionary to apply
         threads: number of threads to execute in (applied only if real_run is True)
         real_run: if True, an actual execution will be carried out (otherwise we just log commands)
+        exec_mode: 'path' (operations on absolute paths) or 'dirfd' (operations relative to directory descriptors)
     """
 
-    cmds['mkdir'] = []
-    for _, dst in [*cmds['ln'], *cmds['mv']]:
-        outdir = os.path.dirname(dst)
-        if not os.path.exists(outdir):
-            cmds['mkdir'].append(outdir)
-    cmds['mkdir'] = list(set(cmds['mkdir']))
+    cmds['mkdir'] = _plan_dirs(cmds, threads)
+    if exec_mode == 'dirfd' and not dirfd.SUPPORTED:
+        logging.warning('Directory descriptors are not supported on this platform, falling back to paths')
+        exec_mode = 'path'
     if real_run:
         if threads > 1:
-            _run_in_threads(cmds, threads)
+            _run_in_threads(cmds, threads, exec_mode)
         else:
-            _run_single_thread(cmds)
+            _run_single_thread(cmds, exec_mode)
     else:
-        for v in cmds['mkdir']:
-            logging.info(f'os.makedirs("{v}", exist_ok=True)')
-        for src, dst in cmds['mv']:
+        _log_commands(cmds['mkdir'], _operations(cmds))
+
+
+def apply_rules_stream(commands: t.Iterable[t.Sequence[str]], threads: int, real_run: bool = False,
+                       exec_mode: str = 'path', chunk_size: int = 65536) -> None:
+    """
+    Apply commands as they are read (e.g. from rulesfile.iter_commands), holding just a few chunks in memory.
+    Each chunk of commands is planned and applied as by apply_rules, except that its commands keep their order
+    (an operation waits for the earlier ones on the same paths, whatever their kinds, see _plan_tasks). Chunks are
+    applied in order - a chunk starts once the previous one is finished (so it may depend on it), while the next
+    one is already being read and planned.
+
+    Args:
+        commands: (kind, path) or (kind, src, dst) tuples in order of execution (mkdir commands are ignored,
+                  directories are planned from destinations just as in apply_rules)
+        threads: number of threads to execute in (applied only if real_run is True)
+        real_run: if True, an actual execution will be carried out (otherwise we just log commands)
+        exec_mode: 'path' or 'dirfd' (see apply_rules)
+        chunk_size: maximum number of commands in a chunk
+    """
+
+    if exec_mode == 'dirfd' and not dirfd.SUPPORTED:
+        logging.warning('Directory descriptors are not supported on this platform, falling back to paths')
+        exec_mode = 'path'
+    chunks = _chunk_commands(commands, chunk_size)
+    if not real_run:
+        for chunk, operations in chunks:
+            _log_commands(_plan_dirs(chunk), operations)
+        return
+    if threads <= 1:
+        for chunk, operations in chunks:
+            chunk['mkdir'] = _plan_dirs(chunk)
+            for task in _plan_tasks(chunk, exec_mode, operations=operations):
+                task.fun(task.batch)
+        return
+    pool = executor.OperationExecutor(threads)
+    try:
+        for chunk, operations in executor.prefetch(chunks):
+            chunk['mkdir'] = _plan_dirs(chunk, threads)
+            tasks = _plan_tasks(chunk, exec_mode, operations=operations)
+            pool.wait()
+            if pool.error is not None:
+                break
+            for task in tasks:
+                pool.submit_task(task)
+    finally:
+        pool.join()
+
+
+def apply_rulesets(rulesets: t.Iterable[CommandsDataType], threads: int, real_run: bool = False,
+                   exec_mode: str = 'path') -> None:
+    """
+    Apply independent rulesets (not touching the same paths) as they come, in a single shared executor -
+    operations of a ruleset are planned and queued as soon as it comes, while the operations of earlier rulesets
+    may still be running. The queue of the executor is bounded, so is the number of operations waiting to run.
+
+    Args:
+        rulesets: rule dictionaries to apply
+        threads: number of threads to execute in (applied only if real_run is True)
+        real_run: if True, an actual execution will be carried out (otherwise we just log commands)
+        exec_mode: 'path' or 'dirfd' (see apply_rules)
+    """
+
+    if exec_mode == 'dirfd' and not dirfd.SUPPORTED:
+        logging.warning('Directory descriptors are not supported on this platform, falling back to paths')
+        exec_mode = 'path'
+    if not real_run or threads <= 1:
+        for cmds in rulesets:
+            apply_rules(cmds, threads, real_run, exec_mode)
+        return
+    pool = executor.OperationExecutor(threads)
+    try:
+        for cmds in rulesets:
+            if pool.error is not None:
+                break
+            cmds['mkdir'] = _plan_dirs(cmds, threads)
+            for task in _plan_tasks(cmds, exec_mode):
+                pool.submit_task(task)
+    finally:
+        pool.join()
+
+
+def _chunk_commands(commands: t.Iterable[t.Sequence[str]],
+                    chunk_size: int) -> t.Iterator[tuple[CommandsDataType, list[tuple[str, str, str]]]]:
+    """
+    Group commands into chunks of at most chunk_size commands (mkdir commands are dropped).
+
+    Returns:
+        iterator over rule dictionaries of the chunks and their (kind, src, dst) operations in order of execution
+    """
+
+    chunk: CommandsDataType = {'mkdir': [], 'mv': [], 'ln': [], 'rm': []}
+    operations: list[tuple[str, str, str]] = []
+    for command in commands:
+        if command[0] == 'mkdir':
+            continue
+        kind, src, dst = command
+        if kind not in ('mv', 'ln', 'rm'):
+            raise ValueError(f'Unknown command {kind}')
+        chunk[kind].append((src, dst))  # type: ignore
+        operations.append((kind, src, dst))
+        if len(operations) == chunk_size:
+            yield chunk, operations
+            chunk = {'mkdir': [], 'mv': [], 'ln': [], 'rm': []}
+            operations = []
+    if operations:
+        yield chunk, operations
+
+
+def _operations(cmds: CommandsDataType) -> t.Iterator[tuple[str, str, str]]:
+    """
+    Returns:
+        iterator over (kind, src, dst) operations of a rule dictionary in order of execution (moves, links, removals)
+    """
+
+    for kind in 'mv', 'ln', 'rm':
+        for src, dst in cmds.get(kind) or ():  # type: ignore
+            yield kind, src, dst
+
+
+def _log_commands(mkdirs: list[str], operations: t.Iterable[tuple[str, str, str]]) -> None:
+    """
+    Log commands instead of executing them (dry run).
+
+    Args:
+        mkdirs: directories to create
+        operations: (kind, src, dst) operations in order of execution
+    """
+
+    for v in mkdirs:
+        logging.info(f'os.makedirs("{v}", exist_ok=True)')
+    for kind, src, dst in operations:
+        if kind == 'mv':
             logging.info(f'os.rename("{src}", "{dst}")')
-        for src, dst in cmds['ln']:
+        elif kind == 'ln':
             logging.info(f'os.link("{src}", "{dst}")')
             if os.path.exists(dst):
                 src_stat = os.stat(src)
@@ -68,84 +210,176 @@ def apply_rules(cmds: CommandsDataType, threads: int, real_run: bool = False) ->
                 if dst_stat.st_ino != src_stat.st_ino:
                     logging.info(f'os.remove("{dst}")')
                     logging.info(f'os.link("{src}", "{dst}")')
+        else:
+            logging.info(f'os.remove("{dst}")  # link of {src}')
+
+
+def _plan_dirs(cmds: CommandsDataType, threads: int = 1) -> list[str]:
+    """
+    Find destination directories that have to be created.
+    Only leaf directories are checked (and created) - their ancestors are implied (os.makedirs creates them),
+    so there is a single existence check per distinct leaf directory.
+
+    Args:
+        cmds: commands to execute
+        threads: number of threads to check existence of directories in
+
+    Returns:
+        sorted list of missing leaf directories
+    """
+
+    dirs = {dst.rpartition('/')[0] for _, dst in itertools.chain(cmds['ln'], cmds['mv'])}
+    dirs.discard('')  # files in / (or in the current directory)
+    parents: set[str] = set()
+    for directory in dirs:
+        parent = os.path.dirname(directory)
+        while parent not in parents and parent != directory:
+            parents.add(parent)
+            directory, parent = parent, os.path.dirname(parent)
+    leaves = sorted(dirs - parents)
+    if threads > 1 and len(leaves) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as pool:
+            exists = list(pool.map(os.path.exists, leaves))
+    else:
+        exists = [os.path.exists(leaf) for leaf in leaves]
+    return [leaf for leaf, leaf_exists in zip(leaves, exists) if not leaf_exists]
 
 
-def _run_single_thread(cmds: CommandsDataType) -> None:
+def _run_single_thread(cmds: CommandsDataType, exec_mode: str = 'path') -> None:
     """
     Executes system commands in a single thread.
 
     Args:
         cmds: commands to execute
+        exec_mode: 'path' or 'dirfd' (see apply_rules)
     """
+    if exec_mode == 'dirfd':
+        for task in _plan_tasks(cmds, exec_mode):
+            task.fun(task.batch)
+        return
     for v in cmds['mkdir']:
         os.makedirs(v, exist_ok=True)
     for src, dst in cmds['mv']:
         os.rename(src, dst)
     for src, dst in cmds['ln']:
         _create_link(src, dst)
+    for src, dst in cmds.get('rm', []):
+        _remove_link(src, dst)
 
 
-def _run_in_threads(cmds: CommandsDataType, thread_num: int) -> None:
+def _run_in_threads(cmds: CommandsDataType, thread_num: int, exec_mode: str = 'path') -> None:
     """
     Executes system commands in multiple threads.
+    Operations are batched by destination directory and handed out to threads from a shared queue
+    as soon as the operations they depend on are done (see _plan_tasks).
 
     Args:
         cmds: commands to execute
-        thread_num: number of threads to start (i.e. evenly split cmds list into)
+        thread_num: number of threads to start
+        exec_mode: 'path' or 'dirfd' (see apply_rules)
     """
-    for v in cmds['mkdir']:
-        os.makedirs(v, exist_ok=True)
-    thread_list = []
-    splitlist = _prep_for_threads(cmds['mv'], thread_num)
-    for chunk in splitlist:
-        t = threading.Thread(target=_apply_2arg_fun, args=(chunk, os.rename))
-        thread_list.append(t)
-        t.start()
-    splitlist = _prep_for_threads(cmds['ln'], thread_num)
-    for chunk in splitlist:
-        t = threading.Thread(target=_apply_2arg_fun, args=(chunk, _create_link))
-        thread_list.append(t)
-        t.start()
-    for t in thread_list:
-        t.join()
-
-
-def _prep_for_threads(lst: list[tuple[str, str]], thread_num: int) -> list[list[tuple[str, str]]]:
-    """
-    Split list evenly into thread_num parts. For threaded execution.
-    What happens here is best demonstrated on an example:
-    Let:
-    list = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11]
-    We want to split it into 4 [roughly] equal parts (4 threads):
-    len(list) = 11, thread_num = 4
-    divmod(11, 4) = (2, 3) i.e. dividing by 4 gives 2[-element lists] and 3 elements remaining.
-    So to get 4 such lists (one for each thread) out of our main list we would have to
-    split elements into lists of 2 (d) (division) and add 3 (r) elements somewhere (remainder).
-    Now the comprehension:
-    We take parts indexed with range (i) - for four threads i = 0, 1, 2, 3.
-    So: i = [0, 1, 2, 3], d = 2, r = 3
-    ------------------ [i*d+min(i, r):(i+1)*d+min(i+1, r)]
-    First list  (i=0): [0*2+min(0, 3):(0+1)*2+min(0+1, 3)] = lst[0:3]  = [1,  2,  3]
-    Second list (i=1): [1*2+min(1, 3):(1+1)*2+min(1+1, 3)] = lst[3:6]  = [4,  5,  6]
-    Third list  (i=2): [2*2+min(2, 3):(2+1)*2+min(2+1, 3)] = lst[6:9]  = [7,  8,  9]
-    Fourth list (i=3): [3*2+min(3, 3):(3+1)*2+min(3+1, 3)] = lst[9:11] = [10, 11]
-    The result then becomes: [ [1,2,3], [4,5,6], [7,8,9], [10,11] ]
-    In essence:
-    - We set starting point to the "complete list" (d) point (with lists of two this is 0, 2, 4)
-    - We set the ending point at the next end (next d) (with lists of two this is 2, 4, 6)
-    - Then we offset these values by 1 for as many times as there are remainders (r) (the min() part)
-      (enlarging first (r) lists by 1 and moving next starting index forward by 1)
+    pool = executor.OperationExecutor(thread_num)
+    for task in _plan_tasks(cmds, exec_mode):
+        pool.submit_task(task)
+    pool.join()
+
+
+def _plan_tasks(cmds: CommandsDataType, exec_mode: str = 'path', batch_size: int = 256,
+                operations: 't.Sequence[tuple[str, str, str]]|None' = None) -> list[executor.Task]:
+    """
+    Build the graph of tasks to execute commands in.
+    Every directory is created by a separate task. Moves, links and removals of links are batched by destination
+    directory (moves and links in 'dirfd' mode by source and destination directory, as every batch opens both of them).
+    A batch waits for its destination directory to be created and for the earlier operations on the same paths
+    (e.g. a link of a moved file waits for the move) - just as if the commands were run one by one.
+    Batches that do not conflict do not wait for each other.
 
     Args:
-        lst: list to split
-        thread_num: number of parts.
+        cmds: commands to execute
+        exec_mode: 'path' or 'dirfd' (see apply_rules)
+        batch_size: maximum number of operations in a batch
+        operations: (kind, src, dst) operations of cmds in order of execution (moves, links, then removals if None)
 
     Returns:
-        A list of `thread_num` lists that each contain roughly the same number of elements.
+        list of tasks (every task comes after the tasks it depends on)
     """
 
-    d, r = divmod(len(lst), thread_num)
-    return [lst[i*d+min(i, r):(i+1)*d+min(i+1, r)] for i in range(thread_num)]
+    tasks: list[executor.Task] = []
+    mkdir_tasks: dict[str, executor.Task] = {}
+    for path in cmds['mkdir']:
+        task = mkdir_tasks[path] = executor.Task(_make_dirs, [path])
+        tasks.append(task)
+        # mkdir list holds just leaf directories - their (possibly missing) ancestors are created along with them
+        parent = os.path.dirname(path)
+        while parent not in mkdir_tasks and parent != path:
+            mkdir_tasks[parent] = task
+            path, parent = parent, os.path.dirname(parent)
+    # only paths touched by more than one operation can make operations conflict
+    if operations is None:
+        shared = collections.Counter(itertools.chain.from_iterable(
+            itertools.chain(cmds['mv'], cmds['ln'], cmds.get('rm', []))))
+    else:
+        shared = collections.Counter(path for _, src, dst in operations for path in (src, dst))
+    shared_paths = {path for path, count in shared.items() if count > 1}
+    index: dict[executor.Task, int] = {}
+    open_batches: dict[tuple[str, str, str], executor.Task] = {}
+    writers: dict[str, executor.Task] = {}
+    readers: dict[str, list[executor.Task]] = {}
+    if exec_mode == 'dirfd':
+        funs = {'mv': dirfd.rename_batch, 'ln': dirfd.link_batch, 'rm': dirfd.remove_batch}
+    else:
+        funs = {'mv': _rename_batch, 'ln': _link_batch, 'rm': _remove_batch}
+    for kind, src, dst in operations if operations is not None else _operations(cmds):
+        deps: set[executor.Task] = set()
+        shared_op = src in shared_paths or dst in shared_paths
+        if shared_op:
+            written, read = ((src, dst), ()) if kind == 'mv' else ((dst,), (src,))
+            deps.update(writers[path] for path in (src, dst) if path in writers)
+            deps.update(task for path in written for task in readers.get(path, ()))
+        outdir = dst.rpartition('/')[0]  # same as os.path.dirname, just faster (except for '/' itself)
+        # dirfd.remove_batch opens just the destination directory
+        key = (kind, src.rpartition('/')[0] if exec_mode == 'dirfd' and kind != 'rm' else '', outdir)
+        batch = open_batches.get(key)
+        # a batch runs as a whole - an operation can join it only if it does not have to wait for a later batch
+        if (batch is None or len(batch.batch) >= batch_size or
+                (deps and any(index[dep] > index[batch] for dep in deps))):
+            batch = executor.Task(funs[kind], [])
+            index[batch] = len(tasks)
+            tasks.append(batch)
+            open_batches[key] = batch
+            if outdir in mkdir_tasks:
+                batch.after(mkdir_tasks[outdir])
+        batch.batch.append((src, dst))
+        if not shared_op:
+            continue
+        for dep in deps:
+            if dep is not batch:
+                batch.after(dep)
+        for path in written:
+            writers[path] = batch
+            readers.pop(path, None)
+        for path in read:
+            path_readers = readers.setdefault(path, [])
+            if not path_readers or path_readers[-1] is not batch:
+                path_readers.append(batch)
+    return tasks
+
+
+def _make_dirs(paths: list[str]) -> None:
+    for path in paths:
+        os.makedirs(path, exist_ok=True)
+
+
+def _rename_batch(batch: list[tuple[str, str]]) -> None:
+    _apply_2arg_fun(batch, os.rename)
+
+
+def _link_batch(batch: list[tuple[str, str]]) -> None:
+    _apply_2arg_fun(batch, _create_link)
+
+
+def _remove_batch(batch: list[tuple[str, str]]) -> None:
+    _apply_2arg_fun(batch, _remove_link)
 
 
 def _apply_2arg_fun(lst: list[tuple[str, str]], fun: t.Callable[[str, str], None]) -> None:
@@ -180,3 +414,25 @@ def _create_link(src: str, dst: str) -> None:
         if dst_stat.st_ino != src_stat.st_ino:
             os.remove(dst)
             os.link(src, dst)
+
+
+def _remove_link(src: str, dst: str) -> None:
+    """
+    Remove a hardlink (created by a previous run).
+    The link is kept if it is not a link of src anymore (unless src does not exist - e.g. the package was removed).
+
+    Args:
+        src: source file the link was created from
+        dst: link to remove
+    """
+
+    try:
+        dst_stat = os.stat(dst)
+    except FileNotFoundError:
+        return
+    try:
+        src_stat = os.stat(src)
+    except FileNotFoundError:
+        src_stat = None
+    if src_stat is None or (src_stat.st_dev, src_stat.st_ino) == (dst_stat.st_dev, dst_stat.st_ino):
+        os.remove(dst)
@@ -0,0 +1,218 @@
+"""
+Pool of worker threads executing batches of file operations from a shared work queue.
+"""
+
+import collections
+import logging
+import queue
+import threading
+import time
+import typing as t
+
+BatchFunctionType = t.Callable[[list[t.Any]], None]
+_T = t.TypeVar('_T')
+
+
+class WorkerStats:
+    """
+    Throughput statistics of a single worker.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.batches = 0
+        self.operations = 0
+        self.busy = 0.0
+
+
+class Task:
+    """
+    A batch of operations (executed by a single function call) that may have to wait for other tasks to finish.
+    """
+
+    __slots__ = ('fun', 'batch', 'pending', 'dependents', 'submitted')
+
+    def __init__(self, fun: BatchFunctionType, batch: list[t.Any]):
+        """
+        Args:
+            fun: function executing the batch
+            batch: list of operations (e.g. (src, dst) tuples)
+        """
+
+        self.fun = fun
+        self.batch = batch
+        self.pending = 0
+        self.dependents: set['Task'] = set()
+        self.submitted = False
+
+    def after(self, task: 'Task') -> None:
+        """
+        Make the task wait for another task to finish.
+        Dependencies have to be declared before the other task is submitted.
+
+        Args:
+            task: task to wait for
+        """
+
+        if self not in task.dependents:
+            task.dependents.add(self)
+            self.pending += 1
+
+
+class OperationExecutor:
+    """
+    Workers take batches of operations from a shared queue as soon as they are done with the previous one,
+    so a slow batch (e.g. a slow directory on NFS) holds up only the worker running it.
+    A task waiting for other tasks is queued once the last of them finishes.
+    The queue is bounded - submitting blocks while the workers are behind.
+    If an operation raises, the remaining batches are skipped and the exception is re-raised by join().
+    """
+
+    def __init__(self, workers: int, queue_size: int = 0):
+        """
+        Args:
+            workers: number of worker threads
+            queue_size: maximum number of queued batches (default: 4 per worker)
+        """
+
+        self.queue_size = queue_size or 4 * workers
+        self.ready: collections.deque[Task] = collections.deque()
+        self.cond = threading.Condition()
+        self.outstanding = 0  # submitted tasks which have not finished yet
+        self.closed = False
+        self.stats = [WorkerStats(f'worker-{i}') for i in range(workers)]
+        self.error: 'BaseException|None' = None
+        self.started = time.perf_counter()
+        self.threads = [threading.Thread(target=self._work, args=(stats,), name=stats.name, daemon=True)
+                        for stats in self.stats]
+        for thread in self.threads:
+            thread.start()
+
+    def submit(self, fun: BatchFunctionType, batch: list[t.Any]) -> None:
+        """
+        Queue a batch of operations (blocks while the queue is full).
+
+        Args:
+            fun: function executing the batch
+            batch: list of operations (e.g. (src, dst) tuples)
+        """
+
+        if batch:
+            self.submit_task(Task(fun, batch))
+
+    def submit_task(self, task: Task) -> None:
+        """
+        Queue a task (blocks while the queue is full). A task with unfinished dependencies is held back until
+        they finish.
+
+        Args:
+            task: task to execute
+        """
+
+        with self.cond:
+            self.outstanding += 1
+            task.submitted = True
+            if task.pending:
+                return
+            while len(self.ready) >= self.queue_size:
+                self.cond.wait()
+            self.ready.append(task)
+            self.cond.notify_all()
+
+    def wait(self) -> None:
+        """
+        Wait for all the tasks submitted so far to finish (the workers keep running and more tasks can be submitted).
+        An error is not re-raised here, but by join() (check self.error to stop submitting).
+        """
+
+        with self.cond:
+            while self.outstanding:
+                self.cond.wait()
+
+    def join(self) -> list[WorkerStats]:
+        """
+        Wait for all the submitted tasks to finish, stop the workers and log their throughput.
+
+        Returns:
+            per-worker statistics
+        """
+
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for thread in self.threads:
+            thread.join()
+        self._report()
+        if self.error is not None:
+            raise self.error
+        return self.stats
+
+    def _work(self, stats: WorkerStats) -> None:
+        while True:
+            with self.cond:
+                while not self.ready and not (self.closed and not self.outstanding):
+                    self.cond.wait()
+                if not self.ready:
+                    return
+                task = self.ready.popleft()
+                self.cond.notify_all()
+            if self.error is None:  # after a failure the remaining tasks are just drained
+                start = time.perf_counter()
+                try:
+                    task.fun(task.batch)
+                except BaseException as e:  # SystemExit included (raised in _create_link)
+                    with self.cond:
+                        if self.error is None:  # the first failure is the one reported by join
+                            self.error = e
+                stats.busy += time.perf_counter() - start
+                stats.batches += 1
+                stats.operations += len(task.batch)
+            with self.cond:
+                self.outstanding -= 1
+                for dependent in task.dependents:
+                    dependent.pending -= 1
+                    if not dependent.pending and dependent.submitted:
+                        self.ready.append(dependent)
+                self.cond.notify_all()
+
+    def _report(self) -> None:
+        elapsed = time.perf_counter() - self.started
+        for stats in self.stats:
+            rate = stats.operations / stats.busy if stats.busy else 0.0
+            logging.info(f'{stats.name}: {stats.operations} operations in {stats.batches} batches, '
+                         f'busy {stats.busy:.2f}s of {elapsed:.2f}s ({rate:.0f} operations/s)')
+
+
+def prefetch(iterable: t.Iterable[_T], depth: int = 1) -> t.Iterator[_T]:
+    """
+    Iterate in a background thread, so that producing the next items overlaps with processing the current one.
+    At most depth items are produced ahead. An exception raised by the iteration is re-raised to the consumer.
+
+    Args:
+        iterable: items to produce (e.g. chunks of parsed commands)
+        depth: number of items to produce ahead
+
+    Returns:
+        iterator over the same items
+    """
+
+    done = object()
+    items: queue.Queue[t.Any] = queue.Queue(maxsize=depth)
+
+    def produce() -> None:
+        try:
+            for item in iterable:
+                items.put(item)
+        except BaseException as e:
+            items.put((done, e))
+            return
+        items.put((done, None))
+
+    threading.Thread(target=produce, name='prefetch', daemon=True).start()
+    while True:
+        item = items.get()
+        if isinstance(item, tuple) and len(item) == 2 and item[0] is done:
+            if item[1] is not None:
+                raise item[1]
+            return
+        yield item
@@ -0,0 +1,128 @@
+"""
+Persistent cache of directory listings (for incremental mapping).
+
+Listing of a directory changes only together with its modification time, so a directory whose mtime did not change
+since the previous run is not listed again - its subdirectories and (mask matching) files are taken from the cache.
+An unchanged tree is then mapped with a single stat per directory.
+
+Listings are cached per tree - i.e. per target and the settings that affect listing (mask, skip_dirs).
+"""
+
+import json
+import logging
+import os
+import typing as t
+
+_VERSION = 1
+# Listings of directories modified less than this long before they were listed are not cached.
+# A later change within the same timestamp tick (1-2s on some filesystems) would leave mtime unchanged.
+RACY_NS = 3 * 10 ** 9
+
+# cached listing: mtime_ns, names of subdirectories (to descend into), [name, inode] of files
+_EntryType = tuple[int, list[str], list[tuple[str, int]]]
+
+
+class TreeCache:
+    """
+    Cached listings of a single tree. Thread-safe (entries are only ever set, never modified).
+    """
+
+    def __init__(self, entries: dict[str, _EntryType]):
+        self.entries = entries
+        self.updated: dict[str, _EntryType] = {}
+        self.changed = False
+
+    def lookup(self, path: str, mtime_ns: int) -> 'tuple[list[str], list[tuple[str, int]]]|None':
+        """
+        Args:
+            path: directory path
+            mtime_ns: current modification time of the directory
+
+        Returns:
+            names of subdirectories and (name, inode) tuples of files or None if the directory has to be listed
+        """
+
+        entry = self.entries.get(path)
+        if entry is None or entry[0] != mtime_ns:
+            return None
+        self.updated[path] = entry
+        return entry[1], entry[2]
+
+    def store(self, path: str, mtime_ns: int, listed_at: int,
+              subdirs: list[str], files: list[tuple[str, int]]) -> None:
+        """
+        Args:
+            path: directory path
+            mtime_ns: modification time of the directory (taken before it was listed)
+            listed_at: time the directory was listed at (time.time_ns())
+            subdirs: names of subdirectories
+            files: (name, inode) tuples of files
+        """
+
+        self.changed = True
+        if mtime_ns < listed_at - RACY_NS:
+            self.updated[path] = (mtime_ns, subdirs, files)
+
+
+class MapCache:
+    """
+    Cache file holding listings of any number of trees.
+    """
+
+    def __init__(self, filename: str, full_rescan: bool = False):
+        """
+        Args:
+            filename: cache file (created if it does not exist)
+            full_rescan: ignore cached listings (the cache is still rewritten with fresh ones)
+        """
+
+        self.filename = filename
+        self.full_rescan = full_rescan
+        self.trees: dict[str, dict[str, _EntryType]] = {}
+        self.used: dict[str, TreeCache] = {}
+        if os.path.exists(filename):
+            try:
+                with open(filename) as loadfile:
+                    content = json.load(loadfile)
+                if content.get('version') == _VERSION:
+                    self.trees = content['trees']
+            except (OSError, ValueError, KeyError, AttributeError) as e:
+                logging.warning(f'Ignoring unreadable map cache {filename}: {e}')
+
+    @staticmethod
+    def tree_key(abs_path: str, mask: str, skip_dirs: t.Iterable[str]) -> str:
+        """
+        Returns:
+            key identifying tree listings
+        """
+
+        return json.dumps([abs_path, mask, sorted(skip_dirs)])
+
+    def tree(self, key: str) -> TreeCache:
+        """
+        Args:
+            key: tree key (see tree_key)
+
+        Returns:
+            cached listings of the tree
+        """
+
+        if key not in self.used:
+            self.used[key] = TreeCache({} if self.full_rescan else self.trees.get(key, {}))
+        return self.used[key]
+
+    def save(self) -> None:
+        """
+        Write the cache file - listings of trees used in this run are replaced with what was (re)listed or reused.
+        Nothing is written if all the trees were unchanged.
+        """
+
+        if all(not tree.changed and key in self.trees and len(tree.updated) == len(self.trees[key])
+               for key, tree in self.used.items()):
+            return
+        for key, tree in self.used.items():
+            self.trees[key] = tree.updated
+        tmp_filename = f'{self.filename}.tmp'
+        with open(tmp_filename, 'w') as savefile:
+            savefile.write(json.dumps({'version': _VERSION, 'trees': self.trees}, separators=(',', ':')))
+        os.replace(tmp_filename, self.filename)
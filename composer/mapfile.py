@@ -0,0 +1,300 @@
+"""
+Repository map files (as written by maprepo) - json, ndjson or index (see mapindex) format.
+
+Json format is a single dictionary of file properties by key (see RepoMap.to_dict).
+Ndjson format holds a header line and a line per mapped directory - its properties and its mapped files:
+
+    {"composer_map": 1}
+    [["/abs/target", "target/", "/abs/target/BaseOS/x86_64/all/Packages/a", "BaseOS", "x86_64",
+      "BaseOS/x86_64/all/Packages/a", "Packages/a"], [["a-1.0-1.el8.x86_64.rpm", 1234], ...]]
+    ...
+    {"composer_stamp": {"target": "/abs/target", "settings": {...}, "mtimes": {"": 1700000000000000000, ...}}}
+
+(directory properties in order of RepoDir arguments, files as (name, inode number) pairs, the optional last line
+is the stamp of the map - see maptarget.create_stamp). Ndjson and index maps saved with a stamp can be checked
+against their tree (see read_stamp and maptarget.check_stamp), json maps cannot hold one.
+
+Json and ndjson files are written while the tree is being walked (see maptarget.iter_target), so the whole map is
+never held in memory (unless keys of a json map collide, see save_map). Ndjson files can also be read as a stream
+(directory by directory). Index files are written at the end of the walk (keys have to be sorted), but are opened
+without loading them (see open_map).
+"""
+
+import json
+import os
+import typing as t
+
+import composer.mapindex as mapindex
+from composer.composer_types import MapStampDataType
+from composer.repomap import ELEM_FIELDS, RepoDir, RepoElem, RepoMap
+
+FORMATS = ('auto', 'json', 'ndjson', 'index')
+NDJSON_EXTENSION = '.ndjson'
+INDEX_EXTENSION = '.idx'
+
+_HEADER = {'composer_map': 1}
+_STAMP_KEY = 'composer_stamp'
+_TAIL_BLOCK = 1 << 16
+
+MapEntriesType = t.Iterable[tuple[RepoDir, list[tuple[str, int]]]]
+
+
+def save_map(entries: MapEntriesType, filename: str, map_format: str = 'auto',
+             stamp: 'MapStampDataType|None' = None) -> int:
+    """
+    Write a map into file as its directories come.
+    Directories with the same key prefix (e.g. AppStream and AppStream-beta with include_beta) may map files
+    to the same keys - a json map holding any is then loaded and written again, so that every key is written once,
+    with its last file (as a map keeps it).
+
+    Args:
+        entries: directories and (name, inode number) tuples of their mapped files (e.g. from maptarget.iter_target)
+        filename: name of the output file
+        map_format: 'json', 'ndjson', 'index' or 'auto' (see resolve_format)
+        stamp: stamp of the map, filled while entries are iterated (not saved in json format)
+
+    Returns:
+        number of files written
+    """
+
+    map_format = resolve_format(filename, map_format)
+    if map_format == 'index':
+        repo_map = build_map(entries)
+        mapindex.save_index(repo_map, filename, stamp)
+        return len(repo_map)
+    written = 0
+    with open(filename, 'w') as savefile:
+        if map_format == 'ndjson':
+            savefile.write(f'{json.dumps(_HEADER)}\n')
+            for directory, files in entries:
+                props = [directory.elem_abs, directory.elem_base, directory.path, directory.elem_repo,
+                         directory.elem_arch, directory.elem_rel, directory.elem_pkg]
+                savefile.write(f'{json.dumps([props, files])}\n')
+                written += len(files)
+            if stamp is not None:
+                savefile.write(f'{json.dumps({_STAMP_KEY: stamp})}\n')
+            return written
+        prefixes: set[str] = set()
+        collided = False
+        for directory, files in entries:
+            if not files:
+                continue
+            collided = collided or directory.key_prefix in prefixes
+            prefixes.add(directory.key_prefix)
+            savefile.write(',\n' if written else '{\n')
+            savefile.write(_json_entries(directory, files))
+            written += len(files)
+        savefile.write('\n}' if written else '{}')
+    if collided:
+        with open(filename) as loadfile:
+            content = json.load(loadfile)  # duplicate keys keep their first position and last value
+        with open(filename, 'w') as savefile:
+            json.dump(content, savefile, indent=2)
+        written = len(content)
+    return written
+
+
+def resolve_format(filename: str, map_format: str = 'auto') -> str:
+    """
+    Args:
+        filename: name of a map file to write
+        map_format: 'json', 'ndjson', 'index' or 'auto'
+
+    Returns:
+        map_format, for 'auto' the format given by filename extension (NDJSON_EXTENSION, INDEX_EXTENSION,
+        json otherwise)
+    """
+
+    if map_format != 'auto':
+        return map_format
+    return ('ndjson' if filename.endswith(NDJSON_EXTENSION) else
+            'index' if filename.endswith(INDEX_EXTENSION) else 'json')
+
+
+def detect_format(filename: str) -> str:
+    """
+    Recognize format of a map file by its content.
+
+    Args:
+        filename: map file
+
+    Returns:
+        'index', 'ndjson' or 'json'
+    """
+
+    if mapindex.is_index(filename):
+        return 'index'
+    with open(filename) as loadfile:
+        first_line = loadfile.readline()
+    try:
+        return 'ndjson' if json.loads(first_line) == _HEADER else 'json'
+    except ValueError:
+        return 'json'
+
+
+def iter_map(filename: str) -> t.Iterator[tuple[RepoDir, list[tuple[str, int]]]]:
+    """
+    Read a ndjson map file directory by directory.
+
+    Args:
+        filename: map file (ndjson)
+
+    Returns:
+        iterator over directories and (name, inode number) tuples of their files
+
+    Raises:
+        ValueError: if the file is not a ndjson map
+    """
+
+    with open(filename) as loadfile:
+        if json.loads(loadfile.readline() or 'null') != _HEADER:
+            raise ValueError(f'{filename} is not a ndjson map file')
+        for line in loadfile:
+            if line.strip() and not line.startswith('{'):  # the stamp is an object, directories are lists
+                props, files = json.loads(line)
+                yield RepoDir(*props), [(name, inode) for name, inode in files]
+
+
+def iter_elems(filename: str, map_format: str = 'auto') -> t.Iterator[RepoElem]:
+    """
+    Read files of a map (ndjson maps are streamed, indexes are read from the index, json maps are loaded whole
+    first).
+
+    Args:
+        filename: map file
+        map_format: 'json', 'ndjson', 'index' or 'auto' (recognized by content)
+
+    Returns:
+        iterator over mapped files
+    """
+
+    if map_format == 'auto':
+        map_format = detect_format(filename)
+    if map_format == 'index':
+        with mapindex.MapIndex(filename) as index:
+            yield from index.values()
+        return
+    if map_format == 'json':
+        yield from load_map(filename, map_format).values()
+        return
+    for directory, files in iter_map(filename):
+        for name, _ in files:
+            yield RepoElem(directory, name)
+
+
+def load_map(filename: str, map_format: str = 'auto') -> RepoMap:
+    """
+    Load a map file. Ndjson maps are built directory by directory (without loading the whole file first),
+    ndjson maps and indexes keep inode numbers.
+
+    Args:
+        filename: map file
+        map_format: 'json', 'ndjson', 'index' or 'auto' (recognized by content)
+
+    Returns:
+        repository map
+    """
+
+    if map_format == 'auto':
+        map_format = detect_format(filename)
+    if map_format == 'json':
+        with open(filename) as loadfile:
+            return RepoMap.from_dict(json.load(loadfile))
+    if map_format == 'index':
+        with mapindex.MapIndex(filename) as index:
+            repo_map = RepoMap()
+            for key, elem in index.items():
+                repo_map.add(elem.directory, elem.elem_name, index.inode(elem.directory, elem.elem_name) or 0)
+            return repo_map
+    return build_map(iter_map(filename))
+
+
+def open_map(filename: str, map_format: str = 'auto') -> 't.Union[RepoMap, mapindex.MapIndex]':
+    """
+    Open a map file for lookups - indexes are memory-mapped (see mapindex.MapIndex), other formats are loaded.
+
+    Args:
+        filename: map file
+        map_format: 'json', 'ndjson', 'index' or 'auto' (recognized by content)
+
+    Returns:
+        read-only mapping of keys to mapped files
+    """
+
+    if map_format == 'auto':
+        map_format = detect_format(filename)
+    if map_format == 'index':
+        return mapindex.MapIndex(filename)
+    return load_map(filename, map_format)
+
+
+def read_stamp(filename: str, map_format: str = 'auto') -> 'MapStampDataType|None':
+    """
+    Read stamp of a map file (just the last line of a ndjson map is read).
+
+    Args:
+        filename: map file
+        map_format: 'json', 'ndjson', 'index' or 'auto' (recognized by content)
+
+    Returns:
+        stamp the map was saved with (None if there is none)
+    """
+
+    if map_format == 'auto':
+        map_format = detect_format(filename)
+    if map_format == 'index':
+        with mapindex.MapIndex(filename) as index:
+            return index.stamp()
+    if map_format != 'ndjson':
+        return None
+    with open(filename, 'rb') as loadfile:
+        end = loadfile.seek(0, os.SEEK_END)
+        tail = b''
+        position = end
+        while position > 0 and tail.rstrip(b'\n').count(b'\n') == 0:
+            step = min(position, _TAIL_BLOCK)
+            position -= step
+            loadfile.seek(position)
+            tail = loadfile.read(step) + tail
+    last_line = tail.rstrip(b'\n').rsplit(b'\n', 1)[-1]
+    if not last_line.startswith(b'{'):
+        return None
+    return json.loads(last_line.decode('utf-8', 'surrogateescape')).get(_STAMP_KEY)
+
+
+def build_map(entries: MapEntriesType) -> RepoMap:
+    """
+    Args:
+        entries: directories and (name, inode number) tuples of their mapped files
+
+    Returns:
+        repository map of all the files (added in order)
+    """
+
+    repo_map = RepoMap()
+    add = repo_map.add
+    for directory, files in entries:
+        for name, inode in files:
+            add(directory, name, inode)
+    return repo_map
+
+
+def _json_entries(directory: RepoDir, files: list[tuple[str, int]]) -> str:
+    """
+    Format files of a directory the way json.dumps(repo_map.to_dict(), indent=2) does (without the enclosing braces).
+    Properties shared by the directory are encoded just once (and json.dumps of a string is not slowed down
+    by the pure-python encoder used for indented output).
+    """
+
+    dumps = json.dumps
+    values = {field: dumps(getattr(directory, field))
+              for field in ELEM_FIELDS if field not in ('elem_name', 'elem_path')}
+    key_prefix = directory.key_prefix
+    path = directory.path
+    chunks = []
+    for name, _ in files:
+        values['elem_name'] = dumps(name)
+        values['elem_path'] = dumps(os.path.join(path, name))
+        fields = ',\n'.join([f'    "{field}": {values[field]}' for field in ELEM_FIELDS])
+        chunks.append(f'  {dumps(key_prefix + name)}: {{\n{fields}\n  }}')
+    return ',\n'.join(chunks)
@@ -0,0 +1,266 @@
+"""
+Memory-mapped repository map index.
+
+An index file holds the keys of a map sorted, so a key is looked up by binary search directly in the (memory-mapped)
+file - opening an index does not deserialize its files at all, and pages of the file are shared by all the processes
+using it. Layout (little-endian, sections aligned to 8 bytes):
+
+    magic (8 bytes) | header: number of files, sizes of directory table, extra keys, stamp and key blob (uint64)
+    directory table: json list of directory properties (in order of RepoDir arguments)
+    extra keys: json object {key: [directory id, file name]} of keys not ending with their file name
+    stamp: json stamp of the map (see maptarget.create_stamp) or null
+    key offsets: number of files + 1 (uint64) - key i is key_blob[offsets[i]:offsets[i + 1]] (utf-8)
+    directory ids: number of files (uint32)
+    map order: number of files (uint32) - positions of keys in the order they were added to the map
+    inode numbers: number of files (uint64, 0 if unknown)
+    key blob: sorted keys (utf-8)
+"""
+
+import bisect
+import collections.abc
+import json
+import mmap
+import struct
+import sys
+import typing as t
+
+from composer.composer_types import MapStampDataType
+from composer.repomap import RepoDir, RepoElem, RepoMap
+
+_MAGIC = b'CMPMAPX1'
+_HEADER = struct.Struct('<5Q')
+# every _FENCE_STRIDE-th key is kept in memory (read on first lookup) to narrow down the search in the file
+_FENCE_STRIDE = 64
+
+
+def is_index(filename: str) -> bool:
+    """
+    Returns:
+        True if filename is a map index file
+    """
+
+    with open(filename, 'rb') as indexfile:
+        return indexfile.read(len(_MAGIC)) == _MAGIC
+
+
+def save_index(repo_map: RepoMap, filename: str, stamp: 'MapStampDataType|None' = None) -> None:
+    """
+    Write a map index.
+
+    Args:
+        repo_map: map to index
+        filename: name of the output file
+        stamp: stamp of the map (to check it against its tree later)
+    """
+
+    dirs: dict[RepoDir, int] = {}
+    extras: dict[str, tuple[int, str]] = {}
+    records = []
+    for position, (key, elem) in enumerate(repo_map.items()):
+        dir_id = dirs.setdefault(elem.directory, len(dirs))
+        if key != elem.directory.key_prefix + elem.elem_name:
+            extras[key] = (dir_id, elem.elem_name)
+        records.append((key.encode('utf-8', 'surrogateescape'), dir_id,
+                        repo_map.inode(elem.directory, elem.elem_name) or 0, position))
+    records.sort()
+    order = [0] * len(records)
+    for i, record in enumerate(records):
+        order[record[3]] = i
+    dir_table = json.dumps([[d.elem_abs, d.elem_base, d.path, d.elem_repo, d.elem_arch, d.elem_rel, d.elem_pkg]
+                            for d in dirs]).encode('utf-8', 'surrogateescape')
+    extra_table = json.dumps(extras).encode('utf-8', 'surrogateescape')
+    stamp_table = json.dumps(stamp).encode('utf-8', 'surrogateescape')
+    offsets = [0]
+    for key, _, _, _ in records:
+        offsets.append(offsets[-1] + len(key))
+    count = len(records)
+    with open(filename, 'wb') as indexfile:
+        indexfile.write(_MAGIC)
+        indexfile.write(_HEADER.pack(count, len(dir_table), len(extra_table), len(stamp_table), offsets[-1]))
+        indexfile.write(_pad(dir_table))
+        indexfile.write(_pad(extra_table))
+        indexfile.write(_pad(stamp_table))
+        indexfile.write(struct.pack(f'<{count + 1}Q', *offsets))
+        indexfile.write(_pad(struct.pack(f'<{count}I', *(dir_id for _, dir_id, _, _ in records))))
+        indexfile.write(_pad(struct.pack(f'<{count}I', *order)))
+        indexfile.write(struct.pack(f'<{count}Q', *(inode for _, _, inode, _ in records)))
+        indexfile.write(b''.join(key for key, _, _, _ in records))
+
+
+class _Keys(collections.abc.Sequence):
+    """
+    Sorted keys of an index (as bytes), read from the index on access.
+    """
+
+    def __init__(self, data: mmap.mmap, start: int, offsets: t.Sequence[int]):
+        self.data = data
+        self.start = start
+        self.offsets = offsets
+        self.size = len(offsets) - 1
+
+    def __getitem__(self, i: t.Any) -> t.Any:
+        offsets = self.offsets
+        return self.data[self.start + offsets[i]:self.start + offsets[i + 1]]
+
+    def __len__(self) -> int:
+        return self.size
+
+
+class MapIndex(collections.abc.Mapping):
+    """
+    Read-only repository map backed by a memory-mapped index file (see save_index) - a mapping of keys
+    (repo:arch:Packages/x:file_name) to RepoElem, iterated in the order of the indexed map.
+    """
+
+    def __init__(self, filename: str):
+        """
+        Args:
+            filename: index file
+
+        Raises:
+            ValueError: if the file is not a map index
+        """
+
+        with open(filename, 'rb') as indexfile:
+            self._mmap = data = mmap.mmap(indexfile.fileno(), 0, access=mmap.ACCESS_READ)
+        self._columns: list[t.Sequence[int]] = []
+        try:
+            if data[:len(_MAGIC)] != _MAGIC:
+                raise ValueError('wrong magic number')
+            offset = len(_MAGIC)
+            count, dirs_size, extras_size, stamp_size, blob_size = _HEADER.unpack_from(data, offset)
+            offset += _HEADER.size
+            dirs = json.loads(data[offset:offset + dirs_size].decode('utf-8', 'surrogateescape'))
+            self._dirs = [RepoDir(*props) for props in dirs]
+            offset += _padded(dirs_size)
+            extras = json.loads(data[offset:offset + extras_size].decode('utf-8', 'surrogateescape'))
+            self._extras = {key: RepoElem(self._dirs[dir_id], name) for key, (dir_id, name) in extras.items()}
+            offset += _padded(extras_size)
+            self._stamp = data[offset:offset + stamp_size]
+            offset += _padded(stamp_size)
+            self._columns.append(_column(data, offset, 'Q', count + 1))
+            offset += 8 * (count + 1)
+            self._columns.append(_column(data, offset, 'I', count))
+            offset += _padded(4 * count)
+            self._columns.append(_column(data, offset, 'I', count))
+            offset += _padded(4 * count)
+            self._columns.append(_column(data, offset, 'Q', count))
+            offset += 8 * count
+            if offset + blob_size != len(data):
+                raise ValueError('size mismatch')
+        except (ValueError, struct.error) as e:
+            self.close()
+            raise ValueError(f'Invalid map index {filename}: {e}') from e
+        offsets, self._dir_ids, self._order, self._inodes = self._columns
+        self._keys = _Keys(data, offset, offsets)
+        self._fence: 'list[bytes]|None' = None
+
+    def close(self) -> None:
+        """
+        Unmap the index file (the index cannot be used afterwards).
+        """
+
+        for column in self._columns:
+            if isinstance(column, memoryview):
+                column.release()
+        self._mmap.close()
+
+    def __enter__(self) -> 'MapIndex':
+        return self
+
+    def __exit__(self, *exc_info: t.Any) -> None:
+        self.close()
+
+    def _find(self, key: str) -> int:
+        """
+        Returns:
+            position of key in the index (-1 if it is not there)
+        """
+
+        encoded = key.encode('utf-8', 'surrogateescape')
+        if self._fence is None:
+            self._fence = [self._keys[i] for i in range(0, len(self._keys), _FENCE_STRIDE)]
+        block = bisect.bisect_right(self._fence, encoded) - 1
+        if block < 0:
+            return -1
+        lo = block * _FENCE_STRIDE
+        i = bisect.bisect_left(self._keys, encoded, lo, min(lo + _FENCE_STRIDE, len(self._keys)))
+        return i if i < len(self._keys) and self._keys[i] == encoded else -1
+
+    def __getitem__(self, key: str) -> RepoElem:
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        extra = self._extras.get(key)
+        if extra is not None:
+            return extra
+        directory = self._dirs[self._dir_ids[i]]
+        return RepoElem(directory, key[len(directory.key_prefix):])
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self._find(key) >= 0
+
+    def __iter__(self) -> t.Iterator[str]:
+        keys = self._keys
+        for i in self._order:
+            yield keys[i].decode('utf-8', 'surrogateescape')
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __repr__(self) -> str:
+        return f'MapIndex({len(self)} files)'
+
+    def inode(self, directory: RepoDir, elem_name: str) -> 'int|None':
+        """
+        Args:
+            directory: directory of a mapped file
+            elem_name: file name
+
+        Returns:
+            inode number of the file as recorded while mapping (None if unknown or if the file is not in the index)
+        """
+
+        key = directory.key_prefix + elem_name
+        i = self._find(key)
+        if i < 0 or key in self._extras or self._dirs[self._dir_ids[i]] is not directory:
+            return None
+        return self._inodes[i] or None
+
+    def stamp(self) -> 'MapStampDataType|None':
+        """
+        Returns:
+            stamp of the map (None if it has not been saved with one)
+        """
+
+        return json.loads(self._stamp.decode('utf-8', 'surrogateescape'))
+
+    def directories(self) -> set[RepoDir]:
+        """
+        Returns:
+            directories of all the indexed files
+        """
+
+        return set(self._dirs)
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b'\0' * (_padded(len(data)) - len(data))
+
+
+def _padded(size: int) -> int:
+    return (size + 7) // 8 * 8
+
+
+def _column(data: mmap.mmap, offset: int, typecode: t.Literal['I', 'Q'], count: int) -> t.Sequence[int]:
+    """
+    Returns:
+        count little-endian integers of typecode starting at offset (a view of the index, if byte order allows)
+    """
+
+    size = struct.calcsize(typecode) * count
+    if offset + size > len(data):
+        raise ValueError('truncated')
+    if sys.byteorder == 'little':
+        return memoryview(data)[offset:offset + size].cast(typecode)
+    return struct.unpack_from(f'<{count}{typecode}', data, offset)
@@ -1,6 +1,39 @@
+import bz2
+import argparse
+import codecs
+import collections
+import concurrent.futures
+import email.message
+import html.parser
+import http.client
 import logging
+import lzma
+import os
+import threading
+import time
+import typing as t
+import urllib.error
+import urllib.parse
 import urllib.request
-from bs4 import BeautifulSoup
+import zlib
+from xml.etree import ElementTree
+
+import composer.maptarget as maptarget
+from composer.remotecache import ListingCache
+from composer.repomap import RepoMap
+
+_REDIRECTS = (301, 302, 303, 307, 308)
+_MAX_REDIRECTS = 5
+_CHUNK_SIZE = 1 << 16
+
+_HostType = tuple[str, str]  # scheme, netloc
+FetchFunctionType = t.Callable[[str, dict[str, str]], tuple[email.message.Message, t.Iterable[bytes]]]
+LinksFunctionType = t.Callable[[t.Iterable[bytes]], t.Iterator[str]]
+
+# listings fetched at once when mapping a remote source (at least, more with more threads)
+_SOURCE_THREADS = 8
+_REPO_NS = '{http://linux.duke.edu/metadata/repo}'
+_COMMON_NS = '{http://linux.duke.edu/metadata/common}'
 
 
 class TreeElement:
@@ -13,17 +46,187 @@ class TreeElement:
         self.parent_to = {}
 
 
-def write_repo_tree_shell(baseurl: str, output_file: str) -> None:
+class ConnectionPool:
+    """
+    Keep-alive HTTP(S) connections, reused per host by the threads of the crawler (see _create_mapped_repo).
+    """
+
+    def __init__(self, timeout: float = 60):
+        """
+        Args:
+            timeout: timeout of connections (in seconds)
+        """
+
+        self.timeout = timeout
+        self.opened = 0  # number of connections opened so far
+        self._idle: dict[_HostType, list[http.client.HTTPConnection]] = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def fetch(self, url: str, headers: 'dict[str, str]|None' = None) -> tuple[email.message.Message, t.Iterator[bytes]]:
+        """
+        Request url (following redirects) over an idle connection to its host (a new one if there is none).
+        The body is read in chunks as it is iterated, the connection is reused once the whole body is read.
+
+        Args:
+            url: http(s) url
+            headers: additional request headers (e.g. of a conditional request)
+
+        Returns:
+            headers of the response and iterator over chunks of its body
+
+        Raises:
+            urllib.error.HTTPError: if the server responds with an error (or 304 Not Modified)
+            ValueError: if url is not a http(s) url
+        """
+
+        for _ in range(_MAX_REDIRECTS + 1):
+            host, connection, response = self._request(url, headers or {})
+            location = response.getheader('Location')
+            if response.status not in _REDIRECTS or not location:
+                break
+            self._release(host, connection, response)
+            url = urllib.parse.urljoin(url, location)
+        if response.status >= 300:
+            self._release(host, connection, response)
+            raise urllib.error.HTTPError(url, response.status, response.reason, response.headers, None)
+        return response.headers, self._read(host, connection, response)
+
+    def _read(self, host: _HostType, connection: http.client.HTTPConnection,
+              response: http.client.HTTPResponse) -> t.Iterator[bytes]:
+        complete = False
+        try:
+            for chunk in iter(lambda: response.read(_CHUNK_SIZE), b''):
+                yield chunk
+            complete = True
+        finally:
+            if complete:
+                self._release(host, connection, response)
+            else:
+                connection.close()
+
+    def close(self) -> None:
+        """
+        Close all the idle connections.
+        """
+
+        with self._lock:
+            for connections in self._idle.values():
+                for connection in connections:
+                    connection.close()
+            self._idle.clear()
+
+    def _request(self, url: str,
+                 headers: dict[str, str]) -> tuple[_HostType, http.client.HTTPConnection, http.client.HTTPResponse]:
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme not in ('http', 'https'):
+            raise ValueError(f'unknown url type: {url}')
+        host = (parts.scheme, parts.netloc)
+        path = urllib.parse.urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        while True:
+            connection, reused = self._connection(host)
+            try:
+                connection.request('GET', path, headers=headers)
+                return host, connection, connection.getresponse()
+            except (http.client.HTTPException, OSError):
+                connection.close()
+                if not reused:  # the server may have closed an idle connection meanwhile - retry on a new one
+                    raise
+
+    def _release(self, host: _HostType, connection: http.client.HTTPConnection,
+                 response: http.client.HTTPResponse) -> None:
+        """
+        Read the rest of response and keep its connection for further requests (unless the server closes it).
+        """
+
+        response.read()
+        if response.will_close:
+            connection.close()
+            return
+        with self._lock:
+            self._idle[host].append(connection)
+
+    def _connection(self, host: _HostType) -> tuple[http.client.HTTPConnection, bool]:
+        """
+        Returns:
+            connection to host and whether it is an idle one (rather than a new one)
+        """
+
+        with self._lock:
+            if self._idle[host]:
+                return self._idle[host].pop(), True
+            self.opened += 1
+        scheme, netloc = host
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout), False
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+
+def iter_links(chunks: t.Iterable[bytes]) -> t.Iterator[str]:
+    """
+    Extract link targets (href values of <a> tags) of a html page (utf-8) while it is being read.
+
+    Args:
+        chunks: content of the page (e.g. as fetched by ConnectionPool.fetch)
+
+    Returns:
+        iterator over link targets (in order of the page)
+    """
+
+    parser = _LinkParser()
+    decoder = codecs.getincrementaldecoder('utf-8')('replace')
+    for chunk in chunks:
+        parser.feed(decoder.decode(chunk))
+        yield from parser.hrefs
+        parser.hrefs.clear()
+    parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+    yield from parser.hrefs
+
+
+def iter_links_bs4(chunks: t.Iterable[bytes]) -> t.Iterator[str]:
+    """
+    Extract link targets as iter_links does, using BeautifulSoup (an optional dependency) - the whole page
+    is read and parsed into a tree first.
+
+    Args:
+        chunks: content of the page
+
+    Returns:
+        iterator over link targets (in order of the page)
+
+    Raises:
+        ImportError: if bs4 is not installed
+    """
+
+    from bs4 import BeautifulSoup
+    soup = BeautifulSoup(b''.join(chunks), 'html.parser', from_encoding='utf-8')
+    for link in soup.find_all('a'):
+        href = link.get('href')
+        if href:
+            yield str(href)
+
+
+HTML_PARSERS: dict[str, LinksFunctionType] = {'stdlib': iter_links, 'bs4': iter_links_bs4}
+
+
+def write_repo_tree_shell(baseurl: str, output_file: str, threads: int = 8, html_parser: str = 'stdlib',
+                          cache: 'ListingCache|None' = None, repodata: bool = False) -> None:
     """
     Models baseurl repository and writes a bash script that is able to
     locally recreate a mock of that repository (using mkdirs and touches).
     Args:
-        baseurl: url of a remote repository
+        baseurl: url of a remote repository (http(s):// or file://)
         output_file: outputfile to write the script to (will overwrite)
+        threads: number of directory listings fetched at once
+        html_parser: parser of the listings (see HTML_PARSERS)
+        cache: cache of listings (requested conditionally, see remotecache)
+        repodata: map files of repositories from their metadata instead of listing their directories
     """
 
     results = []
-    repo = _create_mapped_repo(baseurl)
+    repo = _create_mapped_repo(baseurl, threads, links=HTML_PARSERS[html_parser], cache=cache, repodata=repodata)
+    if cache:
+        cache.save()
     (mkdirs, touches) = _debug_recreate_repo_tree(repo, [], [])
     results += mkdirs
     results += touches
@@ -32,26 +235,164 @@ def write_repo_tree_shell(baseurl: str, output_file: str) -> None:
         for line in results:
             savefile.write(line+'\n')
 
+
+def is_url(target: str) -> bool:
+    """
+    Returns:
+        True if target is an url of a remote repository (mapped by map_remote) rather than a directory
+    """
+
+    return urllib.parse.urlsplit(target).scheme in ('http', 'https', 'file')
+
+
+def map_remote(baseurl: str, args: argparse.Namespace, cache: 'ListingCache|None' = None) -> RepoMap:
+    """
+    Map a remote repository straight from its listings (or repodata), into the same map maptarget.map_target
+    creates of a local tree - nothing is written to disk. Directories matching skip_dirs are not fetched at all.
+
+    Args:
+        baseurl: url of a remote repository (http(s):// or file://)
+        args: argparse object (requires: <map_target requirements>; optional: threads, listing_cache - cache file
+                               of the listings, full_rescan, skip_unchanged (see ListingCache), repodata - map
+                               repositories from their metadata)
+        cache: cache of listings to use instead of listing_cache (the caller saves it)
+
+    Returns:
+        map (RepoMap) of the repository (empty if its listing cannot be fetched)
+    """
+
+    listing_cache = getattr(args, 'listing_cache', None)
+    own_cache = None
+    if cache is None and listing_cache:
+        cache = own_cache = ListingCache(listing_cache, getattr(args, 'full_rescan', False),
+                                         getattr(args, 'skip_unchanged', False))
+    threads = max(getattr(args, 'threads', 1) or 1, _SOURCE_THREADS)
+    repo = _create_mapped_repo(baseurl, threads, cache=cache, repodata=getattr(args, 'repodata', False),
+                               skip=maptarget.skipped_dirs(baseurl, args))
+    if own_cache:
+        own_cache.save()
+    if repo is None:
+        logging.warning(f'Remote repository {baseurl} cannot be listed! Return empty!')
+        return RepoMap()
+    return maptarget.map_listed(baseurl, _iter_listed(repo, baseurl.rstrip('/')), args)
+
 # Internal
 
 
-def _create_mapped_repo(baseurl: str) -> 'TreeElement|None':
+def _create_mapped_repo(baseurl: str, threads: int = 8, fetch: 'FetchFunctionType|None' = None,
+                        links: LinksFunctionType = iter_links, cache: 'ListingCache|None' = None,
+                        repodata: bool = False,
+                        skip: 't.Callable[[str, str], bool]|None' = None) -> 'TreeElement|None':
+    """
+    Map a remote repository. Directory listings are fetched by a pool of threads (at most threads requests
+    in flight) over keep-alive connections (see ConnectionPool) - a directory is fetched as soon as its parent
+    listing is parsed. Entries of every directory keep the order of its listing, so the tree does not depend
+    on the order the listings come in.
+    With a cache, listings are requested conditionally - unchanged ones are taken from the cache (and so are all
+    the listings under them, if the cache skips unchanged subtrees).
+    With repodata, a directory listing repodata/ is mapped from its metadata (see _map_repodata) - only its
+    subdirectories without packages (e.g. images/) are listed further. If the metadata cannot be read, the directory
+    is crawled as usual.
+
+    Args:
+        baseurl: url of a remote repository (file:// directories are listed locally)
+        threads: number of directory listings fetched at once
+        fetch: function requesting a url (a ConnectionPool is used by default, urlopen for file:// urls)
+        links: function extracting link targets of a listing
+        cache: cache of listings (the caller saves it)
+        repodata: map directories with repodata/ from their metadata
+        skip: function telling whether a directory (its name and unquoted url) is left out, without being listed
+
+    Returns:
+        root of the repository tree (None if its listing cannot be fetched), directories which cannot be fetched
+        are None
+    """
+
+    local = urllib.parse.urlsplit(baseurl).scheme == 'file'
+    connections = ConnectionPool() if fetch is None and not local else None
+    fetch = connections.fetch if connections else fetch or _urlopen
+    if cache:
+        cache.crawl(baseurl)
+    skip_unchanged = cache is not None and cache.skip_unchanged
     root = TreeElement('/', 'dir', baseurl)
-    if root:
-        return _recursive_map_target(root, baseurl)
-    else:
-        return None
+    stats: collections.Counter[str] = collections.Counter()
+    repositories = 0
+    start = time.perf_counter()
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(threads, 1)) as pool:
+            # parent, directory, its relative url, whether listings under it are cached_only, metadata requested
+            pending: dict[concurrent.futures.Future, tuple['TreeElement|None', TreeElement, str, bool, bool]] = {
+                pool.submit(_map_target, root, baseurl, '', fetch, links, cache): (None, root, '', False, False)}
+            while pending:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    parent, current_root, rel, cached_only, metadata = pending.pop(future)
+                    covered: 'set[str]|None' = set()
+                    if metadata:
+                        covered = future.result()
+                        repositories += covered is not None
+                    else:
+                        mapped, source = future.result()
+                        stats[source] += 1
+                        if mapped is None:
+                            if parent is None:
+                                return None
+                            parent.parent_to[current_root.elem_name] = None
+                            continue
+                        cached_only = skip_unchanged and source != 'fetched'
+                        sub = current_root.parent_to.get('repodata/')
+                        if repodata and sub is not None and sub.elem_type == 'dir':
+                            future = pool.submit(_map_repodata, current_root, baseurl, rel, fetch)
+                            pending[future] = (parent, current_root, rel, cached_only, True)
+                            continue
+                    for sub in list(current_root.parent_to.values()):
+                        if sub is not None and sub.elem_type == 'dir' and sub.elem_name not in (covered or ()):
+                            sub_url = rel + '/' + sub.elem_name if rel and rel[-1] != '/' else rel + sub.elem_name
+                            if skip and skip(urllib.parse.unquote(sub.elem_name).rstrip('/'),
+                                             baseurl.rstrip('/') + '/' + urllib.parse.unquote(sub_url).rstrip('/')):
+                                del current_root.parent_to[sub.elem_name]
+                                continue
+                            future = pool.submit(_map_target, sub, baseurl, sub_url, fetch, links, cache,
+                                                 cached_only)
+                            pending[future] = (current_root, sub, sub_url, cached_only, False)
+    finally:
+        if connections:
+            connections.close()
+    elapsed = time.perf_counter() - start
+    listings = sum(stats.values())
+    logging.info(f'Mapped {listings} listings in {elapsed:.2f}s ({listings / elapsed:.0f} listings/s)' +
+                 (f': {stats["fetched"]} fetched, {stats["not modified"]} not modified, '
+                  f'{stats["cached"]} taken from the cache' if cache else '') +
+                 (f', {repositories} repositories mapped from repodata' if repodata else ''))
+    return root
 
 
-def _recursive_map_target(current_root: 'TreeElement|None', base: str, rel: str = '') -> 'TreeElement|None':
-    current_root = _map_target(current_root, base, rel)
-    if not current_root:
-        return None
-    for sub in current_root.parent_to.values():
-        if sub.elem_type == 'dir':
-            sub_url = rel + '/' + sub.elem_name if rel and rel[-1] != '/' else rel + sub.elem_name
-            current_root.parent_to[sub.elem_name] = _recursive_map_target(sub, base, sub_url)
-    return current_root
+def _iter_listed(repo_root: TreeElement, path: str) -> t.Iterator[tuple[str, list[str]]]:
+    """
+    Iterate a mapped repository top-down, as maptarget.map_listed takes it.
+
+    Args:
+        repo_root: root of the repository tree
+        path: url of the root (without the trailing slash)
+
+    Returns:
+        iterator over (unquoted) urls of directories and names of their files
+    """
+
+    stack = [(repo_root, path)]
+    while stack:
+        element, element_path = stack.pop()
+        dirs, files = [], []
+        for sub in element.parent_to.values():
+            if sub is None:
+                continue
+            name = urllib.parse.unquote(sub.elem_name)
+            if sub.elem_type == 'dir':
+                dirs.append((sub, f'{element_path}/{name.rstrip("/")}'))
+            else:
+                files.append(name)
+        yield element_path, files
+        stack += reversed(dirs)
 
 
 def _debug_recreate_repo_tree(repo_root: 'TreeElement|None', mkdirs: list[str],
@@ -68,19 +409,139 @@ def _debug_recreate_repo_tree(repo_root: 'TreeElement|None', mkdirs: list[str],
     return (mkdirs, touches)
 
 
-def _map_target(current_root: 'TreeElement|None', base: str, rel: str = '') -> 'TreeElement|None':
+def _map_target(current_root: 'TreeElement|None', base: str, rel: str = '', fetch: 'FetchFunctionType|None' = None,
+                links: LinksFunctionType = iter_links, cache: 'ListingCache|None' = None,
+                cached_only: bool = False) -> 'tuple[TreeElement|None, str]':
+    """
+    Returns:
+        current_root with entries of its listing added (None if it cannot be fetched) and where the listing comes
+        from - 'fetched', 'not modified' (304, cached) or 'cached' (not requested, as cached_only)
+    """
+
     if current_root is None:
-        return None
+        return None, 'fetched'
     target = base + '/' + rel if base[-1] != '/' else base + rel
+    if urllib.parse.urlsplit(target).scheme == 'file':
+        try:
+            return _add_entries(current_root, _list_local(target), base, rel), 'fetched'
+        except OSError:
+            return None, 'fetched'
+    cached = cache.lookup(target) if cache else None
+    if cache and cached is not None and cached_only:
+        return _add_entries(current_root, cache.reuse(target), base, rel), 'cached'
     logging.info(f'Mapping remote target {target}')
     try:
-        with urllib.request.urlopen(target) as response:
-            html = response.read()
-    except (urllib.error.HTTPError, ValueError):
+        headers, chunks = (fetch or _urlopen)(target, cache.conditions(target) if cache else {})
+        hrefs = list(links(chunks))
+    except urllib.error.HTTPError as e:
+        if cache and cached is not None and e.code == 304:
+            return _add_entries(current_root, cache.reuse(target), base, rel), 'not modified'
+        return None, 'fetched'
+    except ValueError:
+        return None, 'fetched'
+    if cache:
+        cache.store(target, headers, hrefs)
+    return _add_entries(current_root, hrefs, base, rel), 'fetched'
+
+
+def _map_repodata(current_root: TreeElement, base: str, rel: str, fetch: FetchFunctionType) -> 'set[str]|None':
+    """
+    Add files of a repository directory listed by its metadata - repodata/repomd.xml, the files it references
+    and locations of all the packages of primary.xml (decompressed and parsed as it is read, see _iter_locations).
+    Files not referenced by the metadata (e.g. signatures of repomd.xml) are left out. Names are quoted
+    as links of a listing are.
+
+    Returns:
+        names of the subdirectories of current_root holding the files (None if the metadata cannot be read)
+    """
+
+    target = base + '/' + rel if base[-1] != '/' else base + rel
+    logging.info(f'Mapping remote repository metadata {target}repodata/')
+    try:
+        _, chunks = fetch(target + 'repodata/repomd.xml', {})
+        repomd = ElementTree.fromstring(b''.join(chunks))
+        files, primary = ['repodata/repomd.xml'], None
+        for data in repomd.iter(f'{_REPO_NS}data'):
+            location = data.find(f'{_REPO_NS}location')
+            href = location.get('href') if location is not None else None
+            if href:
+                files.append(href)
+                if data.get('type') == 'primary':
+                    primary = href
+        if primary is None:
+            raise ValueError('no primary metadata')
+        _, chunks = fetch(target + primary, {})
+        files += _iter_locations(chunks, primary)
+    except (OSError, ValueError, ElementTree.ParseError, EOFError, lzma.LZMAError, zlib.error) as e:
+        logging.warning(f'Cannot read metadata of {target}, listing it instead: {e}')
         return None
-    soup = BeautifulSoup(html, 'html.parser', from_encoding='utf-8')
-    for packages in soup.find_all('a'):
-        href = packages.get('href')
+    covered = set()
+    for path in sorted(set(files)):
+        *dirs, name = urllib.parse.quote(path).split('/')
+        element, element_rel = current_root, rel
+        for directory in dirs:
+            sub = element.parent_to.get(directory + '/')
+            if sub is None or sub.elem_type != 'dir':
+                sub = element.parent_to[directory + '/'] = TreeElement(directory + '/', 'dir', base, element_rel)
+            element, element_rel = sub, element_rel + directory + '/'
+        if dirs and name:
+            covered.add(dirs[0] + '/')
+            element.parent_to[name] = TreeElement(name, 'file', base, element_rel)
+    return covered
+
+
+def _iter_locations(chunks: t.Iterable[bytes], filename: str) -> t.Iterator[str]:
+    """
+    Iterate locations of packages of a (compressed) primary.xml - parsed incrementally, elements of every package
+    are dropped once it is read, so memory does not grow with the size of the file.
+
+    Args:
+        chunks: content of the file
+        filename: name of the file (its extension selects decompression: .gz, .xz, .bz2 or none for .xml)
+    """
+
+    decompress = _decompressor(filename)
+    parser: 'ElementTree.XMLPullParser[ElementTree.Element]' = ElementTree.XMLPullParser(events=('start', 'end'))
+    root = None
+    for chunk in chunks:
+        parser.feed(decompress(chunk))
+        for event, element in t.cast(t.Iterator[tuple[str, ElementTree.Element]], parser.read_events()):
+            if root is None:
+                root = element
+            elif event == 'end' and element.tag == f'{_COMMON_NS}location':
+                href = element.get('href')
+                if href:
+                    yield href
+            elif event == 'end' and element.tag == f'{_COMMON_NS}package':
+                root.clear()
+    parser.close()
+
+
+def _decompressor(filename: str) -> t.Callable[[bytes], bytes]:
+    if filename.endswith('.gz'):
+        return zlib.decompressobj(zlib.MAX_WBITS | 32).decompress
+    if filename.endswith('.xz'):
+        return lzma.LZMADecompressor().decompress
+    if filename.endswith('.bz2'):
+        return bz2.BZ2Decompressor().decompress
+    if filename.endswith('.xml'):
+        return bytes
+    raise ValueError(f'unsupported compression of {filename}')
+
+
+def _list_local(url: str) -> list[str]:
+    """
+    Returns:
+        names of the entries of a file:// directory in the form of listing links (quoted, directories end with /)
+    """
+
+    with os.scandir(urllib.request.url2pathname(urllib.parse.urlsplit(url).path)) as entries:
+        return [urllib.parse.quote(name) for name in
+                sorted(entry.name + '/' if entry.is_dir() else entry.name for entry in entries)]
+
+
+def _add_entries(current_root: TreeElement, hrefs: t.Iterable[str], base: str, rel: str) -> TreeElement:
+    for href in hrefs:
         if href == '../':
             continue
         if href[-1] == '/':
@@ -90,3 +551,29 @@ def _map_target(current_root: 'TreeElement|None', base: str, rel: str = '') -> '
             element = TreeElement(href, 'file', base, rel)
             current_root.parent_to[element.elem_name] = element
     return current_root
+
+
+class _LinkParser(html.parser.HTMLParser):
+    """
+    Collects href values of <a> tags (the last one if a tag repeats it, empty ones are skipped).
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.hrefs: list[str] = []
+
+    def handle_starttag(self, tag: str, attrs: list[tuple[str, 'str|None']]) -> None:
+        if tag == 'a':
+            href = dict(attrs).get('href')
+            if href:
+                self.hrefs.append(href)
+
+
+def _urlopen(url: str, headers: 'dict[str, str]|None' = None) -> tuple[email.message.Message, t.Iterator[bytes]]:
+    response = urllib.request.urlopen(urllib.request.Request(url, headers=headers or {}))
+    return response.headers, _read_response(response)
+
+
+def _read_response(response: t.Any) -> t.Iterator[bytes]:
+    with response:
+        yield from iter(lambda: response.read(_CHUNK_SIZE), b'')
@@ -1,61 +1,255 @@
+import abc
 import argparse
+import collections
+import concurrent.futures
+import json
 import logging
 import re
 import os
+import threading
+import time
+import typing as t
 
+import composer.mapcache as mapcache
+from composer.composer_types import MapStampDataType
+from composer.mapcache import MapCache
+from composer.repomap import RepoDir, RepoMap
 
-def map_target(target: str, args: argparse.Namespace) -> dict[str, dict[str, str]]:
+# Depth (relative to the mapped target) at which a tree is split into independently walked subtrees.
+# Both supported layouts (repo/arch and arch/repo) keep a single repo/arch pair below this level.
+_SPLIT_DEPTH = 2
+# Arguments affecting what a tree maps to - a map is reused only if it was created with the same ones.
+_STAMP_SETTINGS = ('mask', 'skip_dirs', 'archs', 'repo_priority', 'include_beta', 'include_extra')
+
+
+class Classifier(abc.ABC):
+    """
+    Classifier of mapped files run during the walk (see map_targets) - classify is called with each mapped directory
+    and its mapped files (from worker threads, in no particular order). Whatever it returns is collected into results
+    in the order of the walk, once the target is mapped.
+    """
+
+    def __init__(self) -> None:
+        self.results: list[t.Any] = []
+
+    @abc.abstractmethod
+    def classify(self, directory: RepoDir, names: list[str]) -> list[t.Any]:
+        """
+        Args:
+            directory: mapped directory
+            names: names of its mapped files (in order of the listing)
+
+        Returns:
+            results for the files of the directory
+        """
+
+
+def map_target(target: str, args: argparse.Namespace, classifiers: t.Sequence[Classifier] = ()) -> RepoMap:
     """
     Map a directory and create a dictionary that lists relevant files and its properties.
     Properties are indexed using unique keys (a set of concatenated file properties).
-    Some directory patterns may be skipped using skip_dirs argument.
+    Some directory patterns may be skipped using skip_dirs argument (skipped subtrees are not walked at all).
     Dictionary is returned.
 
     Args:
         target: target directory to use as the base for repo-dictionary
         args: argparse object (requires: mask, skip_dirs, archs, repo_priority, include_beta, include_extra)
+        classifiers: classifiers to run on the mapped files
 
     Returns:
-        dictionary consisting of indexed file paths/properties.
+        map (RepoMap) consisting of indexed file paths/properties.
 
     Note:
         A hardcoded 'Packages' directory needs to exist somewhere in the tree
     """
 
+    return map_targets([target], args, [classifiers])[0]
+
+
+def map_targets(targets: list[str], args: argparse.Namespace,
+                classifiers: t.Sequence[t.Sequence[Classifier]] = (),
+                targets_args: t.Sequence[argparse.Namespace] = ()) -> list[RepoMap]:
+    """
+    Map several targets at the same time.
+    Each target is split into its repo/arch subtrees, which are walked (using os.scandir) in a pool of worker threads
+    shared by all the targets.
+
+    Args:
+        targets: target directories to map
+        args: argparse object (requires: <map_target requirements>; optional: threads - size of the worker pool,
+                               map_cache - cache file of directory listings, full_rescan - do not use cached listings)
+        classifiers: classifiers to run on the mapped files of each target (in order of targets, see Classifier)
+        targets_args: arguments to map each of the targets with (in order of targets, args if not given)
+
+    Returns:
+        list of maps (in order of targets) as returned by map_target
+    """
+
+    workers = max(getattr(args, 'threads', 1) or 1, 1)
+    map_cache = getattr(args, 'map_cache', None)
+    cache = MapCache(map_cache, getattr(args, 'full_rescan', False)) if map_cache else None
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        submitted = [_submit_target(target, targets_args[i] if i < len(targets_args) else args, pool, cache,
+                                    classifiers[i] if i < len(classifiers) else ())
+                     for i, target in enumerate(targets)]
+        maps = [_collect_target(ctx, parts) for ctx, parts in submitted]
+    if cache:
+        cache.save()
+    return maps
+
+
+def iter_target(target: str, args: argparse.Namespace,
+                stamp: 'MapStampDataType|None' = None) -> t.Iterator[tuple[RepoDir, list[tuple[str, int]]]]:
+    """
+    Map a target as a stream - mapped directories are yielded (in the order of the walk) as soon as they are listed,
+    so the whole map is never held in memory. Adding the files to a RepoMap in order gives the map of map_target.
+    Subtrees are walked in a pool of worker threads, just a few of them ahead of the consumer.
+
+    Args:
+        target: target directory to map
+        args: argparse object (requires: <map_targets requirements>)
+        stamp: stamp (see create_stamp) to record modification times of listed directories into
+
+    Returns:
+        iterator over directories and (name, inode number) tuples of their mapped files
+    """
+
+    workers = max(getattr(args, 'threads', 1) or 1, 1)
+    map_cache = getattr(args, 'map_cache', None)
+    cache = MapCache(map_cache, getattr(args, 'full_rescan', False)) if map_cache else None
     logging.info(f'Mapping target {target}')
-    current_root: dict[str, dict[str, str]] = {}
     if not os.path.exists(target):
         logging.warning(f'Target {target} does not exist! Return empty!')
-        return current_root
-    abs_path = os.path.abspath(target)
-    pattern = re.compile(args.mask)
-    for rootdir, dirs, files in os.walk(abs_path):
-        if any([sd in rootdir for sd in args.skip_dirs]):
-            continue
-        for elem_name in files:
-            if not pattern.match(elem_name):
-                continue
-            elem_arch = _set_elem_arch(rootdir, args.archs)
-            elem_repo = _set_elem_repo(rootdir, args)
-            if elem_arch is None or elem_repo is None:
-                continue
-            elem_path = os.path.join(rootdir, elem_name)
-            m = re.search(f'{target}(.*/(Packages/.*)$)', elem_path)
-            if not m:
-                continue
-            elem_rel = os.path.dirname(m.group(1))
-            elem_pkg = os.path.dirname(m.group(2))
-            elem_key = f'{elem_repo}:{elem_arch}:{elem_pkg}:{elem_name}'
-            current_root[elem_key] = {'elem_name': elem_name, 'elem_abs': abs_path,
-                                      'elem_path': elem_path, 'elem_arch': elem_arch,
-                                      'elem_repo': elem_repo, 'elem_base': target,
-                                      'elem_rel': elem_rel, 'elem_pkg': elem_pkg}
+        return
+    ctx = _MapContext(target, args, cache)
+    ctx.mtimes = stamp['mtimes'] if stamp is not None else None
+    mapped = 0
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        pending: collections.deque[concurrent.futures.Future] = collections.deque()
+        for rootdir, files in _plan_units(ctx.abs_path, _SPLIT_DEPTH, ctx):
+            if len(pending) >= 2 * workers:
+                for directory, dir_files in pending.popleft().result():
+                    mapped += len(dir_files)
+                    yield directory, dir_files
+            pending.append(pool.submit(_list_unit, rootdir, files, ctx))
+        while pending:
+            for directory, dir_files in pending.popleft().result():
+                mapped += len(dir_files)
+                yield directory, dir_files
+    _log_stats(ctx, mapped)
+    if cache:
+        cache.save()
+
+
+def map_listed(target: str, listing: t.Iterable[tuple[str, list[str]]], args: argparse.Namespace) -> RepoMap:
+    """
+    Map a tree listed by other means than walking it (e.g. a remote repository, see mapremote.map_remote) - files
+    are classified and keyed the same way as those of a walked tree. Subtrees matching skip_dirs are expected
+    to be left out of the listing already (see skipped_dirs).
+
+    Args:
+        target: root of the tree (a directory or an url)
+        listing: directories (paths starting with target, top-down) and names of their files
+        args: argparse object (requires: <map_target requirements>)
+
+    Returns:
+        map (RepoMap) as returned by map_target
+    """
+
+    ctx = _MapContext(target, args)
+    current_root = RepoMap()
+    for rootdir, names in listing:
+        _map_files(rootdir, [(name, 0) for name in names], ctx, current_root)
+    logging.info(f'Mapped target {target}: {len(current_root)} files')
     return current_root
 
 
+def skipped_dirs(target: str, args: argparse.Namespace) -> t.Callable[[str, str], bool]:
+    """
+    Args:
+        target: root of the tree (a directory or an url)
+        args: argparse object (requires: mask, skip_dirs)
+
+    Returns:
+        function telling whether a directory (its name and path starting with target) is skipped together with
+        its whole subtree (see skip_dirs)
+    """
+
+    return _MapContext(target, args).is_skipped
+
+
+def create_stamp(target: str, args: argparse.Namespace) -> MapStampDataType:
+    """
+    Create an (empty) stamp of a map - filled by iter_target, saved together with the map (see mapfile.save_map)
+    and checked before the map is used instead of mapping the target again (see check_stamp).
+
+    Args:
+        target: mapped directory
+        args: argparse object (requires: <map_target requirements>)
+
+    Returns:
+        stamp with no directories recorded yet
+    """
+
+    return {'target': os.path.abspath(target), 'settings': _stamp_settings(args), 'mtimes': {}}
+
+
+def tree_key(target: str, args: argparse.Namespace) -> str:
+    """
+    Args:
+        target: directory to map
+        args: argparse object (requires: <map_target requirements>)
+
+    Returns:
+        key identifying the map of target - targets with the same key map to the same map
+    """
+
+    return json.dumps([os.path.abspath(target), _stamp_settings(args)], sort_keys=True)
+
+
+def check_stamp(stamp: MapStampDataType, args: argparse.Namespace) -> 'str|None':
+    """
+    Check that a saved map still matches its tree - i.e. that it was mapped with the same arguments and none of its
+    directories has been modified since (a single stat per directory, nothing is listed). Files are added, removed
+    or renamed only together with a change of their directory mtime, so is every subdirectory.
+
+    Args:
+        stamp: stamp of the map
+        args: argparse object (requires: <map_target requirements>)
+
+    Returns:
+        reason why the map is stale or None if it is up to date
+    """
+
+    if stamp['settings'] != _stamp_settings(args):
+        return 'mapped with different arguments'
+    if not stamp['mtimes']:
+        return f'no directories of {stamp["target"]} recorded'
+    for rel, mtime_ns in stamp['mtimes'].items():
+        path = stamp['target'] + rel
+        try:
+            current = os.stat(path).st_mtime_ns
+        except OSError:
+            return f'{path} is missing'
+        if mtime_ns < 0 or current != mtime_ns:
+            return f'{path} has been modified'
+    return None
+
+
 # Internal
 
 
+def _stamp_settings(args: argparse.Namespace) -> dict[str, t.Any]:
+    """
+    Returns:
+        arguments affecting mapping (as they are stored in a stamp)
+    """
+
+    settings = {name: getattr(args, name, None) for name in _STAMP_SETTINGS}
+    settings['skip_dirs'] = sorted(settings['skip_dirs'] or [])
+    return settings
+
+
 def _set_elem_arch(root: str, archs: list[str]) -> 'str|None':
     """
     Output appropriate arch found in root.
@@ -99,3 +293,317 @@ def _set_elem_repo(root: str, args: argparse.Namespace) -> 'str|None':
         if args.include_extra and repo.lower() in root:
             return repo
     return None
+
+
+class _MapContext:
+
+    def __init__(self, target: str, args: argparse.Namespace, cache: 'MapCache|None' = None):
+        self.target = target
+        self.abs_path = os.path.abspath(target) if '://' not in target else target.rstrip('/')
+        self.pattern = re.compile(args.mask)
+        # relative path of a directory (group 1) and its 'Packages' part (group 2)
+        self.rel_pattern = re.compile(re.escape(self.abs_path.rstrip('/')) + '/(.*/(Packages/.*))$')
+        self.args = args
+        # skip_dirs are of form '/os/' - single directory names are matched against path components,
+        # longer patterns (e.g. '/x86_64/os/') against the path relative to the target
+        self.skip_names = {sd.strip('/') for sd in args.skip_dirs if sd.strip('/').count('/') == 0}
+        self.skip_paths = [sd for sd in args.skip_dirs if sd.strip('/').count('/') > 0]
+        self.stats: collections.Counter = collections.Counter()
+        self.stats_lock = threading.Lock()
+        self.cache = cache.tree(MapCache.tree_key(self.abs_path, args.mask, args.skip_dirs)) if cache else None
+        self.classifiers: t.Sequence[Classifier] = ()
+        # mtime_ns of listed directories by path relative to abs_path (recorded only if not None, see create_stamp)
+        self.mtimes: 'dict[str, int]|None' = None
+
+    def is_skipped(self, name: str, path: str) -> bool:
+        """
+        Check if a directory is to be skipped (together with its whole subtree).
+
+        Args:
+            name: directory name
+            path: absolute directory path
+
+        Returns:
+            True if directory matches any of skip_dirs
+        """
+
+        if name in self.skip_names:
+            return True
+        rel = path[len(self.abs_path):] + '/'
+        return any(sd in rel for sd in self.skip_paths)
+
+    def count(self, **counts: int) -> None:
+        """
+        Add to mapping statistics (thread-safe).
+        """
+
+        with self.stats_lock:
+            self.stats.update(counts)
+
+
+def _submit_target(target: str, args: argparse.Namespace, pool: concurrent.futures.ThreadPoolExecutor,
+                   cache: 'MapCache|None' = None, classifiers: t.Sequence[Classifier] = ()
+                   ) -> 'tuple[_MapContext|None, list[concurrent.futures.Future]]':
+    """
+    List the shallow part of the target tree and submit its units of work into the pool.
+
+    Args:
+        target: target directory to map
+        args: argparse object (requires: <map_target requirements>)
+        pool: pool to submit mapping into
+        cache: cache of directory listings
+        classifiers: classifiers to run on the mapped files
+
+    Returns:
+        mapping context (None if there is nothing to map) and futures of partial maps (in os.walk order)
+    """
+
+    logging.info(f'Mapping target {target}')
+    if not os.path.exists(target):
+        logging.warning(f'Target {target} does not exist! Return empty!')
+        return None, []
+    ctx = _MapContext(target, args, cache)
+    ctx.classifiers = classifiers
+    parts = [pool.submit(_map_unit, rootdir, files, ctx)
+             for rootdir, files in _plan_units(ctx.abs_path, _SPLIT_DEPTH, ctx)]
+    return ctx, parts
+
+
+def _collect_target(ctx: '_MapContext|None', parts: list[concurrent.futures.Future]) -> RepoMap:
+    """
+    Merge partial maps (and results of classifiers) of a target.
+    Parts are merged in the order of the walk, so the result is the same as if it was mapped in one go.
+
+    Args:
+        ctx: mapping context returned by _submit_target
+        parts: futures returned by _submit_target
+
+    Returns:
+        map consisting of indexed file paths/properties
+    """
+
+    current_root = RepoMap()
+    for part in parts:
+        mapped, classified = part.result()
+        current_root.update(mapped)
+        for classifier, results in zip(ctx.classifiers if ctx else (), classified):
+            classifier.results += results
+    if ctx:
+        _log_stats(ctx, len(current_root))
+    return current_root
+
+
+def _log_stats(ctx: '_MapContext', mapped: int) -> None:
+    logging.info(f'Mapped target {ctx.target}: {mapped} files, '
+                 f'{ctx.stats["listed"]} directories listed, '
+                 f'{ctx.stats["pruned"]} skipped subtrees pruned')
+    if ctx.cache is not None:
+        logging.info(f'Map cache of {ctx.target}: {ctx.stats["cached"]} hits (unchanged directories), '
+                     f'{ctx.stats["listed"]} misses')
+
+
+def _plan_units(top: str, depth: int, ctx: _MapContext
+                ) -> list[tuple[str, 'list[tuple[str, int]]|None']]:
+    """
+    Split a tree into units of work.
+    Directories shallower than depth are listed right away, deeper ones are left as whole subtrees.
+
+    Args:
+        top: root of the tree
+        depth: number of levels to list
+        ctx: mapping context
+
+    Returns:
+        A list of (directory, files) tuples in os.walk (top-down) order (files as returned by _list_dir).
+        Subtrees to walk have files set to None.
+    """
+
+    dirs, files = _list_dir(top, ctx)
+    units: list[tuple[str, 'list[tuple[str, int]]|None']] = [(top, files)]
+    for subdir in dirs:
+        if depth > 1:
+            units += _plan_units(subdir, depth - 1, ctx)
+        else:
+            units.append((subdir, None))
+    return units
+
+
+def _map_unit(top: str, files: 'list[tuple[str, int]]|None',
+              ctx: _MapContext) -> tuple[RepoMap, list[list[t.Any]]]:
+    """
+    Map files of a unit of work (see _plan_units) - a whole subtree or a single listed directory.
+
+    Args:
+        top: directory (root of the subtree)
+        files: files of the directory (None to walk the whole subtree)
+        ctx: mapping context
+
+    Returns:
+        map consisting of indexed file paths/properties (of this unit) and results of each of ctx.classifiers
+    """
+
+    current_root = RepoMap()
+    classified: list[list[t.Any]] = [[] for _ in ctx.classifiers]
+    listing = _walk(top, ctx) if files is None else [(top, files)]
+    for rootdir, dir_files in listing:
+        _map_files(rootdir, dir_files, ctx, current_root, classified)
+    return current_root, classified
+
+
+def _list_unit(top: str, files: 'list[tuple[str, int]]|None',
+               ctx: _MapContext) -> list[tuple[RepoDir, list[tuple[str, int]]]]:
+    """
+    List mapped directories of a unit of work (see _plan_units) - a whole subtree or a single listed directory.
+
+    Args:
+        top: directory (root of the subtree)
+        files: files of the directory (None to walk the whole subtree)
+        ctx: mapping context
+
+    Returns:
+        directories (in os.walk order) and (name, inode number) tuples of their mapped files
+    """
+
+    listing = _walk(top, ctx) if files is None else [(top, files)]
+    mapped = []
+    match = ctx.pattern.match
+    for rootdir, dir_files in listing:
+        directory = _classify_dir(rootdir, ctx)
+        if directory is not None:
+            dir_files = [file for file in dir_files if match(file[0])]
+            if dir_files:
+                mapped.append((directory, dir_files))
+    return mapped
+
+
+def _walk(top: str, ctx: _MapContext) -> t.Iterator[tuple[str, list[tuple[str, int]]]]:
+    """
+    Walk a subtree top-down (in os.walk order).
+
+    Args:
+        top: root of the subtree
+        ctx: mapping context
+
+    Returns:
+        iterator over directories and their files (as returned by _list_dir)
+    """
+
+    stack = [top]
+    while stack:
+        rootdir = stack.pop()
+        dirs, files = _list_dir(rootdir, ctx)
+        yield rootdir, files
+        stack += reversed(dirs)
+
+
+def _list_dir(rootdir: str, ctx: _MapContext) -> tuple[list[str], list[tuple[str, int]]]:
+    """
+    List a directory the way os.walk does (symlinked directories are not descended into, errors are ignored).
+    Subdirectories matching skip_dirs are pruned, so their subtrees are never listed.
+    With a map cache, unchanged directories (same mtime) are not listed at all.
+    Modification times of listed directories are recorded into ctx.mtimes (if set) - -1 for directories modified
+    right before they were listed (a later change might leave their mtime unchanged).
+
+    Args:
+        rootdir: directory to list
+        ctx: mapping context
+
+    Returns:
+        paths of subdirectories (to descend into) and (name, inode number) tuples of other entries
+    """
+
+    if ctx.cache is not None or ctx.mtimes is not None:
+        try:
+            mtime_ns = os.stat(rootdir).st_mtime_ns
+        except OSError:
+            return [], []
+        cached = ctx.cache.lookup(rootdir, mtime_ns) if ctx.cache is not None else None
+        if cached is not None:
+            ctx.count(cached=1)
+            if ctx.mtimes is not None:
+                ctx.mtimes[rootdir[len(ctx.abs_path):]] = mtime_ns  # cached listings are never racy
+            return [os.path.join(rootdir, name) for name in cached[0]], cached[1]
+        listed_at = time.time_ns()
+        if ctx.mtimes is not None:
+            ctx.mtimes[rootdir[len(ctx.abs_path):]] = mtime_ns if mtime_ns < listed_at - mapcache.RACY_NS else -1
+    dirs = []
+    files = []
+    pruned = 0
+    try:
+        with os.scandir(rootdir) as it:
+            for entry in it:
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    is_dir = False
+                if not is_dir:
+                    files.append((entry.name, entry.inode()))
+                elif ctx.is_skipped(entry.name, entry.path):
+                    pruned += 1
+                elif not entry.is_symlink():
+                    dirs.append(entry.path)
+    except OSError:
+        pass
+    else:
+        if ctx.cache is not None:
+            match = ctx.pattern.match
+            ctx.cache.store(rootdir, mtime_ns, listed_at, [os.path.basename(path) for path in dirs],
+                            [file for file in files if match(file[0])])
+    ctx.count(listed=1, pruned=pruned)
+    return dirs, files
+
+
+def _map_files(rootdir: str, files: list[tuple[str, int]], ctx: _MapContext,
+               current_root: RepoMap, classified: 'list[list[t.Any]]|None' = None) -> RepoMap:
+    """
+    Map files of a single directory.
+
+    Args:
+        rootdir: (absolute) directory the files are in
+        files: (name, inode number) tuples of files in rootdir
+        ctx: mapping context
+        current_root: map to add mapped files into
+        classified: lists to add results of ctx.classifiers into (classifiers are not run if None)
+
+    Returns:
+        current_root
+    """
+
+    directory = _classify_dir(rootdir, ctx)
+    if directory is None:
+        return current_root
+    match = ctx.pattern.match
+    add = current_root.add
+    names = []
+    for elem_name, inode in files:
+        if match(elem_name):
+            add(directory, elem_name, inode)
+            names.append(elem_name)
+    if classified is not None and names:
+        for classifier, results in zip(ctx.classifiers, classified):
+            results += classifier.classify(directory, names)
+    return current_root
+
+
+def _classify_dir(rootdir: str, ctx: _MapContext) -> 'RepoDir|None':
+    """
+    Derive properties shared by all the files of a directory.
+
+    Args:
+        rootdir: (absolute) directory to classify
+        ctx: mapping context
+
+    Returns:
+        directory properties (arch, repo, path relative to target, 'Packages' part of the path)
+        or None if files in rootdir are not mapped
+    """
+
+    elem_arch = _set_elem_arch(rootdir, ctx.args.archs)
+    elem_repo = _set_elem_repo(rootdir, ctx.args)
+    if elem_arch is None or elem_repo is None:
+        return None
+    m = ctx.rel_pattern.match(rootdir + '/')
+    if not m:
+        return None
+    return RepoDir(ctx.abs_path, ctx.target, rootdir, elem_repo, elem_arch,
+                   os.path.dirname(m.group(1)), os.path.dirname(m.group(2)))
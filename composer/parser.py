@@ -44,10 +44,12 @@ def _create_parser() -> argparse.ArgumentParser:
     parser_fromrules = subparsers.add_parser('fromrules', help='load commands from file and execute (or dryrun)')
     parser_saverules = subparsers.add_parser('saverules', help='create commands and save output (no execution)')
     parser_maprepo = subparsers.add_parser('maprepo', help='map repo and store to json file')
+    parser_batch = subparsers.add_parser('batch', help='create commands of several repo pairs (a manifest) and\n' +
+                                                       'execute (or dryrun) them at once')
     parser_fakerepo = subparsers.add_parser('fakerepo', help='create fake-repo creation script (for testing)')
     parser_fakeremote = subparsers.add_parser('fakeremote',
                                               help='create fake remote repo creation script (for testing)')
-    for sub in parser_direct, parser_saverules, parser_maprepo:
+    for sub in parser_direct, parser_saverules, parser_maprepo, parser_batch:
         sub.add_argument('-p', '--repo_priority', help='Priority for repos (which is to be taken first)' +
                                                        'e.g. AppStream,BaseOS,HighAvailability (no spaces!)\n' +
                                                        '(default: %(default)s)',
@@ -71,9 +73,30 @@ def _create_parser() -> argparse.ArgumentParser:
                          help='include additional dirs (e.g. rhel-9-for-x86_64-baseos-rpms/)\n' +
                               '(default: %(default)s)',
                          type=lambda x: bool(strtobool(x)), required=False, default=False)
+        sub.add_argument('-c', '--map_cache', help='cache file of directory listings - only directories changed\n' +
+                                                   'since the previous run are listed again (default: %(default)s)',
+                         type=str, required=False, default=None)
+        sub.add_argument('-F', '--full_rescan', help='list all directories (and refresh the map cache)\n' +
+                                                     '(default: %(default)s)',
+                         type=lambda x: bool(strtobool(x)), required=False, default=False)
+    for sub in parser_direct, parser_saverules, parser_batch:
+        sub.add_argument('-L', '--listing_cache', help='cache file of listings of a remote src repo (an url) -\n' +
+                                                       'they are requested conditionally (default: %(default)s)',
+                         type=str, required=False, default=None)
+        sub.add_argument('-u', '--skip_unchanged', help='take whole subtrees of unchanged remote listings from\n' +
+                                                        'the listing cache (default: %(default)s)',
+                         type=lambda x: bool(strtobool(x)), required=False, default=False)
+        sub.add_argument('-Y', '--repodata', help='map repositories of a remote src repo from their\n' +
+                                                  'repomd.xml and primary.xml (default: %(default)s)',
+                         type=lambda x: bool(strtobool(x)), required=False, default=False)
     for sub in parser_direct, parser_saverules:
-        sub.add_argument('-s', '--src_repo', help='src repo (what we want to model)',
-                         type=str, required=True)
+        src = sub.add_mutually_exclusive_group(required=True)
+        src.add_argument('-s', '--src_repo', help='src repo (what we want to model) - a directory or an url\n' +
+                                                  '(http(s)://, file://) of a remote one',
+                         type=str)
+        src.add_argument('-I', '--src_map', help='map of src repo saved by maprepo (ndjson or index) to use\n' +
+                                                 'instead of mapping it (mapped again if it has changed)',
+                         type=str)
         sub.add_argument('-d', '--dst_repo', help='dst repo (what we want to modify)',
                          type=str, required=True)
         sub.add_argument('-m', '--move_debug', help='move debug packages out of destination repo\n' +
@@ -92,19 +115,47 @@ def _create_parser() -> argparse.ArgumentParser:
                                                       'It is of format from_repo/to_repo' +
                                                       'e.g. CodeReady/PowerTools,Devel/BaseOS (no spaces!)',
                          type=str, required=False)
-    for sub in parser_direct, parser_fromrules:
+        sub.add_argument('-P', '--previous_rules', help='previously applied rules - only the changes are created\n' +
+                                                        '(direct updates the file after a real run)\n' +
+                                                        '(default: %(default)s)',
+                         type=str, required=False, default=None)
+    for sub in parser_direct, parser_fromrules, parser_batch:
         sub.add_argument('-r', '--real_run', help='real_run (default: %(default)s)',
                          type=lambda x: bool(strtobool(x)), required=False, default=False)
+        sub.add_argument('-E', '--exec_mode', help='execute operations on absolute paths (path) or relative to ' +
+                                                   'opened directories (dirfd)\n' +
+                                                   '(default: %(default)s)',
+                         type=str, required=False, choices=['path', 'dirfd'], default='path')
+    for sub in parser_direct, parser_fromrules, parser_saverules:
+        sub.add_argument('-f', '--rules_format', help='format of rules files: json, packed (binary, with a table\n' +
+                                                      'of shared path prefixes), ndjson (a command per line,\n' +
+                                                      'applied while being read) or auto (packed for *.packed,\n' +
+                                                      'ndjson for *.ndjson; recognized by content when loading)\n' +
+                                                      '(default: %(default)s)',
+                         type=str, required=False, choices=['auto', 'json', 'packed', 'ndjson'], default='auto')
+    for sub in parser_direct, parser_fromrules, parser_saverules, parser_maprepo, parser_batch:
         sub.add_argument('-T', '--threads', help='run in T threads (default: %(default)s)',
                          type=int, required=False, default=1)
+    parser_direct.add_argument('-k', '--skip_existing', help='skip links that already exist\n' +
+                                                             '(default: %(default)s)',
+                               type=lambda x: bool(strtobool(x)), required=False, default=True)
     parser_fromrules.add_argument('-i', '--input_file', help='Infile to load repository commands from',
                                   type=str, required=True)
     parser_saverules.add_argument('-o', '--output_file', help='Outfile to save repository commands to',
                                   type=str, required=True)
     parser_maprepo.add_argument('-s', '--src_repo', help='src repo (what we want to model)',
                                 type=str, required=True)
-    parser_maprepo.add_argument('-o', '--output_file', help='Map out file (as json)',
+    parser_maprepo.add_argument('-o', '--output_file', help='Map out file (written while mapping)',
                                 type=str, required=True)
+    parser_maprepo.add_argument('-f', '--map_format', help='format of the map file: json, ndjson (a line per\n' +
+                                                           'directory, readable as a stream), index (sorted,\n' +
+                                                           'memory-mapped for lookups) or auto (ndjson for\n' +
+                                                           '*.ndjson, index for *.idx files) (default: %(default)s)',
+                                type=str, required=False, choices=['auto', 'json', 'ndjson', 'index'],
+                                default='auto')
+    parser_batch.add_argument('-i', '--manifest', help='json list of jobs - direct options by their long names\n' +
+                                                       '(mapping options default to the ones given here)',
+                              type=str, required=True)
     for sub in parser_fakerepo, parser_fakeremote:
         sub.add_argument('-b', '--bash_output', help='Bash output script (fake repo creation script)',
                          type=str, required=True)
@@ -112,6 +163,28 @@ def _create_parser() -> argparse.ArgumentParser:
                                  type=str, required=True)
     parser_fakeremote.add_argument('-i', '--input_url', help='Repository url',
                                    type=str, required=True)
+    parser_fakeremote.add_argument('-T', '--threads', help='fetch T directory listings at once (default: %(default)s)',
+                                   type=int, required=False, default=8)
+    parser_fakeremote.add_argument('-c', '--listing_cache', help='cache file of directory listings - listings are\n' +
+                                                                 'requested conditionally (ETag, Last-Modified) and\n' +
+                                                                 'unchanged ones are taken from the cache\n' +
+                                                                 '(default: %(default)s)',
+                                   type=str, required=False, default=None)
+    parser_fakeremote.add_argument('-u', '--skip_unchanged', help='take whole subtrees of unchanged listings from\n' +
+                                                                  'the cache (for mirrors replaced as a whole)\n' +
+                                                                  '(default: %(default)s)',
+                                   type=lambda x: bool(strtobool(x)), required=False, default=False)
+    parser_fakeremote.add_argument('-F', '--full_rescan', help='fetch all listings (and refresh the listing cache)\n' +
+                                                               '(default: %(default)s)',
+                                   type=lambda x: bool(strtobool(x)), required=False, default=False)
+    parser_fakeremote.add_argument('-H', '--html_parser', help='parser of directory listings: stdlib (streamed)\n' +
+                                                               'or bs4 (BeautifulSoup, if installed)\n' +
+                                                               '(default: %(default)s)',
+                                   type=str, required=False, choices=['stdlib', 'bs4'], default='stdlib')
+    parser_fakeremote.add_argument('-R', '--repodata', help='map repositories (directories with repodata/) from\n' +
+                                                            'their repomd.xml and primary.xml instead of listing\n' +
+                                                            'their packages (default: %(default)s)',
+                                   type=lambda x: bool(strtobool(x)), required=False, default=False)
     return parser
 
 
@@ -0,0 +1,141 @@
+"""
+Persistent cache of remote directory listings (for re-crawling with conditional requests).
+
+Links of every listing are cached together with its validators (ETag, Last-Modified). Listings are then requested
+conditionally (If-None-Match, If-Modified-Since) - an unchanged listing is answered with 304 Not Modified and its
+cached links are used, without downloading and parsing the page again.
+
+Validators of a listing change only with its own entries - a file added deeper in the tree does not change
+the listings above it (unless the mirror propagates modification times up). Listings under an unchanged one are
+therefore still requested, unless skipping of unchanged subtrees is enabled (see ListingCache) - suitable for mirrors
+whose trees are replaced as a whole (e.g. synced into a new directory), where an unchanged listing means
+an unchanged subtree.
+"""
+
+import email.message
+import json
+import logging
+import os
+
+_VERSION = 1
+
+# cached listing: ETag, Last-Modified (None if not sent by the server), links of the listing
+_EntryType = tuple['str|None', 'str|None', list[str]]
+
+
+class ListingCache:
+    """
+    Cache file holding listings of any number of remote trees. Thread-safe (entries are only ever set, never modified).
+    """
+
+    def __init__(self, filename: str, full_rescan: bool = False, skip_unchanged: bool = False):
+        """
+        Args:
+            filename: cache file (created if it does not exist)
+            full_rescan: ignore cached listings (the cache is still rewritten with fresh ones)
+            skip_unchanged: take listings under an unchanged (304) listing from the cache without requesting them
+        """
+
+        self.filename = filename
+        self.full_rescan = full_rescan
+        self.skip_unchanged = skip_unchanged
+        self.entries: dict[str, _EntryType] = {}
+        self.updated: dict[str, _EntryType] = {}
+        self.roots: set[str] = set()
+        self.changed = False
+        if os.path.exists(filename):
+            try:
+                with open(filename) as loadfile:
+                    content = json.load(loadfile)
+                if content.get('version') == _VERSION:
+                    self.entries = {url: (etag, modified, links)
+                                    for url, (etag, modified, links) in content['listings'].items()}
+            except (OSError, ValueError, KeyError, AttributeError, TypeError) as e:
+                logging.warning(f'Ignoring unreadable listing cache {filename}: {e}')
+
+    def crawl(self, baseurl: str) -> None:
+        """
+        Start a crawl of baseurl - cached listings under it not used by the crawl are dropped on save.
+
+        Args:
+            baseurl: url of a remote repository
+        """
+
+        self.roots.add(baseurl)
+
+    def lookup(self, url: str) -> 'list[str]|None':
+        """
+        Args:
+            url: url of a listing
+
+        Returns:
+            cached links of the listing (None if it is not cached)
+        """
+
+        if self.full_rescan:
+            return None
+        entry = self.entries.get(url)
+        return entry[2] if entry is not None else None
+
+    def conditions(self, url: str) -> dict[str, str]:
+        """
+        Args:
+            url: url of a listing
+
+        Returns:
+            headers of a conditional request of the listing (empty if it is not cached)
+        """
+
+        entry = None if self.full_rescan else self.entries.get(url)
+        if entry is None:
+            return {}
+        etag, modified, _ = entry
+        headers = {}
+        if etag:
+            headers['If-None-Match'] = etag
+        if modified:
+            headers['If-Modified-Since'] = modified
+        return headers
+
+    def reuse(self, url: str) -> list[str]:
+        """
+        Keep a cached listing (e.g. after 304 Not Modified).
+
+        Args:
+            url: url of a cached listing
+
+        Returns:
+            links of the listing
+        """
+
+        self.updated[url] = self.entries[url]
+        return self.entries[url][2]
+
+    def store(self, url: str, headers: email.message.Message, links: list[str]) -> None:
+        """
+        Args:
+            url: url of a listing
+            headers: headers of the response (listings without validators are not cached)
+            links: links of the listing
+        """
+
+        self.changed = True
+        etag, modified = headers.get('ETag'), headers.get('Last-Modified')
+        if etag or modified:
+            self.updated[url] = (etag, modified, links)
+
+    def save(self) -> None:
+        """
+        Write the cache file - listings under the crawled urls are replaced with what was fetched or reused.
+        Nothing is written if all the listings were unchanged.
+        """
+
+        kept = {url: entry for url, entry in self.entries.items()
+                if not any(url.startswith(root) for root in self.roots)}
+        if not self.changed and len(kept) + len(self.updated) == len(self.entries):
+            return
+        tmp_filename = f'{self.filename}.tmp'
+        with open(tmp_filename, 'w') as savefile:
+            savefile.write(json.dumps({'version': _VERSION, 'listings': {**kept, **self.updated}},
+                                      separators=(',', ':')))
+        os.replace(tmp_filename, self.filename)
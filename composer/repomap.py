@@ -0,0 +1,230 @@
+"""
+Compact repository map.
+
+Mapped files of a directory share all of their properties except for the file name. A map therefore stores a single
+RepoDir record per directory and keys (which end with the file name) pointing to it. Per-file views (RepoElem) and
+paths are derived on demand.
+"""
+
+import collections.abc
+import os
+import sys
+import typing as t
+
+ELEM_FIELDS = ('elem_name', 'elem_abs', 'elem_path', 'elem_arch', 'elem_repo', 'elem_base', 'elem_rel', 'elem_pkg')
+_ELEM_FIELD_SET = frozenset(ELEM_FIELDS)
+
+
+class RepoDir:
+    """
+    Properties shared by all the mapped files of a single directory.
+    """
+
+    __slots__ = ('elem_abs', 'elem_base', 'path', 'elem_repo', 'elem_arch', 'elem_rel', 'elem_pkg', 'key_prefix')
+
+    def __init__(self, elem_abs: str, elem_base: str, path: str,
+                 elem_repo: str, elem_arch: str, elem_rel: str, elem_pkg: str):
+        self.elem_abs = elem_abs
+        self.elem_base = elem_base
+        self.path = path
+        self.elem_repo = sys.intern(elem_repo)
+        self.elem_arch = sys.intern(elem_arch)
+        self.elem_rel = elem_rel
+        self.elem_pkg = sys.intern(elem_pkg)
+        self.key_prefix = f'{self.elem_repo}:{self.elem_arch}:{self.elem_pkg}:'
+
+
+class RepoElem:
+    """
+    A single mapped file.
+    Fields are accessible both as attributes and (as in the plain dictionary it replaces) by name,
+    e.g. repo_elem['elem_path'].
+    """
+
+    __slots__ = ('directory', 'elem_name')
+
+    def __init__(self, directory: RepoDir, elem_name: str):
+        self.directory = directory
+        self.elem_name = elem_name
+
+    @property
+    def elem_abs(self) -> str:
+        return self.directory.elem_abs
+
+    @property
+    def elem_base(self) -> str:
+        return self.directory.elem_base
+
+    @property
+    def elem_path(self) -> str:
+        return os.path.join(self.directory.path, self.elem_name)
+
+    @property
+    def elem_repo(self) -> str:
+        return self.directory.elem_repo
+
+    @property
+    def elem_arch(self) -> str:
+        return self.directory.elem_arch
+
+    @property
+    def elem_rel(self) -> str:
+        return self.directory.elem_rel
+
+    @property
+    def elem_pkg(self) -> str:
+        return self.directory.elem_pkg
+
+    def __getitem__(self, field: str) -> str:
+        if field not in _ELEM_FIELD_SET:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def get(self, field: str, default: t.Any = None) -> t.Any:
+        return self[field] if field in _ELEM_FIELD_SET else default
+
+    def to_dict(self) -> dict[str, str]:
+        """
+        Returns:
+            file properties as a plain dictionary
+        """
+
+        return {field: getattr(self, field) for field in ELEM_FIELDS}
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, RepoElem):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return repr(self.to_dict())
+
+
+class RepoMap(collections.abc.Mapping):
+    """
+    Repository map - a read-only mapping of keys (repo:arch:Packages/x:file_name) to RepoElem.
+    """
+
+    __slots__ = ('_elems', '_inodes')
+
+    def __init__(self) -> None:
+        # values are RepoDir for files whose key is directory.key_prefix + file name (i.e. every file mapped
+        # from a tree) and RepoElem for keys of any other form (possible only in maps loaded from files)
+        self._elems: dict[str, 't.Union[RepoDir, RepoElem]'] = {}
+        # inode numbers recorded while mapping (maps loaded from files have none)
+        self._inodes: dict[str, int] = {}
+
+    def add(self, directory: RepoDir, elem_name: str, inode: int = 0) -> str:
+        """
+        Add a file to the map (replacing a file with the same key, if present).
+
+        Args:
+            directory: directory the file is in
+            elem_name: file name
+            inode: inode number of the file (0 if unknown)
+
+        Returns:
+            key of the file
+        """
+
+        key = directory.key_prefix + elem_name
+        self._elems[key] = directory
+        if inode:
+            self._inodes[key] = inode
+        else:
+            self._inodes.pop(key, None)
+        return key
+
+    def update(self, other: 'RepoMap') -> None:
+        """
+        Add all the files of other map (as if they were added one by one).
+        """
+
+        for key in self._inodes.keys() & other._elems.keys() - other._inodes.keys():
+            del self._inodes[key]
+        self._elems.update(other._elems)
+        self._inodes.update(other._inodes)
+
+    def inode(self, directory: RepoDir, elem_name: str) -> 'int|None':
+        """
+        Args:
+            directory: directory of a mapped file
+            elem_name: file name
+
+        Returns:
+            inode number of the file as recorded while mapping
+            (None if unknown or if the file is not in the map, e.g. replaced by a file with the same key)
+        """
+
+        key = directory.key_prefix + elem_name
+        if self._elems.get(key) is not directory:
+            return None
+        return self._inodes.get(key)
+
+    def directories(self) -> set[RepoDir]:
+        """
+        Returns:
+            directories of all the mapped files
+        """
+
+        return {value if isinstance(value, RepoDir) else value.directory for value in self._elems.values()}
+
+    def __getitem__(self, key: str) -> RepoElem:
+        value = self._elems[key]
+        if isinstance(value, RepoDir):
+            return RepoElem(value, key[len(value.key_prefix):])
+        return value
+
+    def __contains__(self, key: object) -> bool:
+        return key in self._elems
+
+    def __iter__(self) -> t.Iterator[str]:
+        return iter(self._elems)
+
+    def __len__(self) -> int:
+        return len(self._elems)
+
+    def __repr__(self) -> str:
+        return f'RepoMap({len(self)} files)'
+
+    def to_dict(self) -> dict[str, dict[str, str]]:
+        """
+        Returns:
+            the map as a plain dictionary (e.g. to save as json)
+        """
+
+        return {key: elem.to_dict() for key, elem in self.items()}
+
+    @classmethod
+    def from_dict(cls, content: t.Mapping[str, t.Mapping[str, str]]) -> 'RepoMap':
+        """
+        Create a map out of a plain dictionary (e.g. loaded from a maprepo json file).
+
+        Args:
+            content: dictionary of file properties (as returned by to_dict)
+
+        Returns:
+            repository map
+
+        Raises:
+            ValueError: if elem_path of a file does not end with its elem_name
+        """
+
+        repo_map = cls()
+        dirs: dict[tuple[str, ...], RepoDir] = {}
+        for key, elem in content.items():
+            path, name = os.path.split(elem['elem_path'])
+            if name != elem['elem_name']:
+                raise ValueError(f'Inconsistent map entry {key}: {elem["elem_path"]} is not {elem["elem_name"]}')
+            dir_props = (elem['elem_abs'], elem['elem_base'], path,
+                         elem['elem_repo'], elem['elem_arch'], elem['elem_rel'], elem['elem_pkg'])
+            directory = dirs.get(dir_props)
+            if directory is None:
+                directory = dirs[dir_props] = RepoDir(*dir_props)
+            if key == directory.key_prefix + name:
+                repo_map._elems[key] = directory
+            else:
+                repo_map._elems[key] = RepoElem(directory, name)
+        return repo_map
@@ -1,21 +1,34 @@
 import os
 import re
 import json
+import bisect
+import concurrent.futures
 import logging
 import argparse
+import typing as t
 import composer.util as util
+import composer.mapfile as mapfile
+import composer.mapindex as mapindex
+import composer.mapremote as mapremote
 import composer.maptarget as maptarget
+import composer.rulesfile as rulesfile
 
 from composer.composer_types import CommandsDataType
+from composer.repomap import RepoDir, RepoElem, RepoMap
 
+_REGEX_SPECIAL_CHARS = frozenset('.^$*+?{}[]\\|()')
 
-def create_move_commands_for_debug_packages(repo: dict[str, dict[str, str]], all_dir: str,
+# source map, destination map and the classifiers run on the destination (see DebugPackageMoves)
+MappedReposType = tuple[t.Mapping[str, RepoElem], RepoMap, t.Sequence[maptarget.Classifier]]
+
+
+def create_move_commands_for_debug_packages(repo: RepoMap, all_dir: str,
                                             debug_dir: str) -> list[tuple[str, str]]:
     """
     This function creates move rules for 'debuginfo' and debugsource packages.
 
     Args:
-        repo: repository dict to apply to.
+        repo: repository map to apply to.
         all_dir: string indicating from which directory to move files (e.g. '/all/')
         debug_dir: string indicating to which directory to move (e.g. '/debug/')
 
@@ -34,7 +47,35 @@ def create_move_commands_for_debug_packages(repo: dict[str, dict[str, str]], all
     return move_commands
 
 
-def create_ruleset(args: argparse.Namespace) -> CommandsDataType:
+class DebugPackageMoves(maptarget.Classifier):
+    """
+    Classifier creating move rules for 'debuginfo' and 'debugsource' packages while the destination is being mapped
+    (the same rules as create_move_commands_for_debug_packages, without another pass over the map).
+    """
+
+    def __init__(self, all_dir: str, debug_dir: str):
+        """
+        Args:
+            all_dir: string indicating from which directory to move files (e.g. '/all/')
+            debug_dir: string indicating to which directory to move (e.g. '/debug/')
+        """
+
+        super().__init__()
+        self.all_dir = all_dir
+        self.debug_dir = debug_dir
+
+    def classify(self, directory: RepoDir, names: list[str]) -> list[tuple[str, str]]:
+        if self.all_dir not in directory.elem_rel:
+            return []
+        debug_names = [name for name in names if '-debuginfo-' in name or '-debugsource-' in name]
+        if not debug_names:
+            return []
+        src_dir = os.path.join(directory.path, '')
+        dst_dir = os.path.join(directory.elem_abs, directory.elem_rel.replace(self.all_dir, self.debug_dir), '')
+        return [(src_dir + name, dst_dir + name) for name in debug_names]
+
+
+def create_ruleset(args: argparse.Namespace, mapped: 'MappedReposType|None' = None) -> CommandsDataType:
     """
     Create rules dictionary. This dictionary is a set of src-dst tuples where src is applied a command to create dst.
     For example tuple (file1.txt, file2.txt) may be placed under the 'mv' key.
@@ -42,39 +83,260 @@ def create_ruleset(args: argparse.Namespace) -> CommandsDataType:
 
     Args:
         args: argparse object (requires: src_repo, dst_repo, move_debug, all_dir, debug_dir, archs, repo_priority,
-                                         os_dir, replacements, custom_rules_file + <map_target requirements>)
+                                         os_dir, replacements, custom_rules_file + <map_targets requirements>;
+                               optional: skip_existing, src_map - map file to use instead of mapping src_repo,
+                                         <mapremote.map_remote options> - if src_repo is an url)
+        mapped: repositories mapped already (the destination with dst_classifiers), not mapped again
 
     Returns:
         commands dictionary containing src-dst tuples placed under desired [command] key.
     """
 
+    cmds, mapped_dst = _create_full_ruleset(args, mapped)
+    if mapped_dst is not None and getattr(args, 'skip_existing', False):
+        cmds['ln'] = drop_existing_links(cmds['ln'], mapped_dst, cmds['mv'], getattr(args, 'threads', 1))
+    return cmds
+
+
+def create_delta_ruleset(args: argparse.Namespace, previous: CommandsDataType,
+                         mapped: 'MappedReposType|None' = None) -> tuple[CommandsDataType, CommandsDataType]:
+    """
+    Create rules changed since a previous ruleset (see diff_rules).
+    If either of the maps is empty, nothing is changed (rather than removing all the previous links).
+
+    Args:
+        args: argparse object (requires: <create_ruleset requirements>)
+        previous: previously applied (full) ruleset
+        mapped: repositories mapped already (see create_ruleset)
+
+    Returns:
+        delta ruleset (to apply) and the full current ruleset (to compare the next run with)
+    """
+
+    cmds, mapped_dst = _create_full_ruleset(args, mapped)
+    if mapped_dst is None:
+        return {'mkdir': [], 'mv': [], 'ln': [], 'rm': []}, previous
+    delta = diff_rules(previous, cmds)
+    if getattr(args, 'skip_existing', False):
+        delta['ln'] = drop_existing_links(delta['ln'], mapped_dst, delta['mv'], getattr(args, 'threads', 1))
+    return delta, cmds
+
+
+def diff_rules(previous: CommandsDataType, current: CommandsDataType) -> CommandsDataType:
+    """
+    Compute changes between two (full) rulesets (in time linear in their size).
+    Links and moves of the current ruleset missing in the previous one are kept (in their order), i.e. added links
+    and links whose source has changed. Previous links whose destination is not linked anymore are to be removed
+    ('rm' key). Previous moves missing now are not reverted.
+
+    Args:
+        previous: previously applied ruleset
+        current: current ruleset
+
+    Returns:
+        delta ruleset
+    """
+
+    previous_ln = {(src, dst) for src, dst in previous['ln']}
+    previous_mv = {(src, dst) for src, dst in previous['mv']}
+    delta: CommandsDataType = {
+        'mkdir': [],
+        'mv': [cmd for cmd in current['mv'] if cmd not in previous_mv],
+        'ln': [cmd for cmd in current['ln'] if cmd not in previous_ln],
+        'rm': []
+    }
+    linked = {dst for _, dst in current['ln']}
+    for src, dst in previous['ln']:
+        if dst not in linked:
+            delta['rm'].append((src, dst))
+            linked.add(dst)  # remove each destination just once
+    logging.info(f'Changes since previous rules: {len(delta["ln"])} links added or changed, '
+                 f'{len(delta["rm"])} links removed, {len(delta["mv"])} moves')
+    return delta
+
+
+def load_previous_rules(filename: str) -> CommandsDataType:
+    """
+    Load a previously applied ruleset (an empty one if the file does not exist yet, i.e. on the first run).
+    The file format is recognized by its content (see rulesfile.load_rules).
+
+    Args:
+        filename: rules file
+
+    Returns:
+        commands dictionary
+    """
+
+    if not os.path.exists(filename):
+        logging.warning(f'Previous rules {filename} do not exist, all the rules are new')
+        return {'mkdir': [], 'mv': [], 'ln': []}
+    return rulesfile.load_rules(filename)
+
+
+def dst_classifiers(args: argparse.Namespace) -> list[maptarget.Classifier]:
+    """
+    Args:
+        args: argparse object (requires: all_dir, debug_dir; optional: move_debug)
+
+    Returns:
+        classifiers to map the destination with (the rules need their results)
+    """
+
+    return [DebugPackageMoves(args.all_dir, args.debug_dir)] if getattr(args, 'move_debug', False) else []
+
+
+def _create_full_ruleset(args: argparse.Namespace,
+                         mapped: 'MappedReposType|None' = None) -> 'tuple[CommandsDataType, RepoMap|None]':
+    """
+    Map source and destination (unless mapped already) and create all the rules (see create_ruleset).
+
+    Returns:
+        commands dictionary and the destination map (None if either of the maps is empty)
+    """
+
+    mapped_src: t.Mapping[str, RepoElem]
+
     cmds: CommandsDataType = {'mkdir': [], 'mv': [], 'ln': []}
-    mapped_src = maptarget.map_target(args.src_repo, args)
-    mapped_dst = maptarget.map_target(args.dst_repo, args)
-    if not mapped_src or not mapped_dst:
-        mapped_dst or logging.warning('Destination map is empty!')  # type: ignore
-        mapped_src or logging.warning('Source map is empty!')  # type: ignore
-        logging.warning('One or both maps are empty. Return empty.')
-        return cmds
-    if args.move_debug:
-        cmds['mv'] = create_move_commands_for_debug_packages(mapped_dst, args.all_dir, args.debug_dir)
+    if mapped is not None:
+        mapped_src, mapped_dst, classifiers = mapped
+    else:
+        classifiers = dst_classifiers(args)
+        if getattr(args, 'src_map', None):
+            mapped_src, mapped_dst = _map_with_src_map(args.src_map, args, classifiers)
+        elif mapremote.is_url(args.src_repo):
+            mapped_src, mapped_dst = _map_with_remote_src(args.src_repo, args, classifiers)
+        else:
+            mapped_src, mapped_dst = maptarget.map_targets([args.src_repo, args.dst_repo], args, [[], classifiers])
+    try:
+        if not mapped_src or not mapped_dst:
+            mapped_dst or logging.warning('Destination map is empty!')  # type: ignore
+            mapped_src or logging.warning('Source map is empty!')  # type: ignore
+            logging.warning('One or both maps are empty. Return empty.')
+            return cmds, None
+        for classifier in classifiers:
+            cmds['mv'] += classifier.results
+        cmds['ln'] = create_link_commands(mapped_src, mapped_dst, args)
+        if args.custom_rules_file:
+            cmds['ln'] += append_custom_rules(mapped_dst, args)
+        return cmds, mapped_dst
+    finally:
+        if mapped is None and isinstance(mapped_src, mapindex.MapIndex):  # opened here (by _map_with_src_map)
+            mapped_src.close()
+
+
+def _map_with_src_map(filename: str, args: argparse.Namespace,
+                      dst_classifiers: t.Sequence[maptarget.Classifier]) -> 'tuple[t.Mapping[str, RepoElem], RepoMap]':
+    """
+    Open a saved source map (see mapfile.open_map) and map just the destination.
+    If the source tree has changed since it was mapped (see maptarget.check_stamp), it is mapped again instead.
+
+    Args:
+        filename: source map file (ndjson or index saved with a stamp)
+        args: argparse object (requires: dst_repo + <map_targets requirements>)
+        dst_classifiers: classifiers to run on the mapped destination
+
+    Returns:
+        source and destination maps
+
+    Raises:
+        ValueError: if the map has no stamp to check it with
+    """
+
+    mapped_src, target = open_src_map(filename, args)
+    if mapped_src is None:
+        mapped_src, mapped_dst = maptarget.map_targets([target, args.dst_repo], args, [[], dst_classifiers])
+        return mapped_src, mapped_dst
+    try:
+        return mapped_src, maptarget.map_target(args.dst_repo, args, dst_classifiers)
+    except BaseException:
+        if isinstance(mapped_src, mapindex.MapIndex):
+            mapped_src.close()
+        raise
+
+
+def _map_with_remote_src(url: str, args: argparse.Namespace,
+                         dst_classifiers: t.Sequence[maptarget.Classifier]) -> tuple[RepoMap, RepoMap]:
+    """
+    Map a remote source (see mapremote.map_remote) while the destination is mapped.
+
+    Args:
+        url: url of the source repository
+        args: argparse object (requires: dst_repo + <map_targets requirements> + <mapremote.map_remote options>)
+        dst_classifiers: classifiers to run on the mapped destination
+
+    Returns:
+        source and destination maps
+    """
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=1) as pool:
+        remote = pool.submit(mapremote.map_remote, url, args)
+        mapped_dst = maptarget.map_target(args.dst_repo, args, dst_classifiers)
+        return remote.result(), mapped_dst
+
+
+def open_src_map(filename: str, args: argparse.Namespace) -> 'tuple[t.Mapping[str, RepoElem]|None, str]':
+    """
+    Open a saved source map (see mapfile.open_map), if the source tree has not changed since it was mapped
+    (see maptarget.check_stamp).
+
+    Args:
+        filename: source map file (ndjson or index saved with a stamp)
+        args: argparse object (requires: <map_targets requirements>)
+
+    Returns:
+        the map (None if it is stale and the tree has to be mapped again) and the mapped tree
+
+    Raises:
+        ValueError: if the map has no stamp to check it with
+    """
+
+    stamp = mapfile.read_stamp(filename)
+    if stamp is None:
+        raise ValueError(f'Source map {filename} has no stamp to check it with (save it in ndjson or index format)')
+    stale = maptarget.check_stamp(stamp, args)
+    if stale is not None:
+        logging.warning(f'Source map {filename} is stale ({stale}), mapping {stamp["target"]} instead')
+        return None, stamp['target']
+    logging.info(f'Using source map {filename} of {stamp["target"]}')
+    return mapfile.open_map(filename), stamp['target']
+
+
+def create_link_commands(mapped_src: t.Mapping[str, RepoElem], mapped_dst: RepoMap,
+                         args: argparse.Namespace) -> list[tuple[str, str]]:
+    """
+    Create link rules for all the packages of source repository found in the destination repository.
+    Each package is looked for in its own arch first, then in the other archs (in order of args.archs).
+    Within an arch, repositories are tried in order of args.repo_priority.
+
+    Args:
+        mapped_src: repository map to model after
+        mapped_dst: repository map that is modeled
+        args: argparse object (requires: archs, repo_priority, all_dir, os_dir, replacements)
+
+    Returns:
+        A list of src-dst tuples to later append to some section of commands to execute (possibly 'ln')
+    """
+
+    links = []
+    index = _index_by_variable_key(mapped_dst, args.repo_priority)
     for mapped_src_key in mapped_src.keys():
         src_arch, src_variable_key = mapped_src_key.split(':', 2)[1:3]
+        found = index.get(src_variable_key)
+        if not found:
+            continue
         for current_arch in [src_arch] + args.archs:  # place "our" arch first
-            for current_repo in args.repo_priority:  # try out repositories in order of importance
-                cmd = _append_rule(mapped_src, mapped_dst, mapped_src_key, src_variable_key, current_repo,
-                                   current_arch, args.all_dir, args.os_dir, args.replacements)
-                if cmd:
-                    cmds['ln'].append(cmd)
-                    break
+            current_repo = found.get(current_arch)
+            if current_repo is None:
+                continue
+            cmd = _append_rule(mapped_src, mapped_dst, mapped_src_key, src_variable_key, current_repo,
+                               current_arch, args.all_dir, args.os_dir, args.replacements)
             if cmd:  # noarchs will hit a couple of times, therefore as soon as we get a hit - we break
+                links.append(cmd)
                 break
-    if args.custom_rules_file:
-        cmds['ln'] += append_custom_rules(mapped_dst, args)
-    return cmds
+    return links
 
 
-def append_custom_rules(repo: dict[str, dict[str, str]], args: argparse.Namespace) -> list[tuple[str, str]]:
+def append_custom_rules(repo: RepoMap, args: argparse.Namespace) -> list[tuple[str, str]]:
     """
     Create additional rules for repository based on created configuration file
 
@@ -92,7 +354,74 @@ def append_custom_rules(repo: dict[str, dict[str, str]], args: argparse.Namespac
         return _append_custom_rules_short(repo, args.custom_rules_file, args.all_dir, args.os_dir)
 
 
-def _append_custom_rules_json(repo: dict[str, dict[str, str]], rulefile:
+def drop_existing_links(links: list[tuple[str, str]], repo: RepoMap, moves: list[tuple[str, str]],
+                        threads: int = 1) -> list[tuple[str, str]]:
+    """
+    Drop links whose destination already is a hardlink of the source (i.e. links that would not change anything).
+    Inode numbers of sources are taken from the map (recorded while mapping). Every destination directory is listed
+    once (directory listing provides inode numbers without stat) and devices are compared once per directory.
+    Links of moved files (or to moved paths) are always kept.
+
+    Args:
+        links: src-dst tuples of links to create (sources are files of repo)
+        repo: repository map of the link sources
+        moves: src-dst tuples of files to move (before creating links)
+        threads: number of threads to list directories in
+
+    Returns:
+        links that still have to be created (in the original order)
+    """
+
+    dirs = {directory.path: directory for directory in repo.directories()}
+    moved = {path for move in moves for path in move}
+    src_inodes: list['int|None'] = []
+    for src, dst in links:
+        src_dir, _, src_name = src.rpartition('/')
+        directory = dirs.get(src_dir)
+        if directory is None or src in moved or dst in moved:
+            src_inodes.append(None)
+        else:
+            src_inodes.append(repo.inode(directory, src_name))
+    src_dirs = sorted({src.rpartition('/')[0] for (src, _), inode in zip(links, src_inodes) if inode})
+    dst_dirs = sorted({dst.rpartition('/')[0] for (_, dst), inode in zip(links, src_inodes) if inode})
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(threads, 1)) as pool:
+        src_devs = dict(zip(src_dirs, pool.map(_device, src_dirs)))
+        dst_listings = dict(zip(dst_dirs, pool.map(_list_inodes, dst_dirs)))
+    kept = []
+    for (src, dst), inode in zip(links, src_inodes):
+        if inode:
+            dst_dir, _, dst_name = dst.rpartition('/')
+            dst_dev, dst_inodes = dst_listings[dst_dir]
+            src_dev = src_devs[src.rpartition('/')[0]]
+            if dst_inodes.get(dst_name) == inode and src_dev is not None and dst_dev == src_dev:
+                continue
+        kept.append((src, dst))
+    logging.info(f'Skipping {len(links) - len(kept)} links that already exist')
+    return kept
+
+
+def _device(directory: str) -> 'int|None':
+    try:
+        return os.stat(directory).st_dev
+    except OSError:
+        return None
+
+
+def _list_inodes(directory: str) -> tuple['int|None', dict[str, int]]:
+    """
+    Returns:
+        device of directory and inode numbers of its entries (by name); None and nothing if it cannot be listed
+    """
+
+    try:
+        with os.scandir(directory) as it:
+            inodes = {entry.name: entry.inode() for entry in it}
+        return os.stat(directory).st_dev, inodes
+    except OSError:
+        return None, {}
+
+
+def _append_custom_rules_json(repo: RepoMap, rulefile:
                               str, all_dir: str, os_dir: str) -> list[tuple[str, str]]:
     """
     Helper additional rules creator to parse json-style config files.
@@ -108,13 +437,9 @@ def _append_custom_rules_json(repo: dict[str, dict[str, str]], rulefile:
     """
     appended_cmds = []
     rulelist = util.load_from_json(rulefile)
+    index = _CustomRuleIndex(repo, all_dir)
     for rule in rulelist:
-        pattern = re.compile(f"{rule['src_repo']}:{rule['src_arch']}:.*?:{rule['file_pattern']}")
-        for elem_key, repo_elem in repo.items():
-            if all_dir not in repo_elem['elem_path']:
-                continue
-            if not pattern.match(elem_key):
-                continue
+        for repo_elem in index.matches(f"{rule['src_repo']}:{rule['src_arch']}", '.*?', rule['file_pattern']):
             output_path = repo_elem['elem_path'].replace(all_dir, os_dir)
             if rule.get('dst_repo'):
                 output_path = output_path.replace(repo_elem['elem_repo'], rule['dst_repo'].strip())
@@ -124,7 +449,7 @@ def _append_custom_rules_json(repo: dict[str, dict[str, str]], rulefile:
     return appended_cmds
 
 
-def _append_custom_rules_short(repo: dict[str, dict[str, str]], rulefile: str,
+def _append_custom_rules_short(repo: RepoMap, rulefile: str,
                                all_dir: str, os_dir: str) -> list[tuple[str, str]]:
     """
     Helper additional rules creator to parse condensed config files.
@@ -145,25 +470,161 @@ def _append_custom_rules_short(repo: dict[str, dict[str, str]], rulefile: str,
     for line in content:
         rule = line.split('->')
         rules.append((rule[0].strip(), rule[1].strip()))
+    index = _CustomRuleIndex(repo, all_dir)
     for file_pattern, repo_archs in rules:
         repo_arch_list = repo_archs.split('/')
-        pattern = re.compile(f"{repo_arch_list[0]}:.*:{file_pattern}")
-        for elem_key, repo_elem in repo.items():
-            m = pattern.match(elem_key)
-            if m:
-                if all_dir not in repo_elem['elem_path']:
-                    continue
-                output_path = repo_elem['elem_path'].replace(all_dir, os_dir)
-                if len(repo_arch_list) > 1:
-                    output_repo = repo_arch_list[1].split(':')[0].strip()
-                    output_path = output_path.replace(repo_elem['elem_repo'], output_repo)
-                    output_arch = repo_arch_list[1].split(':')[1].strip()
-                    output_path = output_path.replace(repo_elem['elem_arch'], output_arch)
-                appended_cmds.append((repo_elem['elem_path'], output_path))
+        for repo_elem in index.matches(repo_arch_list[0], '.*', file_pattern):
+            output_path = repo_elem['elem_path'].replace(all_dir, os_dir)
+            if len(repo_arch_list) > 1:
+                output_repo = repo_arch_list[1].split(':')[0].strip()
+                output_path = output_path.replace(repo_elem['elem_repo'], output_repo)
+                output_arch = repo_arch_list[1].split(':')[1].strip()
+                output_path = output_path.replace(repo_elem['elem_arch'], output_arch)
+            appended_cmds.append((repo_elem['elem_path'], output_path))
     return appended_cmds
 
 
-def _append_rule(src_repo: dict[str, dict[str, str]], dst_repo: dict[str, dict[str, str]], mapped_src_key: str,
+class _CustomRuleIndex:
+    """
+    Index of files (in all_dir) of a repository, used to find files matching custom rules.
+    A rule is a pattern of form <src_repo>:<src_arch>:<joiner>:<file_pattern> matched against keys
+    (repo:arch:pkg:name).
+    Files are bucketed by repo:arch and sorted by name within a bucket, so that only buckets matching
+    <src_repo>:<src_arch> and names starting with the literal prefix of <file_pattern> need to be matched.
+    Rules whose form does not allow that (e.g. alternatives or inline flags) are matched against all the files.
+    """
+
+    def __init__(self, repo: RepoMap, all_dir: str):
+        self.repo = repo
+        self.keys: list[str] = []  # keys of files in all_dir (in order of the map)
+        # 'repo:arch:' -> (sorted names, their positions)
+        self.buckets: dict[str, tuple[list[str], list[int]]] = {}
+        self.unindexed: list[int] = []  # positions of names containing ':' (always candidates)
+        buckets: dict[str, list[tuple[str, int]]] = {}
+        for key in repo.keys():
+            if all_dir not in repo[key]['elem_path']:
+                continue
+            position = len(self.keys)
+            self.keys.append(key)
+            parts = key.split(':', 3)
+            if len(parts) < 4 or ':' in parts[3]:
+                self.unindexed.append(position)
+            else:
+                buckets.setdefault(f'{parts[0]}:{parts[1]}:', []).append((parts[3], position))
+        for bucket, entries in buckets.items():
+            entries.sort()
+            self.buckets[bucket] = ([name for name, _ in entries], [position for _, position in entries])
+
+    def matches(self, head: str, joiner: str, file_pattern: str) -> list[RepoElem]:
+        """
+        Find files matching a rule (same as matching f'{head}:{joiner}:{file_pattern}' against every key).
+
+        Args:
+            head: <src_repo>:<src_arch> part of the pattern
+            joiner: pattern matching the pkg part of keys
+            file_pattern: pattern of file names
+
+        Returns:
+            matching files (in order of the map)
+        """
+
+        pattern = re.compile(f'{head}:{joiner}:{file_pattern}')
+        return [self.repo[self.keys[position]] for position in self._candidates(pattern, head, file_pattern)
+                if pattern.match(self.keys[position])]
+
+    def _candidates(self, pattern: 're.Pattern[str]', head: str, file_pattern: str) -> t.Iterable[int]:
+        """
+        Positions of keys that may match pattern (in order of the map).
+        """
+
+        if not self._indexable(pattern, head):
+            return range(len(self.keys))
+        head_pattern = re.compile(f'{head}:')
+        prefix = _literal_prefix(file_pattern)
+        positions = list(self.unindexed)
+        for bucket, (names, bucket_positions) in self.buckets.items():
+            if not head_pattern.match(bucket):
+                continue
+            if prefix:
+                positions += bucket_positions[bisect.bisect_left(names, prefix):
+                                              bisect.bisect_right(names, prefix + '\U0010ffff')]
+            else:
+                positions += bucket_positions
+        positions.sort()
+        return positions
+
+    @staticmethod
+    def _indexable(pattern: 're.Pattern[str]', head: str) -> bool:
+        """
+        Check if a rule pattern allows to use the index.
+        Keys have exactly three colons (as long as names have none). If the pattern has three colons of its own
+        (i.e. head is two patterns joined with a colon), neither of the parts can match a colon of the key.
+        So head must match exactly repo:arch and file_pattern starts at the beginning of the name.
+        """
+
+        if '|' in pattern.pattern or pattern.flags & ~re.UNICODE:
+            return False
+        parts = head.split(':')
+        if len(parts) != 2:
+            return False
+        try:
+            for part in parts:
+                re.compile(part)
+        except re.error:
+            return False
+        return True
+
+
+def _literal_prefix(pattern: str) -> str:
+    """
+    Get the literal prefix of a regular expression (a string that any match has to start with).
+
+    Args:
+        pattern: regular expression
+
+    Returns:
+        literal prefix (possibly empty)
+    """
+
+    prefix: list[str] = []
+    for char in pattern:
+        if char in _REGEX_SPECIAL_CHARS:
+            if char in '*?{' and prefix:  # previous character is optional
+                prefix.pop()
+            break
+        prefix.append(char)
+    return ''.join(prefix)
+
+
+def _index_by_variable_key(repo: RepoMap, repo_priority: list[str]) -> dict[str, dict[str, str]]:
+    """
+    Index repository by the arch-independent part of keys (Packages/x:file_name).
+
+    Args:
+        repo: repository map to index
+        repo_priority: repositories (in order of importance); files of other repositories are left out
+
+    Returns:
+        A dictionary of {variable_key: {arch: repository}}, where repository is the most important one
+        the file is found in (for that arch)
+    """
+
+    rank: dict[str, int] = {}
+    for i, repo_name in enumerate(repo_priority):
+        rank.setdefault(repo_name, i)
+    index: dict[str, dict[str, str]] = {}
+    for key in repo.keys():
+        elem_repo, elem_arch, variable_key = key.split(':', 2)
+        if elem_repo not in rank:
+            continue
+        found = index.setdefault(variable_key, {})
+        current = found.get(elem_arch)
+        if current is None or rank[elem_repo] < rank[current]:
+            found[elem_arch] = elem_repo
+    return index
+
+
+def _append_rule(src_repo: t.Mapping[str, RepoElem], dst_repo: RepoMap, mapped_src_key: str,
                  variable_key: str, current_repo: str, current_arch: str,
                  all_dir: str, os_dir: str, replacements: dict[str, str]) -> 'tuple[str, str]|None':
     """
@@ -174,8 +635,8 @@ def _append_rule(src_repo: dict[str, dict[str, str]], dst_repo: dict[str, dict[s
     These links' placement is determined by looking at the placement of the file in the source directory.
 
     Args:
-        src_repo: repository dict to model after
-        dst_repo: repository dict that is modeled
+        src_repo: repository map to model after
+        dst_repo: repository map that is modeled
         mapped_src_key: key identifying file in source repository
         variable_key: partial key from which to create complete keys (for search)
         current_repo: repository to look into (add to variable_key)
@@ -191,18 +652,20 @@ def _append_rule(src_repo: dict[str, dict[str, str]], dst_repo: dict[str, dict[s
     ret_cmd = None
     try:
         search_key = f'{current_repo}:{current_arch}:{variable_key}'  # create search key
-        if dst_repo[search_key]:  # test if such key exists - i.e. the first most important repo hits
+        dst_elem = dst_repo[search_key]
+        if dst_elem:  # test if such key exists - i.e. the first most important repo hits
+            src_elem = src_repo[mapped_src_key]
             # in the file path relative to base replace destination repository with repository found in source
-            target_repo = src_repo[mapped_src_key]["elem_repo"]
+            target_repo = src_elem["elem_repo"]
             if replacements and replacements.get(target_repo):
                 target_repo = replacements[target_repo]
-            output_repo = dst_repo[search_key]['elem_rel'].replace(f'{current_repo}/', f'{target_repo}/')
+            output_repo = dst_elem['elem_rel'].replace(f'{current_repo}/', f'{target_repo}/')
             # replace destination architecture with architecture found in source
-            output_repo = output_repo.replace(f'{current_arch}/', f'{src_repo[mapped_src_key]["elem_arch"]}/')
+            output_repo = output_repo.replace(f'{current_arch}/', f'{src_elem["elem_arch"]}/')
             output_repo = output_repo.replace(all_dir, os_dir)
-            output_path = os.path.join(dst_repo[search_key]['elem_abs'], output_repo, dst_repo[search_key]['elem_name'])
+            output_path = os.path.join(dst_elem['elem_abs'], output_repo, dst_elem['elem_name'])
             # linking dest elem_path (full path to file) to (os) path created from source's repository
-            ret_cmd = (dst_repo[search_key]['elem_path'], output_path)
+            ret_cmd = (dst_elem['elem_path'], output_path)
     except KeyError:
         pass
     return ret_cmd
@@ -0,0 +1,281 @@
+"""
+Rules files - json, packed (binary, columnar) or ndjson (streamed) format.
+
+Packed format stores every directory prefix and every file name just once (in a prefix table and a name table)
+and each command as (prefix id, name id) pairs in 32-bit columns:
+
+    magic (8 bytes) | header: sizes of the tables and numbers of commands (little-endian uint64)
+    prefix table | name table (utf-8, every string NUL terminated)
+    mkdir column: prefix ids of created directories
+    mv, ln and rm columns: src prefix ids, src name ids, dst prefix ids, dst name ids (each as a separate column)
+
+A prefix keeps its trailing slash, so prefix + name is exactly the original path.
+Packed files are several times smaller than json and are loaded without parsing the whole file as text.
+
+Ndjson format holds a single command per line (as a json array), in order of execution:
+
+    ["mkdir", "/dst/dir"]
+    ["mv", "/src/file", "/dst/file"]
+    ["ln", "/src/file", "/dst/file"]
+
+so it can be written and read (and applied, see execution.apply_rules_stream) one command at a time.
+"""
+
+import array
+import itertools
+import json
+import struct
+import sys
+import typing as t
+
+import composer.util as util
+from composer.composer_types import CommandsDataType
+
+FORMATS = ('auto', 'json', 'packed', 'ndjson')
+PACKED_EXTENSION = '.packed'  # not '.rules' - existing *.rules files are json
+NDJSON_EXTENSION = '.ndjson'
+
+_MAGIC = b'CMPRULE1'
+# prefix table size, name table size, mkdir count, mv count, ln count, rm count (-1 if there is no 'rm' key)
+_HEADER = struct.Struct('<6q')
+_KINDS = ('mv', 'ln', 'rm')
+_LINES_CHUNK = 4096  # ndjson lines written/parsed at once
+
+
+def save_rules(cmds: CommandsDataType, filename: str, rules_format: str = 'auto') -> None:
+    """
+    Save rules dictionary into file.
+
+    Args:
+        cmds: commands dictionary
+        filename: name of the output file
+        rules_format: 'json', 'packed', 'ndjson' or 'auto' (by filename extension - PACKED_EXTENSION, NDJSON_EXTENSION,
+                      json otherwise)
+    """
+
+    if rules_format == 'auto':
+        rules_format = ('packed' if filename.endswith(PACKED_EXTENSION) else
+                        'ndjson' if filename.endswith(NDJSON_EXTENSION) else 'json')
+    if rules_format == 'json':
+        util.save_to_json(cmds, filename)
+        return
+    if rules_format == 'ndjson':
+        write_commands(iter_ruleset(cmds), filename)
+        return
+    with open(filename, 'wb') as savefile:
+        savefile.write(pack(cmds))
+
+
+def load_rules(filename: str, rules_format: str = 'auto') -> CommandsDataType:
+    """
+    Load rules dictionary from file.
+
+    Args:
+        filename: name of the file to load dictionary from
+        rules_format: 'json', 'packed', 'ndjson' or 'auto' (recognized by file content, see detect_format)
+
+    Returns:
+        dictionary of rules to execute
+    """
+
+    if rules_format == 'auto':
+        rules_format = detect_format(filename)
+    if rules_format == 'json':
+        cmds: CommandsDataType = util.load_from_json(filename)
+        return cmds
+    if rules_format == 'ndjson':
+        cmds = {'mkdir': [], 'mv': [], 'ln': []}
+        for kind, *paths in iter_commands(filename):
+            if kind == 'mkdir':
+                cmds['mkdir'].append(paths[0])
+            else:
+                cmds.setdefault(kind, []).append(tuple(paths))  # type: ignore
+        return cmds
+    with open(filename, 'rb') as loadfile:
+        return unpack(loadfile.read())
+
+
+def detect_format(filename: str) -> str:
+    """
+    Recognize format of a rules file by its content.
+
+    Args:
+        filename: rules file
+
+    Returns:
+        'packed', 'ndjson' or 'json'
+    """
+
+    with open(filename, 'rb') as loadfile:
+        start = loadfile.read(len(_MAGIC))
+    if start == _MAGIC:
+        return 'packed'
+    # json rules are a single object, ndjson starts with an array (or is empty)
+    return 'ndjson' if start.lstrip()[:1] in (b'[', b'') else 'json'
+
+
+def iter_ruleset(cmds: CommandsDataType) -> t.Iterator[tuple[str, ...]]:
+    """
+    Args:
+        cmds: commands dictionary
+
+    Returns:
+        iterator over commands - (kind, path) or (kind, src, dst) tuples in order of execution
+    """
+
+    for path in cmds['mkdir']:
+        yield 'mkdir', path
+    for kind, cmd_list in ('mv', cmds['mv']), ('ln', cmds['ln']), ('rm', cmds.get('rm', [])):
+        for src, dst in cmd_list:
+            yield kind, src, dst
+
+
+def write_commands(commands: t.Iterable[t.Sequence[str]], filename: str) -> None:
+    """
+    Write commands into a ndjson rules file as they come (the whole ruleset never has to be held in memory).
+
+    Args:
+        commands: (kind, path) or (kind, src, dst) tuples
+        filename: name of the output file
+    """
+
+    commands = iter(commands)
+    with open(filename, 'w') as savefile:
+        while True:
+            lines = [f'{json.dumps(command)}\n' for command in itertools.islice(commands, _LINES_CHUNK)]
+            if not lines:
+                break
+            savefile.write(''.join(lines))
+
+
+def iter_commands(filename: str, rules_format: str = 'auto') -> t.Iterator[tuple[str, ...]]:
+    """
+    Read commands one by one. Only ndjson files are actually streamed, other formats are loaded whole first.
+
+    Args:
+        filename: rules file
+        rules_format: see load_rules
+
+    Returns:
+        iterator over (kind, path) or (kind, src, dst) tuples in order of execution
+    """
+
+    if rules_format == 'auto':
+        rules_format = detect_format(filename)
+    if rules_format != 'ndjson':
+        yield from iter_ruleset(load_rules(filename, rules_format))
+        return
+    with open(filename) as loadfile:
+        line_number = 0
+        while True:
+            block = list(itertools.islice(loadfile, _LINES_CHUNK))
+            if not block:
+                break
+            lines = [(line_number + i, line) for i, line in enumerate(block, 1) if line.strip()]
+            line_number += len(block)
+            try:
+                # a single parser call per block of lines is several times faster than parsing them one by one
+                commands = json.loads(f'[{",".join(line for _, line in lines)}]')
+            except ValueError:
+                commands = None
+            if commands is not None and len(commands) != len(lines):
+                commands = None  # a line holding several values - parsed one by one to find it
+            for i, (number, line) in enumerate(lines):
+                try:
+                    command = json.loads(line) if commands is None else commands[i]
+                except ValueError:
+                    command = None
+                if (not isinstance(command, list) or not command or command[0] not in ('mkdir',) + _KINDS or
+                        len(command) != (2 if command[0] == 'mkdir' else 3)):
+                    raise ValueError(f'{filename}:{number}: invalid command {line.strip()}')
+                yield tuple(command)
+
+
+def pack(cmds: CommandsDataType) -> bytes:
+    """
+    Args:
+        cmds: commands dictionary
+
+    Returns:
+        commands in packed format
+    """
+
+    prefixes: dict[str, int] = {}
+    names: dict[str, int] = {}
+    mkdir = array.array('I', [prefixes.setdefault(path, len(prefixes)) for path in cmds['mkdir']])
+    columns = []
+    counts = []
+    for cmd_list in cmds['mv'], cmds['ln'], cmds.get('rm'):
+        counts.append(-1 if cmd_list is None else len(cmd_list))
+        src_prefix, src_name, dst_prefix, dst_name = (array.array('I') for _ in range(4))
+        for src, dst in cmd_list or ():
+            cut = src.rfind('/') + 1
+            src_prefix.append(prefixes.setdefault(src[:cut], len(prefixes)))
+            src_name.append(names.setdefault(src[cut:], len(names)))
+            cut = dst.rfind('/') + 1
+            dst_prefix.append(prefixes.setdefault(dst[:cut], len(prefixes)))
+            dst_name.append(names.setdefault(dst[cut:], len(names)))
+        columns += [src_prefix, src_name, dst_prefix, dst_name]
+    prefix_table = _pack_table(prefixes)
+    name_table = _pack_table(names)
+    header = _HEADER.pack(len(prefix_table), len(name_table), len(mkdir), *counts)
+    return b''.join([_MAGIC, header, prefix_table, name_table] + [_to_bytes(column) for column in [mkdir] + columns])
+
+
+def unpack(data: bytes) -> CommandsDataType:
+    """
+    Args:
+        data: commands in packed format
+
+    Returns:
+        commands dictionary
+    """
+
+    if data[:len(_MAGIC)] != _MAGIC:
+        raise ValueError('Not a packed rules file')
+    offset = len(_MAGIC)
+    prefix_size, name_size, mkdir_count, *counts = _HEADER.unpack_from(data, offset)
+    offset += _HEADER.size
+    prefixes = _unpack_table(data[offset:offset + prefix_size])
+    offset += prefix_size
+    names = _unpack_table(data[offset:offset + name_size])
+    offset += name_size
+    mkdir, offset = _read_column(data, offset, mkdir_count)
+    cmds: CommandsDataType = {'mkdir': [prefixes[i] for i in mkdir], 'mv': [], 'ln': []}
+    for kind, count in zip(_KINDS, counts):
+        if count < 0:
+            continue
+        src_prefix, offset = _read_column(data, offset, count)
+        src_name, offset = _read_column(data, offset, count)
+        dst_prefix, offset = _read_column(data, offset, count)
+        dst_name, offset = _read_column(data, offset, count)
+        cmds[kind] = [(prefixes[sp] + names[sn], prefixes[dp] + names[dn])  # type: ignore
+                      for sp, sn, dp, dn in zip(src_prefix, src_name, dst_prefix, dst_name)]
+    if offset != len(data):
+        raise ValueError('Corrupted packed rules file')
+    return cmds
+
+
+def _pack_table(strings: dict[str, int]) -> bytes:
+    return ''.join(f'{string}\0' for string in strings).encode('utf-8', 'surrogateescape')
+
+
+def _unpack_table(data: bytes) -> list[str]:
+    return data.decode('utf-8', 'surrogateescape').split('\0')[:-1]
+
+
+def _to_bytes(column: 'array.array[int]') -> bytes:
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column.tobytes()
+
+
+def _read_column(data: bytes, offset: int, count: int) -> tuple[t.Sequence[int], int]:
+    end = offset + 4 * count
+    if end > len(data):
+        raise ValueError('Truncated packed rules file')
+    column = array.array('I')
+    column.frombytes(data[offset:end])
+    if sys.byteorder == 'big':
+        column.byteswap()
+    return column, end
@@ -0,0 +1,137 @@
+import json
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import composer.batch as b
+import composer.mapremote as mr
+import composer.maptarget as mt
+import composer.parser as p
+import composer.rules as r
+
+
+class TestBatch(unittest.TestCase):
+
+    def _create_tree(self, base, files):
+        for path in files:
+            os.makedirs(os.path.join(base, os.path.dirname(path)), exist_ok=True)
+            open(os.path.join(base, path), 'w').close()
+
+    def _write_manifest(self, tmp, jobs):
+        filename = os.path.join(tmp, 'manifest.json')
+        with open(filename, 'w') as f:
+            json.dump(jobs, f)
+        return filename
+
+    def test_load_manifest(self):
+        args = p.parse_args(['batch', '-i', 'manifest.json', '-a', 'x86_64,noarch', '-T', '4', '-r', 'True'])
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = self._write_manifest(tmp, [
+                {'src_repo': '/mirror/redhat8/', 'dst_repo': '/srv/eurolinux8/',
+                 'replacements': {'CodeReady': 'PowerTools'}},
+                {'src_map': 'redhat9.idx', 'dst_repo': '/srv/eurolinux9/', 'archs': ['aarch64'],
+                 'include_beta': True, 'move_debug': 'False'}])
+            first, second = b.load_manifest(filename, args)
+        self.assertEqual((first.src_repo, first.src_map, first.dst_repo),
+                         ('/mirror/redhat8/', None, '/srv/eurolinux8/'))
+        self.assertEqual(first.replacements, {'CodeReady': 'PowerTools'})
+        self.assertEqual(first.archs, ['x86_64', 'noarch'])
+        self.assertTrue(first.move_debug)
+        self.assertEqual((second.src_repo, second.src_map), (None, 'redhat9.idx'))
+        self.assertEqual(second.archs, ['aarch64'])
+        self.assertTrue(second.include_beta)
+        self.assertFalse(second.move_debug)
+        for job in first, second:
+            self.assertEqual((job.threads, job.real_run, job.exec_mode), (4, True, 'path'))
+            self.assertEqual(job.repo_priority, args.repo_priority)
+
+    def test_load_manifest_invalid(self):
+        args = p.parse_args(['batch', '-i', 'manifest.json'])
+        with tempfile.TemporaryDirectory() as tmp:
+            for content in ({'src_repo': '/a/', 'dst_repo': '/b/'},
+                            [{'src_repo': '/a/', 'dst_repo': '/b/', 'output_file': 'x.json'}],
+                            [{'src_repo': '/a/'}],
+                            [{'src_repo': '/a/', 'src_map': 'a.idx', 'dst_repo': '/b/'}],
+                            [{'dst_repo': '/b/'}]):
+                with self.subTest(content=content), self.assertRaises(ValueError):
+                    b.load_manifest(self._write_manifest(tmp, content), args)
+
+    def test_group_by_destination(self):
+        jobs = [p.parse_args(['direct', '-s', '/src/', '-d', dst])
+                for dst in ['/srv/el8/', '/srv/el9', '/srv/el8', '/srv/el9/BaseOS/', '/srv/el8-beta/']]
+        self.assertEqual(b._group_by_destination(jobs), [[0, 2], [1, 3], [4]])
+
+    def test_merge_rulesets(self):
+        first = {'mkdir': [], 'mv': [('/a/all/x-debuginfo.rpm', '/a/debug/x-debuginfo.rpm')],
+                 'ln': [('/a/all/x.rpm', '/a/os/x.rpm')]}
+        second = {'mkdir': [], 'mv': [('/a/all/x-debuginfo.rpm', '/a/debug/x-debuginfo.rpm')],
+                  'ln': [('/a/all/y.rpm', '/a/os/y.rpm')], 'rm': [('/a/all/z.rpm', '/a/os/z.rpm')]}
+        self.assertIs(b._merge_rulesets([first]), first)
+        self.assertEqual(b._merge_rulesets([first, second]),
+                         {'mkdir': [], 'mv': first['mv'], 'ln': first['ln'] + second['ln'], 'rm': second['rm']})
+
+    def test_map_jobs_remote(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(os.path.join(tmp, 'src'), ['BaseOS/x86_64/os/Packages/a/a-1.el8.x86_64.rpm',
+                                                         'BaseOS/x86_64/os/Packages/b/b-1.el8.x86_64.rpm'])
+            self._create_tree(os.path.join(tmp, 'dst'), ['BaseOS/x86_64/all/Packages/a/a-1.el8.x86_64.rpm'])
+            url = pathlib.Path(tmp, 'src').as_uri()
+            filename = self._write_manifest(tmp, [
+                {'src_repo': f'{tmp}/src', 'dst_repo': f'{tmp}/dst', 'skip_dirs': 'debug'},
+                {'src_repo': url, 'dst_repo': f'{tmp}/dst', 'skip_dirs': 'debug'},
+                {'src_repo': url, 'dst_repo': f'{tmp}/dst', 'skip_dirs': 'debug', 'previous_rules': 'el.rules'}])
+            args = p.parse_args(['batch', '-i', filename, '-T', '2', '-L', os.path.join(tmp, 'listings.json')])
+            jobs = b.load_manifest(filename, args)
+            self.assertEqual(jobs[1].listing_cache, os.path.join(tmp, 'listings.json'))
+            with patch('composer.mapremote.map_remote', wraps=mr.map_remote) as map_remote_mock:
+                (local, dst, _), (remote, _, _), (again, _, _) = b.map_jobs(jobs, args)
+            map_remote_mock.assert_called_once()
+            self.assertIs(remote, again)
+            self.assertEqual(sorted(remote), sorted(local))
+            self.assertEqual(len(remote), 2)
+            self.assertEqual(r.create_link_commands(remote, dst, jobs[1]), r.create_link_commands(local, dst, jobs[0]))
+
+    def test_run_batch(self):
+        for cpus in 1, 4:
+            with self.subTest(cpus=cpus), patch('os.cpu_count', return_value=cpus):
+                self._run_batch()
+
+    def _run_batch(self):
+        src_files = [f'{repo}/{arch}/all/Packages/{c}/{c}pkg-{i}.el8.{arch}.rpm'
+                     for repo in ['BaseOS', 'AppStream'] for arch in ['x86_64', 'aarch64'] for c in 'ab'
+                     for i in range(3)]
+        dst_files = [f'{repo}/{arch}/all/Packages/{c}/{c}pkg-{i}.el8.{arch}.rpm'
+                     for repo in ['BaseOS', 'AppStream'] for arch in ['x86_64', 'aarch64'] for c in 'ab'
+                     for i in range(2)]
+        dst_files += ['BaseOS/x86_64/all/Packages/a/apkg-debuginfo-0.el8.x86_64.rpm']
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(os.path.join(tmp, 'src'), src_files)
+            for dst in 'el1', 'el2', 'el3':
+                self._create_tree(os.path.join(tmp, dst), dst_files)
+            filename = self._write_manifest(tmp, [
+                {'src_repo': f'{tmp}/src/', 'dst_repo': f'{tmp}/el1/'},
+                {'src_repo': f'{tmp}/src/', 'dst_repo': f'{tmp}/el2/', 'archs': ['x86_64']},
+                {'src_repo': f'{tmp}/src', 'dst_repo': f'{tmp}/el3/', 'previous_rules': f'{tmp}/el3.rules'}])
+            args = p.parse_args(['batch', '-i', filename, '-T', '4', '-r', 'True'])
+            jobs = b.load_manifest(filename, args)
+            expected = [r.create_ruleset(job) for job in jobs]
+            with patch('composer.maptarget.map_targets', wraps=mt.map_targets) as map_targets_mock:
+                b.run_batch(jobs, args)
+            map_targets_mock.assert_called_once()
+            self.assertEqual(len(map_targets_mock.call_args[0][0]), 5)  # src mapped twice (all and x86_64 archs)
+            for dst, cmds in zip(['el1', 'el2', 'el3'], expected):
+                with self.subTest(dst=dst):
+                    for _, link in cmds['ln']:
+                        self.assertTrue(os.path.exists(link), link)
+                    for src, moved in cmds['mv']:
+                        self.assertFalse(os.path.exists(src))
+                        self.assertTrue(os.path.exists(moved))
+            self.assertEqual(len(expected[0]['ln']), 16)
+            self.assertEqual(len(expected[1]['ln']), 8)
+            self.assertEqual(expected[0]['mv'], [(f'{tmp}/el1/BaseOS/x86_64/all/Packages/a/'
+                                                  'apkg-debuginfo-0.el8.x86_64.rpm',
+                                                  f'{tmp}/el1/BaseOS/x86_64/debug/Packages/a/'
+                                                  'apkg-debuginfo-0.el8.x86_64.rpm')])
+            self.assertEqual(len(r.load_previous_rules(f'{tmp}/el3.rules')['ln']), 16)
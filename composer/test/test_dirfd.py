@@ -0,0 +1,59 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import composer.dirfd as dirfd
+import composer.execution as e
+
+
+class TestDirFd(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.all = os.path.join(self.tmp.name, 'BaseOS/x86_64/all/Packages/a')
+        self.os = os.path.join(self.tmp.name, 'BaseOS/x86_64/os/Packages/a')
+        os.makedirs(self.all)
+        os.makedirs(self.os)
+        for name in 'a1.rpm', 'a2.rpm', 'a3.rpm':
+            open(os.path.join(self.all, name), 'w').close()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def _same_file(self, first, second):
+        return os.stat(first).st_ino == os.stat(second).st_ino
+
+    def test_rename_batch(self):
+        dirfd.rename_batch([(os.path.join(self.all, 'a1.rpm'), os.path.join(self.os, 'a1.rpm')),
+                            (os.path.join(self.all, 'a2.rpm'), os.path.join(self.os, 'b2.rpm'))])
+        self.assertEqual(os.listdir(self.all), ['a3.rpm'])
+        self.assertEqual(sorted(os.listdir(self.os)), ['a1.rpm', 'b2.rpm'])
+
+    def test_link_batch(self):
+        os.link(os.path.join(self.all, 'a1.rpm'), os.path.join(self.os, 'a1.rpm'))
+        open(os.path.join(self.os, 'a2.rpm'), 'w').close()
+        batch = [(os.path.join(self.all, name), os.path.join(self.os, name)) for name in ('a1.rpm', 'a2.rpm', 'a3.rpm')]
+        with patch('os.unlink', wraps=os.unlink) as unlink_mock:
+            dirfd.link_batch(batch)
+        self.assertEqual(unlink_mock.call_count, 1)
+        for src, dst in batch:
+            self.assertTrue(self._same_file(src, dst))
+
+    def test_link_batch_same_dir(self):
+        dirfd.link_batch([(os.path.join(self.all, 'a1.rpm'), os.path.join(self.all, 'a1-copy.rpm'))])
+        self.assertTrue(self._same_file(os.path.join(self.all, 'a1.rpm'), os.path.join(self.all, 'a1-copy.rpm')))
+
+    def test_apply_rules_dirfd(self):
+        debug = os.path.join(self.tmp.name, 'BaseOS/x86_64/debug/Packages/a')
+        cmds = {
+            'mkdir': [],
+            'mv': [(os.path.join(self.all, 'a3.rpm'), os.path.join(debug, 'a3.rpm'))],
+            'ln': [(os.path.join(self.all, 'a1.rpm'), os.path.join(self.os, 'a1.rpm')),
+                   (os.path.join(debug, 'a3.rpm'), os.path.join(self.os, 'a3.rpm'))]
+        }
+        e.apply_rules(cmds, 4, real_run=True, exec_mode='dirfd')
+        self.assertEqual(cmds['mkdir'], [debug])
+        self.assertEqual(sorted(os.listdir(self.all)), ['a1.rpm', 'a2.rpm'])
+        self.assertTrue(self._same_file(os.path.join(self.all, 'a1.rpm'), os.path.join(self.os, 'a1.rpm')))
+        self.assertTrue(self._same_file(os.path.join(debug, 'a3.rpm'), os.path.join(self.os, 'a3.rpm')))
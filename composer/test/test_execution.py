@@ -1,4 +1,5 @@
 import os
+import tempfile
 import unittest
 from unittest.mock import call, patch, mock_open
 
@@ -54,7 +55,7 @@ class TestExecution(unittest.TestCase):
         e.apply_rules(mock_cmd_dict, threads=1, real_run=True)
         self.assertEqual(len(mock_cmd_dict['mkdir']), 1)
         self.assertEqual(mock_cmd_dict['mkdir'], ['/minefield/eurolinux8/AppStream/x86_64/os/Packages/a'])
-        once_mock.assert_called_once_with(mock_cmd_dict)
+        once_mock.assert_called_once_with(mock_cmd_dict, 'path')
 
     @patch('composer.execution._run_in_threads')
     def test_apply_rules_run_threaded(self, threads_mock):
@@ -79,7 +80,7 @@ class TestExecution(unittest.TestCase):
         e.apply_rules(mock_cmd_dict, threads=2, real_run=True)
         self.assertEqual(len(mock_cmd_dict['mkdir']), 1)
         self.assertEqual(mock_cmd_dict['mkdir'], ['/minefield/eurolinux8/AppStream/x86_64/os/Packages/a'])
-        threads_mock.assert_called_once_with(mock_cmd_dict, 2)
+        threads_mock.assert_called_once_with(mock_cmd_dict, 2, 'path')
 
     @patch('os.makedirs')
     @patch('os.rename')
@@ -110,12 +111,19 @@ class TestExecution(unittest.TestCase):
                 "/minefield/eurolinux8/AppStream/x86_64/all/Packages/a/aide-0.16-11.el8.x86_64.rpm",
                 "/minefield/eurolinux8/AppStream/x86_64/os/Packages/a/aide-0.16-11.el8.x86_64.rpm")
 
-    @patch('composer.execution._prep_for_threads')
-    @patch('composer.execution._apply_2arg_fun')
-    def test_run_multiple_threads(self, two_arg_mock, prep_mock):
+    @patch('os.makedirs')
+    @patch('os.rename')
+    @patch('os.link')
+    def test_run_multiple_threads(self, link_mock, rename_mock, makedirs_mock):
         mock_cmd_dict = {
-                          "mkdir": [],
-                          "mv": [],
+                          "mkdir": ["/minefield/eurolinux8/AppStream/x86_64/os/Packages/a"],
+                          "mv":
+                          [
+                            [
+                              "/minefield/eurolinux8/BaseOS/i686/all/Packages/a/aide-debuginfo-0.16-14.el8.i686.rpm",
+                              "/minefield/eurolinux8/BaseOS/i686/debug/Packages/a/aide-debuginfo-0.16-14.el8.i686.rpm"
+                            ]
+                          ],
                           "ln":
                           [
                            [
@@ -128,26 +136,156 @@ class TestExecution(unittest.TestCase):
                            ]
                           ]
                         }
-        prep_mock.side_effect = [
-                    [[]],
-                    [
-                        ["/minefield/eurolinux8/AppStream/x86_64/all/Packages/a/aide-0.16-11.el8.x86_64.rpm",
-                         "/minefield/eurolinux8/AppStream/x86_64/os/Packages/a/aide-0.16-11.el8.x86_64.rpm"
-                         ],
-                        ["/minefield/eurolinux8/BaseOS/i686/all/Packages/a/alsa-lib-1.2.8-2.el8.i686.rpm",
-                         "/minefield/eurolinux8/AppStream/x86_64/os/Packages/a/alsa-lib-1.2.8-2.el8.i686.rpm"
-                         ]
-                    ]
-                ]
         e._run_in_threads(mock_cmd_dict, thread_num=2)
-        prep_mock.assert_has_calls([call(mock_cmd_dict['mv'], 2), call(mock_cmd_dict['ln'], 2)])
-        two_arg_mock.assert_called()
-        # GH has some issues with check below
-        # two_arg_mock.assert_has_calls(
-        #         [call([], os.rename),
-        #          call(["/minefield/eurolinux8/AppStream/x86_64/all/Packages/a/aide-0.16-11.el8.x86_64.rpm",
-        #                "/minefield/eurolinux8/AppStream/x86_64/os/Packages/a/aide-0.16-11.el8.x86_64.rpm"],
-        #               e._create_link)])
+        makedirs_mock.assert_called_once_with("/minefield/eurolinux8/AppStream/x86_64/os/Packages/a", exist_ok=True)
+        rename_mock.assert_called_once_with(*mock_cmd_dict['mv'][0])
+        link_mock.assert_has_calls([call(*mock_cmd_dict['ln'][0]), call(*mock_cmd_dict['ln'][1])])
+
+    def test_plan_tasks(self):
+        mock_cmd_dict = {
+                          "mkdir": ["/repo/debug/Packages/a", "/repo/os/Packages/a"],
+                          "mv": [("/repo/all/Packages/a/a-debuginfo.rpm", "/repo/debug/Packages/a/a-debuginfo.rpm")],
+                          "ln": [("/repo/all/Packages/a/a.rpm", "/repo/os/Packages/a/a.rpm"),
+                                 ("/repo/all/Packages/a/a-debuginfo.rpm", "/repo/os/Packages/a/a-debuginfo.rpm"),
+                                 ("/repo/all/Packages/b/b.rpm", "/repo/os2/Packages/b/b.rpm"),
+                                 ("/repo/os2/Packages/b/b.rpm", "/repo/os/Packages/a/b.rpm"),
+                                 ("/repo/all/Packages/a/a.rpm", "/repo/os/Packages/a/a2.rpm")]
+                        }
+        tasks = e._plan_tasks(mock_cmd_dict)
+        self.assertEqual([task.batch for task in tasks],
+                         [["/repo/debug/Packages/a"], ["/repo/os/Packages/a"], mock_cmd_dict['mv'],
+                          [mock_cmd_dict['ln'][0], mock_cmd_dict['ln'][1]], [mock_cmd_dict['ln'][2]],
+                          [mock_cmd_dict['ln'][3], mock_cmd_dict['ln'][4]]])
+        mkdir_debug, mkdir_os, mv, ln_os, ln_os2, ln_os_after_os2 = tasks
+        self.assertEqual(mkdir_debug.dependents, {mv})
+        self.assertEqual(mkdir_os.dependents, {ln_os, ln_os_after_os2})
+        self.assertEqual(mv.dependents, {ln_os})
+        self.assertEqual(ln_os2.dependents, {ln_os_after_os2})
+        self.assertEqual([task.pending for task in tasks], [0, 0, 1, 2, 0, 2])
+
+    def test_plan_tasks_remove(self):
+        mock_cmd_dict = {
+                          "mkdir": [],
+                          "mv": [],
+                          "ln": [("/repo/all/Packages/a/a-2.rpm", "/repo/os/Packages/a/a-2.rpm")],
+                          "rm": [("/repo/all/Packages/a/a-1.rpm", "/repo/os/Packages/a/a-1.rpm"),
+                                 ("/repo/all/Packages/a/a-2.rpm", "/repo/os/Packages/a/a.rpm")]
+                        }
+        for mode, fun in ('path', e._remove_batch), ('dirfd', e.dirfd.remove_batch):
+            with self.subTest(mode=mode):
+                ln, rm = e._plan_tasks(mock_cmd_dict, mode)
+                self.assertEqual(rm.batch, mock_cmd_dict['rm'])
+                self.assertEqual(rm.fun, fun)
+                self.assertEqual(rm.pending, 0)  # reading a linked file does not wait for the link
+
+    def test_remove_link(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            names = ['linked', 'relinked', 'missing_src', 'missing_dst']
+            for name in names:
+                open(os.path.join(tmp, f'{name}.src'), 'w').close()
+                os.link(os.path.join(tmp, f'{name}.src'), os.path.join(tmp, f'{name}.dst'))
+            os.remove(os.path.join(tmp, 'relinked.dst'))
+            open(os.path.join(tmp, 'relinked.dst'), 'w').close()
+            os.remove(os.path.join(tmp, 'missing_src.src'))
+            os.remove(os.path.join(tmp, 'missing_dst.dst'))
+            batch = [(os.path.join(tmp, f'{name}.src'), os.path.join(tmp, f'{name}.dst')) for name in names]
+            for fun in e._remove_batch, e.dirfd.remove_batch:
+                with self.subTest(fun=fun.__module__):
+                    fun(batch)
+                    fun(batch)
+                    self.assertEqual(sorted(os.listdir(tmp)),
+                                     ['linked.src', 'missing_dst.src', 'relinked.dst', 'relinked.src'])
+                    os.link(os.path.join(tmp, 'linked.src'), os.path.join(tmp, 'linked.dst'))
+                    open(os.path.join(tmp, 'missing_src.dst'), 'w').close()
+
+    def test_chunk_commands(self):
+        commands = [('mkdir', '/r/os'), ('mv', '/r/a', '/r/b'), ('ln', '/r/b', '/r/os/b'), ('rm', '/r/c', '/r/os/c')]
+        self.assertEqual(list(e._chunk_commands(commands, 2)),
+                         [({'mkdir': [], 'mv': [('/r/a', '/r/b')], 'ln': [('/r/b', '/r/os/b')], 'rm': []},
+                           [('mv', '/r/a', '/r/b'), ('ln', '/r/b', '/r/os/b')]),
+                          ({'mkdir': [], 'mv': [], 'ln': [], 'rm': [('/r/c', '/r/os/c')]},
+                           [('rm', '/r/c', '/r/os/c')])])
+        with self.assertRaises(ValueError):
+            list(e._chunk_commands([('cp', '/r/a', '/r/b')], 2))
+
+    def test_apply_rules_stream(self):
+        for threads, exec_mode in (1, 'path'), (4, 'path'), (4, 'dirfd'):
+            with self.subTest(threads=threads, exec_mode=exec_mode), tempfile.TemporaryDirectory() as tmp:
+                os.makedirs(f'{tmp}/all/a')
+                for name in 'a.rpm', 'a-debuginfo.rpm', 'b.rpm':
+                    open(f'{tmp}/all/a/{name}', 'w').close()
+                commands = [('mv', f'{tmp}/all/a/a-debuginfo.rpm', f'{tmp}/debug/a/a-debuginfo.rpm'),
+                            ('ln', f'{tmp}/debug/a/a-debuginfo.rpm', f'{tmp}/os/a/a-debuginfo.rpm'),
+                            ('ln', f'{tmp}/all/a/a.rpm', f'{tmp}/os/a/a.rpm'),
+                            ('ln', f'{tmp}/all/a/b.rpm', f'{tmp}/os/b/b.rpm'),
+                            ('rm', f'{tmp}/all/a/b.rpm', f'{tmp}/os/b/b.rpm')]
+                e.apply_rules_stream(iter(commands), threads, True, exec_mode, chunk_size=1)
+                self.assertEqual(sorted(os.listdir(f'{tmp}/os/a')), ['a-debuginfo.rpm', 'a.rpm'])
+                self.assertEqual(os.listdir(f'{tmp}/os/b'), [])
+                self.assertEqual(os.stat(f'{tmp}/os/a/a-debuginfo.rpm').st_ino,
+                                 os.stat(f'{tmp}/debug/a/a-debuginfo.rpm').st_ino)
+
+    def test_apply_rules_stream_interleaved(self):
+        for threads, exec_mode in (1, 'path'), (4, 'path'), (4, 'dirfd'):
+            with self.subTest(threads=threads, exec_mode=exec_mode), tempfile.TemporaryDirectory() as tmp:
+                os.makedirs(f'{tmp}/all')
+                open(f'{tmp}/all/a.rpm', 'w').close()
+                # a link created, then moved and linked again, then the first link removed - in a single chunk
+                commands = [('ln', f'{tmp}/all/a.rpm', f'{tmp}/os/a.rpm'),
+                            ('mv', f'{tmp}/os/a.rpm', f'{tmp}/debug/a.rpm'),
+                            ('ln', f'{tmp}/debug/a.rpm', f'{tmp}/os/a.rpm'),
+                            ('rm', f'{tmp}/all/a.rpm', f'{tmp}/all/a.rpm')]
+                e.apply_rules_stream(iter(commands), threads, True, exec_mode)
+                self.assertEqual(os.listdir(f'{tmp}/all'), [])
+                self.assertEqual(os.stat(f'{tmp}/os/a.rpm').st_ino, os.stat(f'{tmp}/debug/a.rpm').st_ino)
+                self.assertEqual(os.stat(f'{tmp}/os/a.rpm').st_nlink, 2)
+        with self.assertLogs(level='INFO') as logs:
+            e.apply_rules_stream(iter([('ln', '/r/a', '/r/b'), ('mv', '/r/b', '/r/c')]), 1)
+        self.assertEqual([record.getMessage() for record in logs.records][-2:],
+                         ['os.link("/r/a", "/r/b")', 'os.rename("/r/b", "/r/c")'])
+
+    def test_apply_rulesets(self):
+        for threads, exec_mode in (1, 'path'), (4, 'path'), (4, 'dirfd'):
+            with self.subTest(threads=threads, exec_mode=exec_mode), tempfile.TemporaryDirectory() as tmp:
+                rulesets = []
+                for repo in 'r1', 'r2':
+                    os.makedirs(f'{tmp}/{repo}/all/a')
+                    for name in 'a.rpm', 'a-debuginfo.rpm':
+                        open(f'{tmp}/{repo}/all/a/{name}', 'w').close()
+                    rulesets.append({'mkdir': [],
+                                     'mv': [(f'{tmp}/{repo}/all/a/a-debuginfo.rpm',
+                                             f'{tmp}/{repo}/debug/a/a-debuginfo.rpm')],
+                                     'ln': [(f'{tmp}/{repo}/debug/a/a-debuginfo.rpm',
+                                             f'{tmp}/{repo}/os/a/a-debuginfo.rpm'),
+                                            (f'{tmp}/{repo}/all/a/a.rpm', f'{tmp}/{repo}/os/a/a.rpm')]})
+                e.apply_rulesets(iter(rulesets), threads, True, exec_mode)
+                for repo in 'r1', 'r2':
+                    self.assertEqual(sorted(os.listdir(f'{tmp}/{repo}/os/a')), ['a-debuginfo.rpm', 'a.rpm'])
+                    self.assertEqual(os.stat(f'{tmp}/{repo}/os/a/a-debuginfo.rpm').st_ino,
+                                     os.stat(f'{tmp}/{repo}/debug/a/a-debuginfo.rpm').st_ino)
+
+    def test_plan_dirs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'BaseOS/x86_64/os/Packages/a'))
+            cmds = {
+                'mkdir': [],
+                'mv': [(f'{tmp}/BaseOS/x86_64/all/Packages/b/b-debuginfo.rpm',
+                        f'{tmp}/BaseOS/x86_64/debug/Packages/b/b-debuginfo.rpm')],
+                'ln': [(f'{tmp}/BaseOS/x86_64/all/Packages/a/a.rpm', f'{tmp}/BaseOS/x86_64/os/Packages/a/a.rpm'),
+                       (f'{tmp}/BaseOS/x86_64/all/Packages/a/a2.rpm', f'{tmp}/BaseOS/x86_64/os/Packages/a/a2.rpm'),
+                       (f'{tmp}/BaseOS/x86_64/all/Packages/b/b.rpm', f'{tmp}/AppStream/x86_64/os/Packages/b.rpm'),
+                       (f'{tmp}/BaseOS/x86_64/all/Packages/b/b.rpm', f'{tmp}/AppStream/x86_64/os/Packages/b/b.rpm')]
+            }
+            for threads in 1, 4:
+                with self.subTest(threads=threads), patch('os.path.exists', wraps=os.path.exists) as exists_mock:
+                    self.assertEqual(e._plan_dirs(cmds, threads), [f'{tmp}/AppStream/x86_64/os/Packages/b',
+                                                                   f'{tmp}/BaseOS/x86_64/debug/Packages/b'])
+                    self.assertEqual(exists_mock.call_count, 3)
+            cmds['mkdir'] = e._plan_dirs(cmds)
+            mkdir_appstream, mkdir_debug, mv, ln_a, ln_b_parent, ln_b = e._plan_tasks(cmds)
+            self.assertEqual(mkdir_appstream.dependents, {ln_b_parent, ln_b})
+            self.assertEqual(mkdir_debug.dependents, {mv})
+            self.assertEqual(ln_a.pending, 0)
 
     @patch('os.rename')
     def test_apply_2arg_fun(self, mock_rename):
@@ -194,8 +332,3 @@ class TestExecution(unittest.TestCase):
         mock_stat.assert_has_calls([call('src1'), call('dst1')])
         mock_remove.assert_called_once_with('dst1')
         mock_link.assert_has_calls([call('src1', 'dst1'), call('src1', 'dst1')])
-
-    def test_prep_for_threads(self):
-        tuplelist = [('src1', 'dst1'), ('src2', 'dst2'), ('src3', 'dst3'), ('src4', 'dst4')]
-        ret = e._prep_for_threads(tuplelist, 2)
-        self.assertEqual(ret, [[('src1', 'dst1'), ('src2', 'dst2')], [('src3', 'dst3'), ('src4', 'dst4')]])
@@ -0,0 +1,115 @@
+import threading
+import unittest
+from unittest.mock import MagicMock
+
+import composer.executor as ex
+
+
+class TestExecutor(unittest.TestCase):
+
+    def test_executor_runs_all(self):
+        done = []
+        lock = threading.Lock()
+
+        def fun(batch):
+            with lock:
+                done.extend(batch)
+
+        pool = ex.OperationExecutor(3, queue_size=1)
+        batches = [[(f'src{i}', f'/d{i % 5}/dst{i}')] for i in range(50)]
+        for batch in batches:
+            pool.submit(fun, batch)
+        stats = pool.join()
+        self.assertEqual(sorted(done), sorted(b[0] for b in batches))
+        self.assertEqual(sum(s.operations for s in stats), 50)
+        self.assertEqual(len(stats), 3)
+
+    def test_executor_error(self):
+        fun = MagicMock(side_effect=[OSError('failed'), None])
+        pool = ex.OperationExecutor(1)
+        pool.submit(fun, [('src1', 'dst1'), ('src2', 'dst2')])
+        pool.submit(fun, [('src3', 'dst3')])
+        with self.assertRaises(OSError):
+            pool.join()
+        fun.assert_called_once_with([('src1', 'dst1'), ('src2', 'dst2')])
+
+    def test_executor_first_error(self):
+        started = threading.Barrier(2)
+        pool = ex.OperationExecutor(2)
+
+        def fail_first(batch):
+            started.wait()
+            raise OSError('first')
+
+        def fail_second(batch):
+            started.wait()
+            while pool.error is None:
+                pass
+            raise OSError('second')
+
+        pool.submit(fail_first, [('src1', 'dst1')])
+        pool.submit(fail_second, [('src2', 'dst2')])
+        with self.assertRaisesRegex(OSError, 'first'):
+            pool.join()
+
+    def test_executor_exit(self):
+        pool = ex.OperationExecutor(2)
+        pool.submit(MagicMock(side_effect=SystemExit(1)), [('src1', 'dst1')])
+        with self.assertRaises(SystemExit):
+            pool.join()
+
+    def test_executor_dependencies(self):
+        done = []
+        lock = threading.Lock()
+
+        def fun(batch):
+            with lock:
+                done.extend(batch)
+
+        first = ex.Task(fun, ['first'])
+        second = ex.Task(fun, ['second'])
+        third = ex.Task(fun, ['third'])
+        third.after(second)
+        second.after(first)
+        second.after(first)
+        self.assertEqual(second.pending, 1)
+        pool = ex.OperationExecutor(4)
+        for task in (third, second, first):
+            pool.submit_task(task)
+        pool.join()
+        self.assertEqual(done, ['first', 'second', 'third'])
+
+    def test_executor_error_dependencies(self):
+        fun = MagicMock(side_effect=OSError('failed'))
+        first = ex.Task(fun, [('src1', 'dst1')])
+        second = ex.Task(fun, [('src2', 'dst2')])
+        second.after(first)
+        pool = ex.OperationExecutor(2)
+        pool.submit_task(first)
+        pool.submit_task(second)
+        with self.assertRaises(OSError):
+            pool.join()
+        fun.assert_called_once_with([('src1', 'dst1')])
+
+    def test_executor_wait(self):
+        done = []
+        pool = ex.OperationExecutor(2)
+        for i in range(10):
+            pool.submit(done.extend, [i])
+        pool.wait()
+        self.assertEqual(sorted(done), list(range(10)))
+        pool.submit(done.extend, [10])
+        pool.join()
+        self.assertEqual(len(done), 11)
+
+    def test_prefetch(self):
+        self.assertEqual(list(ex.prefetch(range(100), depth=2)), list(range(100)))
+
+        def failing():
+            yield 1
+            raise OSError('failed')
+
+        items = ex.prefetch(failing())
+        self.assertEqual(next(items), 1)
+        with self.assertRaises(OSError):
+            next(items)
@@ -0,0 +1,41 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import composer.mapcache as mc
+
+
+class TestMapCache(unittest.TestCase):
+
+    def test_tree_cache(self):
+        tree = mc.TreeCache({'/repo/a': (10, ['b'], [('a.rpm', 1)])})
+        self.assertEqual(tree.lookup('/repo/a', 10), (['b'], [('a.rpm', 1)]))
+        self.assertIsNone(tree.lookup('/repo/a', 11))
+        self.assertIsNone(tree.lookup('/repo/c', 10))
+        tree.store('/repo/c', 10, 10 + mc.RACY_NS, [], [('c.rpm', 2)])  # modified right before listing
+        tree.store('/repo/d', 10, 11 + mc.RACY_NS, [], [('d.rpm', 3)])
+        self.assertEqual(tree.updated, {'/repo/a': (10, ['b'], [('a.rpm', 1)]), '/repo/d': (10, [], [('d.rpm', 3)])})
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'cache.json')
+            key = mc.MapCache.tree_key('/repo', '.*\\.rpm$', ['/os/', '/debug/'])
+            self.assertEqual(key, mc.MapCache.tree_key('/repo', '.*\\.rpm$', ['/debug/', '/os/']))
+            cache = mc.MapCache(filename)
+            cache.tree(key).store('/repo/a', 10, 11 + mc.RACY_NS, ['b'], [('a.rpm', 1)])
+            cache.tree('other').store('/other', 10, 11 + mc.RACY_NS, [], [])
+            cache.save()
+            self.assertEqual(mc.MapCache(filename).tree(key).lookup('/repo/a', 10), (['b'], [['a.rpm', 1]]))
+            rescan = mc.MapCache(filename, full_rescan=True)
+            self.assertIsNone(rescan.tree(key).lookup('/repo/a', 10))
+            rescan.save()
+            self.assertEqual(mc.MapCache(filename).trees, {key: {}, 'other': {'/other': [10, [], []]}})
+
+    def test_unreadable(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as cache_file:
+            cache_file.write('{"version": 1, ')
+            cache_file.flush()
+            with patch('logging.warning') as warning_mock:
+                self.assertEqual(mc.MapCache(cache_file.name).trees, {})
+            warning_mock.assert_called_once()
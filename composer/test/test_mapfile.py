@@ -0,0 +1,133 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import composer.execution as execution
+import composer.mapfile as mf
+from composer.repomap import RepoDir, RepoMap
+
+
+class TestMapFile(unittest.TestCase):
+
+    def setUp(self):
+        all_a = RepoDir('/minefield/eurolinux8', 'minefield/eurolinux8/',
+                        '/minefield/eurolinux8/BaseOS/x86_64/all/Packages/a', 'BaseOS', 'x86_64',
+                        'BaseOS/x86_64/all/Packages/a', 'Packages/a')
+        os_a = RepoDir('/minefield/eurolinux8', 'minefield/eurolinux8/',
+                       '/minefield/eurolinux8/BaseOS/x86_64/os/Packages/a', 'BaseOS', 'x86_64',
+                       'BaseOS/x86_64/os/Packages/a', 'Packages/a')
+        all_b = RepoDir('/minefield/eurolinux8', 'minefield/eurolinux8/',
+                        '/minefield/eurolinux8/AppStream/x86_64/all/Packages/b', 'AppStream', 'x86_64',
+                        'AppStream/x86_64/all/Packages/b', 'Packages/b')
+        # the same key in two directories - the later one replaces the earlier one
+        self.entries = [(all_a, [('aide-0.16-14.el8.x86_64.rpm', 11), ('acl-2.2.53-1.el8.x86_64.rpm', 12)]),
+                        (all_b, []),
+                        (os_a, [('aide-0.16-14.el8.x86_64.rpm', 13)]),
+                        (all_b, [('bash-4.4.20-4.el8.x86_64.rpm', 0)])]
+        self.mapped = mf.build_map(self.entries)
+
+    def test_build_map(self):
+        self.assertEqual(len(self.mapped), 3)
+        aide = self.mapped['BaseOS:x86_64:Packages/a:aide-0.16-14.el8.x86_64.rpm']
+        self.assertEqual(aide['elem_rel'], 'BaseOS/x86_64/os/Packages/a')
+        self.assertEqual(self.mapped.inode(aide.directory, aide.elem_name), 13)
+
+    def test_save_map_json(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'map.json')
+            for entries in self.entries, []:
+                with self.subTest(entries=len(entries)):
+                    self.assertEqual(mf.save_map(entries, path), len(mf.build_map(entries)))
+                    with open(path) as f:
+                        content = f.read()
+                    self.assertEqual(content, json.dumps(mf.build_map(entries).to_dict(), indent=2))
+                    self.assertEqual(mf.detect_format(path), 'json')
+                    self.assertEqual(mf.load_map(path).to_dict(), mf.build_map(entries).to_dict())
+            mf.save_map(self.entries[:2], path)
+            with open(path) as f:
+                self.assertEqual(f.read(), json.dumps(mf.build_map(self.entries[:2]).to_dict(), indent=2))
+
+    def test_save_map_colliding_keys(self):
+        # AppStream and AppStream-beta map to the same keys (include_beta) - the later file replaces the earlier one
+        stable, beta = (RepoDir('/r', 'r/', f'/r/{repo}/x86_64/os/Packages/a', 'AppStream', 'x86_64',
+                                f'{repo}/x86_64/os/Packages/a', 'Packages/a')
+                        for repo in ('AppStream', 'AppStream-beta'))
+        entries = [(stable, [('a-1.rpm', 1), ('a-2.rpm', 2)]), (beta, [('a-1.rpm', 3)])]
+        expected = mf.build_map(entries)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'map.json')
+            self.assertEqual(mf.save_map(entries, path), 2)
+            with open(path) as f:
+                self.assertEqual(f.read(), json.dumps(expected.to_dict(), indent=2))
+            scripts = []
+            for filename in path, os.path.join(tmp, 'map.ndjson'):
+                mf.save_map(entries, filename)
+                execution.create_local_repo_script(mf.iter_elems(filename), os.path.join(tmp, 'fake.sh'))
+                with open(os.path.join(tmp, 'fake.sh')) as f:
+                    scripts.append(f.read())
+            self.assertEqual(scripts[0], scripts[1])
+            self.assertIn('touch AppStream-beta/x86_64/os/Packages/a/a-1.rpm\n', scripts[0])
+            self.assertNotIn('touch AppStream/x86_64/os/Packages/a/a-1.rpm\n', scripts[0])
+
+    def test_save_map_ndjson(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'map.ndjson')
+            self.assertEqual(mf.save_map(self.entries, path), 4)
+            self.assertEqual(mf.detect_format(path), 'ndjson')
+            self.assertEqual([(d.path, files) for d, files in mf.iter_map(path)],
+                             [(d.path, files) for d, files in self.entries])
+            loaded = mf.load_map(path)
+            self.assertEqual(list(loaded.items()), list(self.mapped.items()))
+            aide = loaded['BaseOS:x86_64:Packages/a:aide-0.16-14.el8.x86_64.rpm']
+            self.assertEqual(loaded.inode(aide.directory, aide.elem_name), 13)
+            self.assertEqual([elem.elem_path for elem in mf.iter_elems(path)],
+                             [os.path.join(d.path, name) for d, files in self.entries for name, _ in files])
+            mf.save_map(self.entries, os.path.join(tmp, 'map.json'))
+            with self.assertRaises(ValueError):
+                list(mf.iter_map(os.path.join(tmp, 'map.json')))
+
+    def test_load_map_from_dict(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'map.json')
+            with open(path, 'w') as f:
+                json.dump(self.mapped.to_dict(), f, indent=2)
+            self.assertIsInstance(mf.load_map(path), RepoMap)
+            self.assertEqual(mf.load_map(path), self.mapped)
+            self.assertEqual(list(mf.iter_elems(path)), list(self.mapped.values()))
+
+    def test_save_map_index(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'map.idx')
+            self.assertEqual(mf.save_map(self.entries, path), 3)
+            self.assertEqual(mf.detect_format(path), 'index')
+            self.assertEqual(mf.load_map(path), self.mapped)
+            loaded = mf.load_map(path)
+            aide = loaded['BaseOS:x86_64:Packages/a:aide-0.16-14.el8.x86_64.rpm']
+            self.assertEqual(loaded.inode(aide.directory, aide.elem_name), 13)
+            index = mf.open_map(path)
+            self.assertIsInstance(index, mf.mapindex.MapIndex)
+            self.assertEqual(index, self.mapped)
+            index.close()
+            self.assertEqual(sorted(elem.elem_path for elem in mf.iter_elems(path)),
+                             sorted(elem.elem_path for elem in self.mapped.values()))
+
+    def test_read_stamp(self):
+        stamp = {'target': '/minefield/eurolinux8', 'settings': {'mask': '.*\\.rpm$'},
+                 'mtimes': {'': 1, '/BaseOS/x86_64/all/Packages/a': 2, '/\udcff': 3}}
+        with tempfile.TemporaryDirectory() as tmp:
+            for filename, map_format in ('map.json', 'json'), ('map.ndjson', 'ndjson'), ('map.idx', 'index'):
+                with self.subTest(map_format=map_format):
+                    path = os.path.join(tmp, filename)
+                    mf.save_map(self.entries, path, stamp=stamp)
+                    self.assertEqual(mf.read_stamp(path), None if map_format == 'json' else stamp)
+                    self.assertEqual(mf.load_map(path).to_dict(), self.mapped.to_dict())
+                    mf.save_map(self.entries, path)
+                    self.assertIsNone(mf.read_stamp(path))
+            path = os.path.join(tmp, 'empty.ndjson')
+            mf.save_map([], path)
+            self.assertIsNone(mf.read_stamp(path))
+            with patch('composer.mapfile._TAIL_BLOCK', 7):
+                mf.save_map([], path, stamp=stamp)
+                self.assertEqual(mf.read_stamp(path), stamp)
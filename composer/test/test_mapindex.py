@@ -0,0 +1,75 @@
+import os
+import tempfile
+import unittest
+
+import composer.mapindex as mi
+from composer.repomap import RepoDir, RepoElem, RepoMap
+
+
+class TestMapIndex(unittest.TestCase):
+
+    def setUp(self):
+        all_a = RepoDir('/minefield/eurolinux8', 'minefield/eurolinux8/',
+                        '/minefield/eurolinux8/BaseOS/x86_64/all/Packages/a', 'BaseOS', 'x86_64',
+                        'BaseOS/x86_64/all/Packages/a', 'Packages/a')
+        all_b = RepoDir('/minefield/eurolinux8', 'minefield/eurolinux8/',
+                        '/minefield/eurolinux8/AppStream/x86_64/all/Packages/b', 'AppStream', 'x86_64',
+                        'AppStream/x86_64/all/Packages/b', 'Packages/b')
+        self.mapped = RepoMap()
+        self.mapped.add(all_a, 'aide-0.16-14.el8.x86_64.rpm', 11)
+        self.mapped.add(all_b, 'bash-4.4.20-4.el8.x86_64.rpm')
+        self.mapped.add(all_a, 'acl-2.2.53-1.el8.x86_64.rpm', 12)
+        self.mapped.add(all_a, 'zsh-\udcff.rpm', 13)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'map.idx')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_index(self):
+        mi.save_index(self.mapped, self.path)
+        self.assertTrue(mi.is_index(self.path))
+        with mi.MapIndex(self.path) as index:
+            self.assertEqual(len(index), 4)
+            self.assertEqual(list(index), list(self.mapped))
+            self.assertEqual(dict(index.items()), dict(self.mapped.items()))
+            self.assertEqual(index, self.mapped)
+            self.assertNotIn('BaseOS:x86_64:Packages/a:aide', index)
+            self.assertNotIn(1, index)
+            self.assertIsNone(index.get('AppStream:x86_64:Packages/b:zsh.rpm'))
+            with self.assertRaises(KeyError):
+                index['0']
+            aide = index['BaseOS:x86_64:Packages/a:aide-0.16-14.el8.x86_64.rpm']
+            self.assertEqual(aide['elem_path'], '/minefield/eurolinux8/BaseOS/x86_64/all/Packages/a/'
+                                                'aide-0.16-14.el8.x86_64.rpm')
+            self.assertEqual(index.inode(aide.directory, aide.elem_name), 11)
+            bash = index['AppStream:x86_64:Packages/b:bash-4.4.20-4.el8.x86_64.rpm']
+            self.assertIsNone(index.inode(bash.directory, bash.elem_name))
+            self.assertEqual({d.path for d in index.directories()}, {d.path for d in self.mapped.directories()})
+
+    def test_index_custom_key(self):
+        mapped = RepoMap.from_dict({'aide': self.mapped['BaseOS:x86_64:Packages/a:aide-0.16-14.el8.x86_64.rpm']
+                                    .to_dict()})
+        mi.save_index(mapped, self.path)
+        with mi.MapIndex(self.path) as index:
+            self.assertEqual(list(index), ['aide'])
+            self.assertIsInstance(index['aide'], RepoElem)
+            self.assertEqual(index['aide']['elem_name'], 'aide-0.16-14.el8.x86_64.rpm')
+            self.assertIsNone(index.inode(index['aide'].directory, 'aide-0.16-14.el8.x86_64.rpm'))
+
+    def test_index_empty(self):
+        mi.save_index(RepoMap(), self.path)
+        with mi.MapIndex(self.path) as index:
+            self.assertEqual(len(index), 0)
+            self.assertNotIn('aide', index)
+
+    def test_index_invalid(self):
+        mi.save_index(self.mapped, self.path)
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        for invalid in b'{"aide": {}}', data[:-1], data + b'\0':
+            with self.subTest(invalid=invalid[:16]):
+                with open(self.path, 'wb') as f:
+                    f.write(invalid)
+                with self.assertRaises(ValueError):
+                    mi.MapIndex(self.path)
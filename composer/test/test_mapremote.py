@@ -1,7 +1,23 @@
+import argparse
+import bz2
+import email.message
+import functools
+import gzip
+import http.server
+import lzma
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import threading
 import unittest
+import urllib.error
 from unittest.mock import call, mock_open, patch
 
 import composer.mapremote as mr
+import composer.maptarget as mt
+import composer.remotecache as rc
 
 
 # Namespace(action='direct',
@@ -61,3 +77,233 @@ class TestMapRemote(unittest.TestCase):
             call('mkdir -p aarch64/\n'),
             call('touch aarch64/AppStream/Packages/a/abrt-2.10.9-21.el8.aarch64.rpm\n')
             ])
+
+    def _serve(self, directory, requests=None):
+        class Handler(http.server.SimpleHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive
+            etag = None
+
+            def send_head(self):
+                # directory listings with an ETag (their mtime), honouring If-None-Match
+                path = self.translate_path(self.path)
+                if os.path.isdir(path) and self.path.endswith('/'):
+                    self.etag = f'"{os.stat(path).st_mtime_ns}"'
+                    if self.headers.get('If-None-Match') == self.etag:
+                        self.send_response(304)
+                        self.end_headers()
+                        return None
+                return super().send_head()
+
+            def end_headers(self):
+                if self.etag:
+                    self.send_header('ETag', self.etag)
+                super().end_headers()
+
+            def log_request(self, code='-', size='-'):
+                if requests is not None:
+                    requests.append((self.path, int(code)))
+
+            def log_message(self, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(Handler, directory=directory))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_address[1]}/'
+
+    def test_create_mapped_repo(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for path in ['BaseOS/x86_64/Packages/a/a-1.rpm', 'BaseOS/x86_64/Packages/a/a-2.rpm',
+                         'BaseOS/x86_64/Packages/b/b-1.rpm', 'AppStream/x86_64/Packages/a/a-3.rpm', 'README']:
+                os.makedirs(os.path.dirname(os.path.join(tmp, 'repo', path)), exist_ok=True)
+                open(os.path.join(tmp, 'repo', path), 'w').close()
+            url = self._serve(tmp)
+            scripts = []
+            for threads in 1, 4:
+                with self.subTest(threads=threads):
+                    connections = mr.ConnectionPool()
+                    repo = mr._create_mapped_repo(url + 'repo', threads, connections.fetch)
+                    scripts.append(mr._debug_recreate_repo_tree(repo, [], []))
+                    self.assertLessEqual(connections.opened, threads)
+            self.assertEqual(scripts[0], scripts[1])
+            self.assertEqual(scripts[0], (['mkdir -p AppStream/x86_64/Packages/a/',
+                                           'mkdir -p AppStream/x86_64/Packages/',
+                                           'mkdir -p AppStream/x86_64/', 'mkdir -p AppStream/',
+                                           'mkdir -p BaseOS/x86_64/Packages/a/', 'mkdir -p BaseOS/x86_64/Packages/b/',
+                                           'mkdir -p BaseOS/x86_64/Packages/', 'mkdir -p BaseOS/x86_64/',
+                                           'mkdir -p BaseOS/'],
+                                          ['touch AppStream/x86_64/Packages/a/a-3.rpm',
+                                           'touch BaseOS/x86_64/Packages/a/a-1.rpm',
+                                           'touch BaseOS/x86_64/Packages/a/a-2.rpm',
+                                           'touch BaseOS/x86_64/Packages/b/b-1.rpm', 'touch README']))
+            self.assertIsNone(mr._create_mapped_repo(url + 'missing/'))
+
+    def test_create_mapped_repo_errors(self):
+        listings = {'http://repo/': b'<a href="../">../</a><a href="a/">a/</a><a href="b/">b/</a>',
+                    'http://repo/b/': b'<a href="b.rpm">b.rpm</a>'}
+
+        def fetch(url, headers):
+            if url not in listings:
+                raise urllib.error.HTTPError(url, 404, 'Not Found', None, None)
+            return email.message.Message(), [listings[url]]
+
+        repo = mr._create_mapped_repo('http://repo/', 2, fetch)
+        self.assertEqual(list(repo.parent_to), ['a/', 'b/'])
+        self.assertIsNone(repo.parent_to['a/'])
+        self.assertEqual(list(repo.parent_to['b/'].parent_to), ['b.rpm'])
+        self.assertEqual(mr._debug_recreate_repo_tree(repo, [], []), (['mkdir -p b/'], ['touch b/b.rpm']))
+
+    def test_iter_links(self):
+        page = (b'<html><head><title>Index of /r/</title></head><body><h1>Index of /r/</h1><hr><pre>'
+                b'<a href="../">../</a>\n<A HREF="Packages/">Packages/</A>  01-Jan-2024 00:00  -\n'
+                b'<a name="top"></a><a href="">empty</a><a href="a&amp;b-1.0.rpm">a&amp;b-1.0.rpm</a>\n'
+                b'<a href="caf\xc3\xa9.rpm" title="x">caf\xc3\xa9.rpm</a><a href=repodata/ />\n'
+                b'<!-- <a href="commented.rpm"></a> --></pre><hr></body></html>')
+        expected = ['../', 'Packages/', 'a&b-1.0.rpm', 'caf\xe9.rpm', 'repodata/']
+        for size in 1, 7, len(page):
+            with self.subTest(size=size):
+                chunks = [page[i:i + size] for i in range(0, len(page), size)]
+                self.assertEqual(list(mr.iter_links(chunks)), expected)
+        self.assertEqual(list(mr.iter_links_bs4([page])), expected)
+
+    def test_bs4_not_imported(self):
+        code = 'import sys, composer.app; print("bs4" in sys.modules)'
+        output = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+        self.assertEqual(output.stdout.strip(), 'False')
+
+    def test_create_mapped_repo_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for path in ['BaseOS/x86_64/Packages/a/a-1.rpm', 'BaseOS/x86_64/Packages/b/b-1.rpm', 'README']:
+                os.makedirs(os.path.dirname(os.path.join(tmp, 'repo', path)), exist_ok=True)
+                open(os.path.join(tmp, 'repo', path), 'w').close()
+            requests = []
+            url = self._serve(tmp, requests) + 'repo/'
+            cache_file = os.path.join(tmp, 'listings.json')
+
+            def crawl(**kwargs):
+                requests.clear()
+                cache = rc.ListingCache(cache_file, **kwargs)
+                repo = mr._create_mapped_repo(url, 4, cache=cache)
+                cache.save()
+                return mr._debug_recreate_repo_tree(repo, [], [])[1], sorted(code for _, code in requests)
+
+            self.assertEqual(crawl(), (['touch BaseOS/x86_64/Packages/a/a-1.rpm',
+                                        'touch BaseOS/x86_64/Packages/b/b-1.rpm', 'touch README'], [200] * 6))
+            touches, codes = crawl()
+            self.assertEqual(len(touches), 3)
+            self.assertEqual(codes, [304] * 6)
+            open(os.path.join(tmp, 'repo/BaseOS/x86_64/Packages/a/a-2.rpm'), 'w').close()
+            touches, codes = crawl()
+            self.assertIn('touch BaseOS/x86_64/Packages/a/a-2.rpm', touches)
+            self.assertEqual(codes, [200] + [304] * 5)
+            open(os.path.join(tmp, 'repo/BaseOS/x86_64/Packages/b/b-2.rpm'), 'w').close()
+            touches, codes = crawl(skip_unchanged=True)  # root is unchanged, so is (supposedly) all the tree
+            self.assertEqual((len(touches), codes), (4, [304]))
+            touches, codes = crawl(full_rescan=True)
+            self.assertEqual((len(touches), codes), (5, [200] * 6))
+
+    def _write_repodata(self, directory, packages, compression):
+        primary = ['<?xml version="1.0" encoding="UTF-8"?>\n<metadata xmlns="http://linux.duke.edu/metadata/common" '
+                   f'xmlns:rpm="http://linux.duke.edu/metadata/rpm" packages="{len(packages)}">']
+        for path in packages:
+            primary.append(f'<package type="rpm"><name>{os.path.basename(path)}</name><arch>x86_64</arch>'
+                           f'<location href="{path}"/><format><rpm:license>MIT</rpm:license></format></package>')
+        primary.append('</metadata>')
+        compress = {'.gz': gzip.compress, '.xz': lzma.compress, '.bz2': bz2.compress, '': bytes}[compression]
+        os.makedirs(os.path.join(directory, 'repodata'), exist_ok=True)
+        for name, content in [(f'repodata/0123-primary.xml{compression}', compress('\n'.join(primary).encode())),
+                              ('repodata/0123-filelists.xml.gz', gzip.compress(b'<filelists/>')),
+                              ('repodata/repomd.xml',
+                               b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                               b'<repomd xmlns="http://linux.duke.edu/metadata/repo"><revision>1</revision>'
+                               b'<data type="primary"><location href="repodata/0123-primary.xml' +
+                               compression.encode() + b'"/></data><data type="filelists">'
+                               b'<location href="repodata/0123-filelists.xml.gz"/></data></repomd>')]:
+            with open(os.path.join(directory, name), 'wb') as f:
+                f.write(content)
+        for path in packages:
+            os.makedirs(os.path.dirname(os.path.join(directory, path)), exist_ok=True)
+            open(os.path.join(directory, path), 'w').close()
+
+    def test_create_mapped_repo_repodata(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for repo, compression in ('baseos', '.gz'), ('appstream', '.xz'), ('powertools', '.bz2'), ('ha', ''):
+                self._write_repodata(os.path.join(tmp, 'repo', repo, 'x86_64'), [
+                    f'packages/a/a-{repo}-1.rpm', f'packages/a/a-{repo}-2.rpm', f'packages/b/b-{repo}-1.rpm'],
+                    compression)
+            os.makedirs(os.path.join(tmp, 'repo/baseos/x86_64/images'))
+            open(os.path.join(tmp, 'repo/baseos/x86_64/images/boot.iso'), 'w').close()
+            open(os.path.join(tmp, 'repo/readme'), 'w').close()
+            open(os.path.join(tmp, 'repo/readme $(id).txt'), 'w').close()
+            requests = []
+            url = self._serve(tmp, requests) + 'repo/'
+            crawled = mr._debug_recreate_repo_tree(mr._create_mapped_repo(url, 4), [], [])
+            self.assertEqual(len(requests), 26)
+            self.assertIn('touch baseos/x86_64/images/boot.iso', crawled[1])
+            self.assertIn('touch readme%20%24%28id%29.txt', crawled[1])  # quoted as a link, safe in the script
+            for target in url, pathlib.Path(tmp, 'repo').as_uri():
+                with self.subTest(target=target):
+                    requests.clear()
+                    repo = mr._create_mapped_repo(target, 4, repodata=True)
+                    self.assertEqual(mr._debug_recreate_repo_tree(repo, [], []), crawled)
+                    # root, repositories and their arch dirs listed, repomd.xml and primary.xml read, images/ listed
+                    self.assertEqual(len(requests), 18 if target == url else 0)
+
+    def test_create_mapped_repo_repodata_errors(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self._write_repodata(os.path.join(tmp, 'a'), ['packages/a-1.rpm'], '.gz')
+            open(os.path.join(tmp, 'a/packages/stray.rpm'), 'w').close()
+            self._write_repodata(os.path.join(tmp, 'b'), ['packages/b-1.rpm'], '.gz')
+            with open(os.path.join(tmp, 'b/repodata/0123-primary.xml.gz'), 'wb') as f:
+                f.write(b'corrupted')
+            self._write_repodata(os.path.join(tmp, 'c'), ['packages/c-1.rpm'], '.gz')
+            os.rename(os.path.join(tmp, 'c/repodata/0123-primary.xml.gz'), os.path.join(tmp, 'c/repodata/primary.zst'))
+            with open(os.path.join(tmp, 'c/repodata/repomd.xml'), 'r+b') as f:
+                repomd = f.read().replace(b'0123-primary.xml.gz', b'primary.zst')
+                f.seek(0)
+                f.write(repomd)
+            with patch('logging.warning') as warning_mock:
+                repo = mr._create_mapped_repo(pathlib.Path(tmp).as_uri(), 2, repodata=True)
+            self.assertEqual(warning_mock.call_count, 2)
+            touches = mr._debug_recreate_repo_tree(repo, [], [])[1]
+            # unreadable metadata - the repositories are listed instead
+            self.assertIn('touch b/packages/b-1.rpm', touches)
+            self.assertIn('touch c/packages/c-1.rpm', touches)
+            self.assertIn('touch c/repodata/primary.zst', touches)
+            self.assertIn('touch a/packages/a-1.rpm', touches)
+            self.assertNotIn('touch a/packages/stray.rpm', touches)  # not in the metadata
+
+    def test_map_remote(self):
+        args = argparse.Namespace(mask=r'.*\.rpm$', skip_dirs=['/debug/', '/x86_64/os/'], archs=['x86_64', 'noarch'],
+                                  repo_priority=['BaseOS', 'AppStream'], include_beta=False, include_extra=False,
+                                  threads=1)
+        with tempfile.TemporaryDirectory() as tmp:
+            self._write_repodata(os.path.join(tmp, 'repo/x86_64/BaseOS'), [
+                'Packages/a/a-1.x86_64.rpm', 'Packages/l/libstdc++-1.x86_64.rpm', 'Packages/n/n-1.noarch.rpm'], '.gz')
+            self._write_repodata(os.path.join(tmp, 'repo/x86_64/AppStream'),
+                                 ['Packages/b/b-1.x86_64.rpm', 'Packages/b/b 2-1.x86_64.rpm'], '.xz')
+            for path in ['x86_64/BaseOS/debug/Packages/a-debuginfo-1.x86_64.rpm', 'x86_64/os/Packages/o-1.x86_64.rpm',
+                         'x86_64/BaseOS/Packages/README', 'x86_64/HighAvailability/Packages/h-1.x86_64.rpm']:
+                os.makedirs(os.path.dirname(os.path.join(tmp, 'repo', path)), exist_ok=True)
+                open(os.path.join(tmp, 'repo', path), 'w').close()
+            expected = {key: (elem.elem_repo, elem.elem_arch, elem.elem_pkg, elem.elem_name)
+                        for key, elem in mt.map_target(os.path.join(tmp, 'repo'), args).items()}
+            self.assertEqual(len(expected), 5)
+            self.assertIn('BaseOS:x86_64:Packages/l:libstdc++-1.x86_64.rpm', expected)
+            self.assertIn('AppStream:x86_64:Packages/b:b 2-1.x86_64.rpm', expected)
+            requests = []
+            url = self._serve(tmp, requests) + 'repo/'
+            for target in url, pathlib.Path(tmp, 'repo').as_uri():
+                for repodata in False, True:
+                    with self.subTest(target=target, repodata=repodata):
+                        requests.clear()
+                        args.repodata = repodata
+                        mapped = mr.map_remote(target, args)
+                        self.assertEqual({key: (elem.elem_repo, elem.elem_arch, elem.elem_pkg, elem.elem_name)
+                                          for key, elem in mapped.items()}, expected)
+                        self.assertEqual(mapped['BaseOS:x86_64:Packages/a:a-1.x86_64.rpm'].elem_path,
+                                         target.rstrip('/') + '/x86_64/BaseOS/Packages/a/a-1.x86_64.rpm')
+                        self.assertFalse([path for path, _ in requests if '/debug/' in path or '/os/' in path])
+            self.assertEqual(len(mr.map_remote(url + 'missing/', args)), 0)
@@ -1,8 +1,11 @@
 import argparse
+import os
+import tempfile
 import unittest
 from unittest.mock import patch
 
 import composer.maptarget as mt
+from composer.repomap import RepoMap
 
 
 # Namespace(action='direct',
@@ -59,63 +62,208 @@ class TestMapTarget(unittest.TestCase):
                                                                      archs=["x86_64", "aarch64"]))
             self.assertEqual(mapped, {})
 
-    def _abspath_side_effect_func(self, value):
-        """ adjust for abspath-like behavior """
-        if value[0] != '/':
-            value = '/' + value
-        if value[-1] == '/':
-            value = value[:-1]
-        return value
-
-    @patch('os.path.exists')
-    @patch('os.path.abspath')
-    def test_map_target_ok(self, abspath, exists):
-
-        abspath.side_effect = self._abspath_side_effect_func
-        expected = \
-            {
-             'AppStream:x86_64:Packages/a:autoconf-2.69-27.el8.noarch.rpm':
-             {'elem_name': 'autoconf-2.69-27.el8.noarch.rpm',
-              'elem_abs': '/minefield/eurolinux8',
-              'elem_path': '/minefield/eurolinux8/' +
-                           'AppStream/x86_64/all/Packages/a/autoconf-2.69-27.el8.noarch.rpm',
-              'elem_arch': 'x86_64',
-              'elem_repo': 'AppStream',
-              'elem_base': 'minefield/eurolinux8/',
-              'elem_rel': 'AppStream/x86_64/all/Packages/a',
-              'elem_pkg': 'Packages/a'},
-             'AppStream:x86_64:Packages/a:autoconf-2.69-29.el8.noarch.rpm':
-             {'elem_name': 'autoconf-2.69-29.el8.noarch.rpm',
-              'elem_abs': '/minefield/eurolinux8',
-              'elem_path': '/minefield/eurolinux8/' +
-                           'AppStream/x86_64/all/Packages/a/autoconf-2.69-29.el8.noarch.rpm',
-              'elem_arch': 'x86_64',
-              'elem_repo': 'AppStream',
-              'elem_base': 'minefield/eurolinux8/',
-              'elem_rel': 'AppStream/x86_64/all/Packages/a',
-              'elem_pkg': 'Packages/a'},
-            }
-        with patch('os.walk') as mockwalk:
-            mockwalk.return_value = [
-                    ('/minefield/eurolinux8', ['AppStream', 'PowerTools'], []),
-                    ('/minefield/eurolinux8/AppStream', ['aarch64', 'i686', 'x86_64'], []),
-                    ('/minefield/eurolinux8/AppStream/x86_64', ['all', 'os'], []),
-                    ('/minefield/eurolinux8/AppStream/x86_64/all', ['Packages'], []),
-                    ('/minefield/eurolinux8/AppStream/x86_64/all/Packages', ['a'], []),
-                    ('/minefield/eurolinux8/AppStream/x86_64/all/Packages/a', [],
-                     ['autoconf-2.69-27.el8.noarch.rpm', 'autoconf-2.69-29.el8.noarch.rpm']),
-                    ('/minefield/eurolinux8/AppStream/x86_64', ['all', 'os'], []),
-                    ('/minefield/eurolinux8/AppStream/x86_64/os', ['Packages'], []),
-                    ('/minefield/eurolinux8/AppStream/x86_64/os/Packages', ['a'], []),
-                    ('/minefield/eurolinux8/AppStream/x86_64/os/Packages/a', [],
-                     ['autoconf-2.69-27.el8.noarch.rpm', 'autoconf-2.69-29.el8.noarch.rpm'])
-                    ]
-            mapped = mt.map_target('minefield/eurolinux8/',
-                                   argparse.Namespace(action='maptarget',
-                                                      repo_priority=['BaseOS', 'AppStream',
-                                                                     'PowerTools', 'HighAvailability',
-                                                                     'ResilientStorage', 'CodeReady'],
-                                                      archs=['x86_64', 'i686', 'aarch64', 'noarch'],
-                                                      skip_dirs=['/debug/', '/os/'], mask='.*\\.rpm$',
-                                                      include_beta=False, include_extra=False))
+    def _create_tree(self, base, files):
+        for path in files:
+            os.makedirs(os.path.join(base, os.path.dirname(path)), exist_ok=True)
+            open(os.path.join(base, path), 'w').close()
+
+    def _mapping_args(self, **kwargs):
+        args = argparse.Namespace(action='maptarget',
+                                  repo_priority=['BaseOS', 'AppStream', 'PowerTools', 'HighAvailability',
+                                                 'ResilientStorage', 'CodeReady'],
+                                  archs=['x86_64', 'i686', 'aarch64', 'noarch'],
+                                  skip_dirs=['/debug/', '/os/'], mask='.*\\.rpm$',
+                                  include_beta=False, include_extra=False)
+        for k, v in kwargs.items():
+            setattr(args, k, v)
+        return args
+
+    def test_map_target_ok(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            appstream = 'minefield/eurolinux8/AppStream/'
+            self._create_tree(tmp, [appstream + 'x86_64/all/Packages/a/autoconf-2.69-27.el8.noarch.rpm',
+                                    appstream + 'x86_64/all/Packages/a/autoconf-2.69-29.el8.noarch.rpm',
+                                    appstream + 'x86_64/os/Packages/a/autoconf-2.69-27.el8.noarch.rpm',
+                                    appstream + 'x86_64/os/Packages/a/autoconf-2.69-29.el8.noarch.rpm',
+                                    appstream + 'aarch64/all/Packages/repodata.xml',
+                                    'minefield/eurolinux8/PowerTools/all/Packages/n/ninja-1.8.2-1.el8.x86_64.rpm'])
+            target = os.path.join(tmp, 'minefield/eurolinux8/')
+            abs_path = os.path.join(tmp, 'minefield/eurolinux8')
+            expected = \
+                {
+                 'AppStream:x86_64:Packages/a:autoconf-2.69-27.el8.noarch.rpm':
+                 {'elem_name': 'autoconf-2.69-27.el8.noarch.rpm',
+                  'elem_abs': abs_path,
+                  'elem_path': abs_path + '/AppStream/x86_64/all/Packages/a/autoconf-2.69-27.el8.noarch.rpm',
+                  'elem_arch': 'x86_64',
+                  'elem_repo': 'AppStream',
+                  'elem_base': target,
+                  'elem_rel': 'AppStream/x86_64/all/Packages/a',
+                  'elem_pkg': 'Packages/a'},
+                 'AppStream:x86_64:Packages/a:autoconf-2.69-29.el8.noarch.rpm':
+                 {'elem_name': 'autoconf-2.69-29.el8.noarch.rpm',
+                  'elem_abs': abs_path,
+                  'elem_path': abs_path + '/AppStream/x86_64/all/Packages/a/autoconf-2.69-29.el8.noarch.rpm',
+                  'elem_arch': 'x86_64',
+                  'elem_repo': 'AppStream',
+                  'elem_base': target,
+                  'elem_rel': 'AppStream/x86_64/all/Packages/a',
+                  'elem_pkg': 'Packages/a'},
+                }
+            mapped = mt.map_target(target, self._mapping_args())
             self.assertEqual(mapped, expected)
+
+    def test_map_targets_threads(self):
+        files = [f'{repo}{beta}/{arch}/all/Packages/{c}/{c}pkg-{i}.el8.{arch}.rpm'
+                 for repo in ['BaseOS', 'AppStream'] for beta in ['', '-beta'] for arch in ['x86_64', 'aarch64']
+                 for c in 'ab' for i in range(3)]
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(os.path.join(tmp, 'src'), files)
+            self._create_tree(os.path.join(tmp, 'dst'), files[::2])
+            targets = [os.path.join(tmp, 'src/'), os.path.join(tmp, 'dst/')]
+            single = mt.map_targets(targets, self._mapping_args(include_beta=True, threads=1))
+            threaded = mt.map_targets(targets, self._mapping_args(include_beta=True, threads=4))
+        self.assertEqual(len(single[0]), 24)
+        self.assertEqual(len(single[1]), 12)
+        self.assertEqual(single, threaded)
+        self.assertEqual([list(m.items()) for m in single], [list(m.items()) for m in threaded])
+
+    def test_iter_target(self):
+        files = [f'{repo}/{arch}/all/Packages/{c}/{c}pkg-{i}.el8.{arch}.rpm'
+                 for repo in ['BaseOS', 'AppStream'] for arch in ['x86_64', 'aarch64'] for c in 'ab' for i in range(3)]
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(tmp, files + ['BaseOS/x86_64/all/Packages/a/README', 'BaseOS/README.rpm'])
+            for threads in 1, 4:
+                with self.subTest(threads=threads):
+                    args = self._mapping_args(threads=threads)
+                    entries = list(mt.iter_target(tmp + '/', args))
+                    self.assertEqual(len(entries), 8)
+                    self.assertTrue(all(len(dir_files) == 3 for _, dir_files in entries))
+                    mapped = RepoMap()
+                    for directory, dir_files in entries:
+                        for name, inode in dir_files:
+                            mapped.add(directory, name, inode)
+                    expected = mt.map_target(tmp + '/', args)
+                    self.assertEqual(list(mapped.items()), list(expected.items()))
+            self.assertEqual(list(mt.iter_target(os.path.join(tmp, 'missing'), self._mapping_args())), [])
+
+    def test_map_targets_classifiers(self):
+        class Names(mt.Classifier):
+            def classify(self, directory, names):
+                return [f'{directory.elem_rel}/{name}' for name in names]
+
+        files = [f'{repo}/{arch}/all/Packages/{c}/{c}pkg-{i}.el8.{arch}.rpm'
+                 for repo in ['BaseOS', 'AppStream'] for arch in ['x86_64', 'aarch64'] for c in 'ab' for i in range(3)]
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(tmp, files + ['BaseOS/x86_64/all/Packages/a/README'])
+            for threads in 1, 4:
+                with self.subTest(threads=threads):
+                    classifiers = [Names(), Names()]
+                    mapped, = mt.map_targets([tmp + '/'], self._mapping_args(threads=threads), [classifiers])
+                    expected = [elem['elem_path'][len(tmp) + 1:] for elem in mapped.values()]
+                    self.assertEqual(classifiers[0].results, expected)
+                    self.assertEqual(classifiers[1].results, expected)
+
+        class Unfinished(mt.Classifier):
+            pass
+
+        with self.assertRaises(TypeError):
+            Unfinished()
+
+    def test_map_targets_args(self):
+        files = [f'BaseOS{beta}/{arch}/all/Packages/a/apkg{beta}-{i}.el8.{arch}.rpm'
+                 for beta in ['', '-beta'] for arch in ['x86_64', 'aarch64'] for i in range(3)]
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(tmp, files)
+            args, beta_args = self._mapping_args(threads=4), self._mapping_args(include_beta=True, archs=['x86_64'])
+            plain, beta = mt.map_targets([tmp + '/', tmp + '/'], args, targets_args=[args, beta_args])
+            self.assertEqual(plain, mt.map_target(tmp + '/', args))
+            self.assertEqual(beta, mt.map_target(tmp + '/', beta_args))
+            self.assertEqual((len(plain), len(beta)), (6, 6))
+            self.assertEqual(mt.tree_key(tmp, args), mt.tree_key(tmp + '/', self._mapping_args()))
+            self.assertNotEqual(mt.tree_key(tmp, args), mt.tree_key(tmp, beta_args))
+
+    @patch('composer.mapcache.RACY_NS', -10 ** 9)
+    def test_stamp(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(tmp, ['BaseOS/x86_64/all/Packages/a/aide-0.16-14.el8.x86_64.rpm',
+                                    'BaseOS/x86_64/os/Packages/a/aide-0.16-14.el8.x86_64.rpm'])
+            args = self._mapping_args()
+            stamp = mt.create_stamp(tmp + '/', args)
+            self.assertEqual(len([entry for entry in mt.iter_target(tmp + '/', args, stamp)]), 1)
+            self.assertEqual(stamp['target'], tmp)
+            self.assertEqual(sorted(stamp['mtimes']), ['', '/BaseOS', '/BaseOS/x86_64', '/BaseOS/x86_64/all',
+                                                       '/BaseOS/x86_64/all/Packages',
+                                                       '/BaseOS/x86_64/all/Packages/a'])
+            self.assertIsNone(mt.check_stamp(stamp, args))
+            self.assertIsNotNone(mt.check_stamp(stamp, self._mapping_args(archs=['x86_64'])))
+            self._create_tree(tmp, ['BaseOS/x86_64/os/Packages/a/acl-2.2.53-1.el8.x86_64.rpm'])
+            self.assertIsNone(mt.check_stamp(stamp, args))  # skipped directories are not checked
+            self._create_tree(tmp, ['BaseOS/x86_64/all/Packages/a/acl-2.2.53-1.el8.x86_64.rpm'])
+            self.assertRegex(mt.check_stamp(stamp, args), 'Packages/a has been modified')
+            stamp = mt.create_stamp(tmp + '/', args)
+            list(mt.iter_target(tmp + '/', args, stamp))
+            self.assertIsNone(mt.check_stamp(stamp, args))
+            os.rename(os.path.join(tmp, 'BaseOS/x86_64/all'), os.path.join(tmp, 'BaseOS/x86_64/old'))
+            self.assertRegex(mt.check_stamp(stamp, args), 'missing|modified')
+
+    def test_stamp_racy(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(tmp, ['BaseOS/x86_64/all/Packages/a/aide-0.16-14.el8.x86_64.rpm'])
+            args = self._mapping_args()
+            stamp = mt.create_stamp(tmp, args)
+            list(mt.iter_target(tmp, args, stamp))
+            self.assertEqual(set(stamp['mtimes'].values()), {-1})  # just created
+            self.assertIsNotNone(mt.check_stamp(stamp, args))
+
+    def test_map_target_prunes_skipped_dirs(self):
+        files = [f'BaseOS/x86_64/{sub}/Packages/a/aide-{sub}-0.16-14.el8.x86_64.rpm'
+                 for sub in ['all', 'os', 'debug', 'kickstart/os']]
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(tmp, files)
+            with patch('os.scandir', side_effect=os.scandir) as scandir_mock:
+                mapped = mt.map_target(tmp + '/', self._mapping_args(skip_dirs=['/debug/', '/kickstart/os/']))
+            listed = [c.args[0][len(tmp):] for c in scandir_mock.call_args_list]
+        self.assertEqual(sorted(mapped), ['BaseOS:x86_64:Packages/a:aide-all-0.16-14.el8.x86_64.rpm',
+                                          'BaseOS:x86_64:Packages/a:aide-os-0.16-14.el8.x86_64.rpm'])
+        self.assertIn('/BaseOS/x86_64/kickstart', listed)
+        self.assertFalse([p for p in listed if '/debug' in p or '/kickstart/os' in p])
+
+    def test_map_target_no_trailing_slash(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self._create_tree(tmp, ['repo.8/BaseOS/x86_64/all/Packages/a/aide-0.16-14.el8.x86_64.rpm'])
+            mapped = mt.map_target(os.path.join(tmp, 'repo.8'), self._mapping_args())
+        elem = mapped['BaseOS:x86_64:Packages/a:aide-0.16-14.el8.x86_64.rpm']
+        self.assertEqual(elem['elem_rel'], 'BaseOS/x86_64/all/Packages/a')
+        self.assertEqual(elem['elem_pkg'], 'Packages/a')
+
+    def test_map_target_inodes(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = 'BaseOS/x86_64/all/Packages/a/aide-0.16-14.el8.x86_64.rpm'
+            self._create_tree(tmp, [path])
+            mapped = mt.map_target(tmp + '/', self._mapping_args())
+            directory = mapped['BaseOS:x86_64:Packages/a:aide-0.16-14.el8.x86_64.rpm'].directory
+            self.assertEqual(mapped.inode(directory, 'aide-0.16-14.el8.x86_64.rpm'),
+                             os.stat(os.path.join(tmp, path)).st_ino)
+
+    @patch('composer.mapcache.RACY_NS', -10 ** 9)
+    def test_map_target_cache(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            target = os.path.join(tmp, 'repo') + '/'
+            self._create_tree(target, ['BaseOS/x86_64/all/Packages/a/aide-0.16-14.el8.x86_64.rpm',
+                                       'BaseOS/x86_64/all/Packages/b/bash-4.4.20-4.el8.x86_64.rpm',
+                                       'BaseOS/x86_64/os/Packages/a/aide-0.16-14.el8.x86_64.rpm'])
+            args = self._mapping_args(map_cache=os.path.join(tmp, 'cache.json'))
+            first = mt.map_target(target, args)
+            with patch('os.scandir', wraps=os.scandir) as scandir_mock:
+                self.assertEqual(mt.map_target(target, args), first)
+            self.assertEqual(scandir_mock.call_count, 0)
+            self._create_tree(target, ['BaseOS/x86_64/all/Packages/a/acl-2.2.53-1.el8.x86_64.rpm'])
+            with patch('os.scandir', wraps=os.scandir) as scandir_mock:
+                mapped = mt.map_target(target, args)
+            scandir_mock.assert_called_once_with(os.path.join(target, 'BaseOS/x86_64/all/Packages/a'))
+            self.assertEqual(set(mapped) - set(first), {'BaseOS:x86_64:Packages/a:acl-2.2.53-1.el8.x86_64.rpm'})
+            args.full_rescan = True
+            with patch('os.scandir', wraps=os.scandir) as scandir_mock:
+                self.assertEqual(mt.map_target(target, args), mapped)
+            self.assertEqual(scandir_mock.call_count, 7)
@@ -0,0 +1,65 @@
+import email.message
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import composer.remotecache as rc
+
+
+class TestRemoteCache(unittest.TestCase):
+
+    def _headers(self, **kwargs):
+        headers = email.message.Message()
+        for name, value in kwargs.items():
+            headers[name.replace('_', '-')] = value
+        return headers
+
+    def test_conditions(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            cache = rc.ListingCache(os.path.join(tmp, 'listings.json'))
+            cache.entries = {'http://r/a/': ('"1"', 'Mon, 01 Jan 2024 00:00:00 GMT', ['a.rpm']),
+                             'http://r/b/': (None, 'Mon, 01 Jan 2024 00:00:00 GMT', ['b.rpm'])}
+            self.assertEqual(cache.conditions('http://r/a/'), {'If-None-Match': '"1"',
+                                                               'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+            self.assertEqual(cache.conditions('http://r/b/'), {'If-Modified-Since': 'Mon, 01 Jan 2024 00:00:00 GMT'})
+            self.assertEqual(cache.conditions('http://r/c/'), {})
+            self.assertEqual(cache.lookup('http://r/a/'), ['a.rpm'])
+            self.assertIsNone(cache.lookup('http://r/c/'))
+            cache.full_rescan = True
+            self.assertEqual(cache.conditions('http://r/a/'), {})
+            self.assertIsNone(cache.lookup('http://r/a/'))
+
+    def test_save_load(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'listings.json')
+            cache = rc.ListingCache(filename)
+            cache.crawl('http://r/')
+            cache.store('http://r/', self._headers(ETag='"1"'), ['a/', 'b/'])
+            cache.store('http://r/a/', self._headers(Last_Modified='Mon, 01 Jan 2024 00:00:00 GMT'), ['a.rpm'])
+            cache.store('http://r/b/', self._headers(), ['b.rpm'])  # no validators - not cached
+            cache.crawl('http://other/')
+            cache.store('http://other/', self._headers(ETag='"2"'), [])
+            cache.save()
+            loaded = rc.ListingCache(filename)
+            self.assertEqual(loaded.entries, {'http://r/': ('"1"', None, ['a/', 'b/']),
+                                              'http://r/a/': (None, 'Mon, 01 Jan 2024 00:00:00 GMT', ['a.rpm']),
+                                              'http://other/': ('"2"', None, [])})
+            loaded.crawl('http://r/')
+            self.assertEqual(loaded.reuse('http://r/'), ['a/', 'b/'])  # http://r/a/ is gone
+            loaded.save()
+            self.assertEqual(sorted(rc.ListingCache(filename).entries), ['http://other/', 'http://r/'])
+            unchanged = rc.ListingCache(filename)
+            unchanged.crawl('http://other/')
+            unchanged.reuse('http://other/')
+            with patch('os.replace') as replace_mock:
+                unchanged.save()
+            replace_mock.assert_not_called()
+
+    def test_unreadable(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as cache_file:
+            cache_file.write('{"version": 1, "listings": {"http://r/": 1}}')
+            cache_file.flush()
+            with patch('logging.warning') as warning_mock:
+                self.assertEqual(rc.ListingCache(cache_file.name).entries, {})
+            warning_mock.assert_called_once()
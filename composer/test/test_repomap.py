@@ -0,0 +1,96 @@
+import unittest
+
+from composer.repomap import RepoDir, RepoElem, RepoMap
+
+
+class TestRepoMap(unittest.TestCase):
+
+    mocked_dict = {
+                    "AppStream:x86_64:Packages/a:aide-0.16-11.el8.x86_64.rpm": {
+                      "elem_name": "aide-0.16-11.el8.x86_64.rpm",
+                      "elem_abs": "/model/eurolinux8",
+                      "elem_path": "/model/eurolinux8/AppStream/x86_64/" +
+                                   "all/Packages/a/aide-0.16-11.el8.x86_64.rpm",
+                      "elem_arch": "x86_64",
+                      "elem_repo": "AppStream",
+                      "elem_base": "model/eurolinux8/",
+                      "elem_rel": "AppStream/x86_64/all/Packages/a",
+                      "elem_pkg": "Packages/a"
+                    },
+                    "AppStream:x86_64:Packages/a:aide-0.16-14.el8.x86_64.rpm": {
+                      "elem_name": "aide-0.16-14.el8.x86_64.rpm",
+                      "elem_abs": "/model/eurolinux8",
+                      "elem_path": "/model/eurolinux8/AppStream/x86_64/" +
+                                   "all/Packages/a/aide-0.16-14.el8.x86_64.rpm",
+                      "elem_arch": "x86_64",
+                      "elem_repo": "AppStream",
+                      "elem_base": "model/eurolinux8/",
+                      "elem_rel": "AppStream/x86_64/all/Packages/a",
+                      "elem_pkg": "Packages/a"
+                    }
+                  }
+
+    def _directory(self):
+        return RepoDir('/model/eurolinux8', 'model/eurolinux8/', '/model/eurolinux8/AppStream/x86_64/all/Packages/a',
+                       'AppStream', 'x86_64', 'AppStream/x86_64/all/Packages/a', 'Packages/a')
+
+    def test_add(self):
+        repo_map = RepoMap()
+        directory = self._directory()
+        key = repo_map.add(directory, 'aide-0.16-11.el8.x86_64.rpm')
+        repo_map.add(directory, 'aide-0.16-14.el8.x86_64.rpm')
+        self.assertEqual(key, 'AppStream:x86_64:Packages/a:aide-0.16-11.el8.x86_64.rpm')
+        self.assertEqual(len(repo_map), 2)
+        self.assertEqual(repo_map[key]['elem_path'],
+                         '/model/eurolinux8/AppStream/x86_64/all/Packages/a/aide-0.16-11.el8.x86_64.rpm')
+        self.assertEqual(repo_map[key].elem_repo, 'AppStream')
+        self.assertEqual(repo_map, self.mocked_dict)
+        self.assertEqual(repo_map.to_dict(), self.mocked_dict)
+
+    def test_elem_unknown_field(self):
+        elem = RepoElem(self._directory(), 'aide-0.16-11.el8.x86_64.rpm')
+        with self.assertRaises(KeyError):
+            elem['directory']
+        self.assertIsNone(elem.get('directory'))
+
+    def test_update_keeps_order(self):
+        first = RepoMap.from_dict(self.mocked_dict)
+        second = RepoMap()
+        second.add(self._directory(), 'aide-0.16-11.el8.x86_64.rpm')
+        second.add(self._directory(), 'amanda-3.5.1-13.el8.x86_64.rpm')
+        first.update(second)
+        amanda = 'AppStream:x86_64:Packages/a:amanda-3.5.1-13.el8.x86_64.rpm'
+        self.assertEqual(list(first), list(self.mocked_dict) + [amanda])
+
+    def test_from_dict(self):
+        repo_map = RepoMap.from_dict(self.mocked_dict)
+        self.assertEqual(repo_map.to_dict(), self.mocked_dict)
+        self.assertEqual(list(repo_map), list(self.mocked_dict))
+
+    def test_from_dict_custom_key(self):
+        elem = self.mocked_dict['AppStream:x86_64:Packages/a:aide-0.16-11.el8.x86_64.rpm']
+        repo_map = RepoMap.from_dict({'aide': elem})
+        self.assertEqual(repo_map['aide'], elem)
+
+    def test_from_dict_inconsistent(self):
+        elem = dict(self.mocked_dict['AppStream:x86_64:Packages/a:aide-0.16-11.el8.x86_64.rpm'])
+        elem['elem_name'] = 'aide.rpm'
+        with self.assertRaises(ValueError):
+            RepoMap.from_dict({'aide': elem})
+
+    def test_inode(self):
+        repo_map = RepoMap()
+        directory = self._directory()
+        other = RepoDir('/model/eurolinux8', 'model/eurolinux8/', '/model/eurolinux8/AppStream/x86_64/os/Packages/a',
+                        'AppStream', 'x86_64', 'AppStream/x86_64/os/Packages/a', 'Packages/a')
+        repo_map.add(directory, 'aide-0.16-11.el8.x86_64.rpm', 11)
+        repo_map.add(directory, 'aide-0.16-14.el8.x86_64.rpm', 14)
+        repo_map.add(other, 'aide-0.16-14.el8.x86_64.rpm')
+        self.assertEqual(repo_map.inode(directory, 'aide-0.16-11.el8.x86_64.rpm'), 11)
+        self.assertIsNone(repo_map.inode(directory, 'aide-0.16-14.el8.x86_64.rpm'))
+        self.assertIsNone(repo_map.inode(other, 'aide-0.16-14.el8.x86_64.rpm'))
+        self.assertEqual(repo_map.directories(), {directory, other})
+        updated = RepoMap.from_dict(self.mocked_dict)
+        updated.update(repo_map)
+        self.assertEqual(updated.inode(directory, 'aide-0.16-11.el8.x86_64.rpm'), 11)
+        self.assertIsNone(RepoMap.from_dict(self.mocked_dict).inode(directory, 'aide-0.16-11.el8.x86_64.rpm'))
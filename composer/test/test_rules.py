@@ -1,9 +1,13 @@
+import os
 import json
+import tempfile
 import unittest
 import argparse
 from unittest.mock import patch, mock_open
 
+import composer.mapfile as mapfile
 import composer.rules as r
+from composer.repomap import RepoDir, RepoMap
 
 
 class TestRules(unittest.TestCase):
@@ -57,6 +61,25 @@ class TestRules(unittest.TestCase):
                           }
                     }
 
+    def _fake_map_targets(self, maps):
+        def map_targets(targets, args, classifiers=()):
+            for mapped, target_classifiers in zip(maps, classifiers):
+                for classifier in target_classifiers:
+                    for elem in mapped.values():
+                        classifier.results += classifier.classify(elem.directory, [elem.elem_name])
+            return maps
+        return map_targets
+
+    def test_debug_package_moves(self):
+        mapped = RepoMap.from_dict(self.mocked_dest)
+        moves = r.DebugPackageMoves('/all/', '/debug/')
+        directory = mapped['BaseOS:x86_64:Packages/a:aide-debuginfo-0.16-14.el8_5.1.x86_64.rpm'].directory
+        names = ['aide-0.16-14.el8_5.1.x86_64.rpm', 'aide-debuginfo-0.16-14.el8_5.1.x86_64.rpm',
+                 'aide-debugsource-0.16-14.el8_5.1.x86_64.rpm']
+        self.assertEqual(moves.classify(directory, names),
+                         r.create_move_commands_for_debug_packages(self.mocked_dest, '/all/', '/debug/'))
+        self.assertEqual(r.DebugPackageMoves('/os/', '/debug/').classify(directory, names), [])
+
     def test_create_move_commands_for_debug_packages(self):
         result = r.create_move_commands_for_debug_packages(self.mocked_dest, '/all/', '/debug/')
         print(result)
@@ -69,7 +92,7 @@ class TestRules(unittest.TestCase):
                                    '/model/eurolinux8/BaseOS/x86_64/debug/Packages/' +
                                    'a/aide-debugsource-0.16-14.el8_5.1.x86_64.rpm')])
 
-    @patch('composer.maptarget.map_target')
+    @patch('composer.maptarget.map_targets')
     @patch('composer.rules._append_rule')
     def test_create_ruleset(self, append_rule_mock, maptarget_mock):
         args = argparse.Namespace(src_repo='/model/redhat8',
@@ -88,7 +111,7 @@ class TestRules(unittest.TestCase):
                                          'a/aide-0.16-11.el8.x86_64.rpm',
                                          '/model/eurolinux8/AppStream/x86_64/os/Packages/' +
                                          'a/aide-0.16-11.el8.x86_64.rpm')
-        maptarget_mock.side_effect = [self.mocked_source, self.mocked_dest]
+        maptarget_mock.side_effect = self._fake_map_targets([self.mocked_source, RepoMap.from_dict(self.mocked_dest)])
         ret = r.create_ruleset(args)
         print(ret)
         self.assertDictEqual(ret, {'mkdir': [],
@@ -106,6 +129,123 @@ class TestRules(unittest.TestCase):
                                            'a/aide-0.16-11.el8.x86_64.rpm')]
                                    })
 
+    @patch('composer.maptarget.check_stamp')
+    @patch('composer.maptarget.map_target')
+    @patch('composer.maptarget.map_targets')
+    def test_create_ruleset_src_map(self, map_targets_mock, map_target_mock, check_stamp_mock):
+        args = argparse.Namespace(src_repo=None, dst_repo='/model/eurolinux8', move_debug=False, all_dir='/all/',
+                                  archs=['x86_64'], repo_priority=['AppStream'], os_dir='/os/', replacements=None,
+                                  custom_rules_file=None)
+        source, dest = RepoMap.from_dict(self.mocked_source), RepoMap.from_dict(self.mocked_dest)
+        map_targets_mock.return_value = [source, dest]
+        expected = r.create_ruleset(argparse.Namespace(**dict(vars(args), src_repo='/model/redhat8')))
+        self.assertEqual(len(expected['ln']), 1)
+        map_targets_mock.reset_mock()
+        map_target_mock.return_value = dest
+        stamp = {'target': '/model/redhat8', 'settings': {}, 'mtimes': {'': 1}}
+        with tempfile.TemporaryDirectory() as tmp:
+            for filename in 'src.idx', 'src.ndjson':
+                with self.subTest(filename=filename):
+                    args.src_map = os.path.join(tmp, filename)
+                    entries = [(elem.directory, [(elem.elem_name, 0)]) for elem in source.values()]
+                    mapfile.save_map(entries, args.src_map, stamp=stamp)
+                    check_stamp_mock.return_value = None
+                    self.assertEqual(r.create_ruleset(args), expected)
+                    map_target_mock.assert_called_with('/model/eurolinux8', args, [])
+                    map_targets_mock.assert_not_called()
+                    check_stamp_mock.return_value = '/model/redhat8 has been modified'
+                    self.assertEqual(r.create_ruleset(args), expected)
+                    map_targets_mock.assert_called_once_with(['/model/redhat8', '/model/eurolinux8'], args, [[], []])
+                    map_targets_mock.reset_mock()
+            args.src_map = os.path.join(tmp, 'src.json')
+            mapfile.save_map([], args.src_map, stamp=stamp)
+            with self.assertRaises(ValueError):
+                r.create_ruleset(args)
+
+    @patch('composer.maptarget.check_stamp', return_value=None)
+    @patch('composer.maptarget.map_target')
+    def test_create_ruleset_src_map_closed(self, map_target_mock, check_stamp_mock):
+        args = argparse.Namespace(src_repo=None, dst_repo='/model/eurolinux8', move_debug=False, all_dir='/all/',
+                                  archs=['x86_64'], repo_priority=['AppStream'], os_dir='/os/', replacements=None,
+                                  custom_rules_file=None)
+        source, dest = RepoMap.from_dict(self.mocked_source), RepoMap.from_dict(self.mocked_dest)
+        stamp = {'target': '/model/redhat8', 'settings': {}, 'mtimes': {'': 1}}
+        opened = []
+        open_map = mapfile.open_map
+
+        def open_and_keep(filename):
+            opened.append(open_map(filename))
+            return opened[-1]
+
+        with tempfile.TemporaryDirectory() as tmp:
+            args.src_map = os.path.join(tmp, 'src.idx')
+            mapfile.save_map([(elem.directory, [(elem.elem_name, 0)]) for elem in source.values()], args.src_map,
+                             stamp=stamp)
+            with patch('composer.mapfile.open_map', side_effect=open_and_keep):
+                for dst_result, link_error in [(RepoMap(), None), (OSError('failed'), None), (dest, OSError('failed'))]:
+                    with self.subTest(dst_result=dst_result, link_error=link_error):
+                        map_target_mock.side_effect = [dst_result]
+                        with patch('composer.rules.create_link_commands', side_effect=link_error):
+                            if isinstance(dst_result, Exception) or link_error:
+                                with self.assertRaises(OSError):
+                                    r.create_ruleset(args)
+                            else:
+                                self.assertEqual(r.create_ruleset(args), {'mkdir': [], 'mv': [], 'ln': []})
+                        self.assertTrue(opened[-1]._mmap.closed)
+        self.assertEqual(len(opened), 3)
+
+    @patch('composer.mapremote.map_remote')
+    @patch('composer.maptarget.map_target')
+    @patch('composer.maptarget.map_targets')
+    def test_create_ruleset_remote_src(self, map_targets_mock, map_target_mock, map_remote_mock):
+        args = argparse.Namespace(src_repo='/model/redhat8', dst_repo='/model/eurolinux8', move_debug=False,
+                                  all_dir='/all/', archs=['x86_64'], repo_priority=['AppStream'], os_dir='/os/',
+                                  replacements=None, custom_rules_file=None)
+        source, dest = RepoMap.from_dict(self.mocked_source), RepoMap.from_dict(self.mocked_dest)
+        map_targets_mock.return_value = [source, dest]
+        expected = r.create_ruleset(args)
+        map_targets_mock.reset_mock()
+        map_remote_mock.return_value, map_target_mock.return_value = source, dest
+        for url in 'https://mirror/redhat8/', 'file:///model/redhat8':
+            with self.subTest(url=url):
+                args.src_repo = url
+                self.assertEqual(r.create_ruleset(args), expected)
+                map_remote_mock.assert_called_with(url, args)
+                map_target_mock.assert_called_with('/model/eurolinux8', args, [])
+                map_targets_mock.assert_not_called()
+
+    def test_diff_rules(self):
+        previous = {'mkdir': ['/r/os/a'],
+                    'mv': [['/r/all/a/a-debuginfo.rpm', '/r/debug/a/a-debuginfo.rpm']],
+                    'ln': [['/r/all/a/a.rpm', '/r/os/a/a.rpm'],
+                           ['/r/all/a/b-1.rpm', '/r/os/a/b.rpm'],
+                           ['/r/all/a/c.rpm', '/r/os/a/c.rpm'],
+                           ['/r/all/a/c.rpm', '/r/os/a/c.rpm']]}
+        current = {'mkdir': [],
+                   'mv': [('/r/all/a/a-debuginfo.rpm', '/r/debug/a/a-debuginfo.rpm'),
+                          ('/r/all/a/d-debuginfo.rpm', '/r/debug/a/d-debuginfo.rpm')],
+                   'ln': [('/r/all/a/a.rpm', '/r/os/a/a.rpm'),
+                          ('/r/all/a/b-2.rpm', '/r/os/a/b.rpm'),
+                          ('/r/all/a/e.rpm', '/r/os/a/e.rpm')]}
+        self.assertDictEqual(r.diff_rules(previous, current),
+                             {'mkdir': [],
+                              'mv': [('/r/all/a/d-debuginfo.rpm', '/r/debug/a/d-debuginfo.rpm')],
+                              'ln': [('/r/all/a/b-2.rpm', '/r/os/a/b.rpm'), ('/r/all/a/e.rpm', '/r/os/a/e.rpm')],
+                              'rm': [('/r/all/a/c.rpm', '/r/os/a/c.rpm')]})
+
+    @patch('composer.maptarget.map_targets')
+    def test_create_delta_ruleset_empty_map(self, maptarget_mock):
+        args = argparse.Namespace(src_repo='/model/redhat8', dst_repo='/model/eurolinux8')
+        previous = {'mkdir': [], 'mv': [], 'ln': [('/r/all/a/a.rpm', '/r/os/a/a.rpm')]}
+        maptarget_mock.return_value = [self.mocked_source, RepoMap()]
+        self.assertEqual(r.create_delta_ruleset(args, previous),
+                         ({'mkdir': [], 'mv': [], 'ln': [], 'rm': []}, previous))
+
+    def test_load_previous_rules_missing(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            self.assertEqual(r.load_previous_rules(os.path.join(tmp, 'rules.json')),
+                             {'mkdir': [], 'mv': [], 'ln': []})
+
     @patch('composer.rules._append_custom_rules_json')
     @patch('composer.rules._append_custom_rules_short')
     def test_append_custom_rules_json_route(self, short_mock, json_mock):
@@ -162,3 +302,73 @@ class TestRules(unittest.TestCase):
                              'Packages/a:aide-0.16-11.el8.x86_64.rpm',
                              'AppStream', 'aarch', '/all/', '/os/', {'CodeReady': 'PowerTools'})
         self.assertIsNone(cmd)
+
+    def test_create_link_commands(self):
+        args = argparse.Namespace(archs=['x86_64', 'noarch'], repo_priority=['BaseOS', 'AppStream'],
+                                  all_dir='/all/', os_dir='/os/', replacements=None)
+        mocked_dest = dict(self.mocked_dest)
+        base_elem = dict(mocked_dest['AppStream:x86_64:Packages/a:aide-0.16-11.el8.x86_64.rpm'])
+        base_elem.update({'elem_path': base_elem['elem_path'].replace('AppStream', 'BaseOS'),
+                          'elem_rel': base_elem['elem_rel'].replace('AppStream', 'BaseOS'),
+                          'elem_repo': 'BaseOS'})
+        mocked_dest['BaseOS:noarch:Packages/a:aide-0.16-11.el8.x86_64.rpm'] = base_elem
+        ret = r.create_link_commands(self.mocked_source, mocked_dest, args)
+        self.assertEqual(ret, [('/model/eurolinux8/AppStream/x86_64/all/Packages/a/aide-0.16-11.el8.x86_64.rpm',
+                                '/model/eurolinux8/AppStream/x86_64/os/Packages/a/aide-0.16-11.el8.x86_64.rpm')])
+        del mocked_dest['AppStream:x86_64:Packages/a:aide-0.16-11.el8.x86_64.rpm']
+        ret = r.create_link_commands(self.mocked_source, mocked_dest, args)
+        self.assertEqual(ret, [('/model/eurolinux8/BaseOS/x86_64/all/Packages/a/aide-0.16-11.el8.x86_64.rpm',
+                                '/model/eurolinux8/AppStream/x86_64/os/Packages/a/aide-0.16-11.el8.x86_64.rpm')])
+
+    def test_index_by_variable_key(self):
+        index = r._index_by_variable_key(self.mocked_dest, ['BaseOS', 'AppStream'])
+        self.assertEqual(index, {'Packages/a:aide-0.16-11.el8.x86_64.rpm': {'x86_64': 'AppStream'},
+                                 'Packages/a:aide-debuginfo-0.16-14.el8_5.1.x86_64.rpm': {'x86_64': 'BaseOS'},
+                                 'Packages/a:aide-debugsource-0.16-14.el8_5.1.x86_64.rpm': {'x86_64': 'BaseOS'}})
+        self.assertEqual(r._index_by_variable_key(self.mocked_dest, ['BaseOS']),
+                         {'Packages/a:aide-debuginfo-0.16-14.el8_5.1.x86_64.rpm': {'x86_64': 'BaseOS'},
+                          'Packages/a:aide-debugsource-0.16-14.el8_5.1.x86_64.rpm': {'x86_64': 'BaseOS'}})
+
+    def test_literal_prefix(self):
+        self.assertEqual(r._literal_prefix('aide-0.*'), 'aide-0')
+        self.assertEqual(r._literal_prefix('el-logos?-8'), 'el-logo')
+        self.assertEqual(r._literal_prefix('el-logos+-8'), 'el-logos')
+        self.assertEqual(r._literal_prefix('(aide|amanda)'), '')
+        self.assertEqual(r._literal_prefix('aide'), 'aide')
+
+    def test_custom_rule_index(self):
+        index = r._CustomRuleIndex(self.mocked_dest, '/all/')
+        debuginfo = self.mocked_dest['BaseOS:x86_64:Packages/a:aide-debuginfo-0.16-14.el8_5.1.x86_64.rpm']
+        debugsource = self.mocked_dest['BaseOS:x86_64:Packages/a:aide-debugsource-0.16-14.el8_5.1.x86_64.rpm']
+        self.assertEqual(index.matches('BaseOS:x86_64', '.*?', 'aide-debug.*'), [debuginfo, debugsource])
+        self.assertEqual(index.matches('Base.*:[^i].*', '.*?', 'aide-debugs'), [debugsource])
+        self.assertEqual(index.matches('BaseOS:x86_64', '.*', '(amanda|aide-debugi)'), [debuginfo])
+        self.assertEqual(index.matches('BaseOS:x86_64', '.*', 'amanda|BaseOS:.*:aide-debugi'), [debuginfo])
+        self.assertEqual(index.matches('BaseOS', '.*', '.*source'), [debugsource])
+        self.assertEqual(index.matches('AppStream:x86_64', '.*?', 'aide-debug.*'), [])
+
+    def test_drop_existing_links(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            all_dir = os.path.join(tmp, 'BaseOS/x86_64/all/Packages/a')
+            os_dir = os.path.join(tmp, 'BaseOS/x86_64/os/Packages/a')
+            os.makedirs(all_dir)
+            os.makedirs(os_dir)
+            names = ['a1.rpm', 'a2.rpm', 'a3.rpm', 'a4.rpm', 'a5-debuginfo.rpm']
+            for name in names:
+                open(os.path.join(all_dir, name), 'w').close()
+            os.link(os.path.join(all_dir, 'a1.rpm'), os.path.join(os_dir, 'a1.rpm'))
+            os.link(os.path.join(all_dir, 'a1.rpm'), os.path.join(os_dir, 'a2.rpm'))
+            os.link(os.path.join(all_dir, 'a5-debuginfo.rpm'), os.path.join(os_dir, 'a5-debuginfo.rpm'))
+            repo = RepoMap()
+            directory = RepoDir(tmp, tmp + '/', all_dir, 'BaseOS', 'x86_64', 'BaseOS/x86_64/all/Packages/a',
+                                'Packages/a')
+            for name in names:
+                if name != 'a4.rpm':
+                    repo.add(directory, name, os.stat(os.path.join(all_dir, name)).st_ino)
+            links = [(os.path.join(all_dir, name), os.path.join(os_dir, name)) for name in names]
+            moves = [(links[-1][0], os.path.join(tmp, 'BaseOS/x86_64/debug/Packages/a/a5-debuginfo.rpm'))]
+            for threads in 1, 4:
+                with self.subTest(threads=threads):
+                    # a1 already linked, a2 links something else, a3 missing, a4 not in map, a5 moved
+                    self.assertEqual(r.drop_existing_links(links, repo, moves, threads), links[1:])
+                    self.assertEqual(r.drop_existing_links(links, repo, [], threads), links[1:-1])
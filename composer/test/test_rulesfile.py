@@ -0,0 +1,68 @@
+import os
+import tempfile
+import unittest
+
+import composer.rulesfile as rf
+
+
+class TestRulesFile(unittest.TestCase):
+
+    cmds = {'mkdir': ['/r/BaseOS/x86_64/os/Packages/a', '/r/BaseOS/x86_64/debug/Packages/a'],
+            'mv': [('/r/BaseOS/x86_64/all/Packages/a/a-debuginfo.rpm',
+                    '/r/BaseOS/x86_64/debug/Packages/a/a-debuginfo.rpm')],
+            'ln': [('/r/BaseOS/x86_64/all/Packages/a/a.rpm', '/r/BaseOS/x86_64/os/Packages/a/a.rpm'),
+                   ('/r/AppStream/x86_64/all/Packages/a/a.rpm', '/r/AppStream/x86_64/os/Packages/a/a.rpm'),
+                   ('relative.rpm', '/r/\udcffnot-utf8/'),
+                   ('', '/')]}
+
+    def test_pack_roundtrip(self):
+        self.assertEqual(rf.unpack(rf.pack(self.cmds)), self.cmds)
+        delta = dict(self.cmds, rm=[('/r/BaseOS/x86_64/all/Packages/b/b.rpm', '/r/BaseOS/x86_64/os/Packages/b/b.rpm')])
+        self.assertEqual(rf.unpack(rf.pack(delta)), delta)
+        empty = {'mkdir': [], 'mv': [], 'ln': [], 'rm': []}
+        self.assertEqual(rf.unpack(rf.pack(empty)), empty)
+
+    def test_pack_shares_prefixes(self):
+        links = [(f'/srv/mirror/all/Packages/a/a{i}.rpm', f'/srv/mirror/os/Packages/a/a{i}.rpm') for i in range(100)]
+        data = rf.pack({'mkdir': [], 'mv': [], 'ln': links})
+        self.assertEqual(data.count(b'/srv/mirror/all/Packages/a/'), 1)
+        self.assertEqual(data.count(b'a99.rpm'), 1)
+
+    def test_unpack_invalid(self):
+        data = rf.pack(self.cmds)
+        for invalid in b'{"mkdir": []}', data[:-1], data + b'\0':
+            with self.subTest(invalid=invalid[:16]), self.assertRaises(ValueError):
+                rf.unpack(invalid)
+
+    def test_save_load_formats(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for filename, rules_format, packed in [('out.json', 'auto', False), ('out.rules', 'auto', False),
+                                                   ('out.packed', 'auto', True), ('out.json', 'packed', True),
+                                                   ('out.packed', 'json', False)]:
+                with self.subTest(filename=filename, rules_format=rules_format):
+                    path = os.path.join(tmp, filename)
+                    rf.save_rules(self.cmds, path, rules_format)
+                    with open(path, 'rb') as f:
+                        self.assertEqual(f.read(1) != b'{', packed)
+                    loaded = rf.load_rules(path)
+                    self.assertEqual(loaded['mkdir'], self.cmds['mkdir'])
+                    self.assertEqual([tuple(cmd) for cmd in loaded['ln']], self.cmds['ln'])
+
+    def test_ndjson(self):
+        delta = dict(self.cmds, rm=[('/r/BaseOS/x86_64/all/Packages/b/b.rpm', '/r/BaseOS/x86_64/os/Packages/b/b.rpm')])
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'out.ndjson')
+            rf.save_rules(delta, path)
+            self.assertEqual(rf.detect_format(path), 'ndjson')
+            with open(path) as f:
+                self.assertEqual(f.readline(), '["mkdir", "/r/BaseOS/x86_64/os/Packages/a"]\n')
+            self.assertEqual(list(rf.iter_commands(path)), list(rf.iter_ruleset(delta)))
+            self.assertEqual(rf.load_rules(path), delta)
+            rf.save_rules(delta, os.path.join(tmp, 'out.json'))
+            self.assertEqual(list(rf.iter_commands(os.path.join(tmp, 'out.json'))), list(rf.iter_ruleset(delta)))
+            for line in ('["ln", "/src"]', '["cp", "/src", "/dst"]', '{"mkdir": []}', '["ln", "/src", ',
+                         '["ln", "/a", "/b"], ["ln", "/c", "/d"]', ' , '):
+                with self.subTest(line=line), self.assertRaisesRegex(ValueError, 'out.ndjson:3'):
+                    with open(path, 'w') as f:
+                        f.write(f'["mkdir", "/r"]\n\n{line}\n')
+                    list(rf.iter_commands(path, 'ndjson'))